@@ -6,7 +6,7 @@ Created on Mon Nov 11 20:28:08 2019
 @author: Pak Shing Ho
 """
 
-import wrds
+from wrdsCache import CachedConnection # wrds.Connection() with a local cache of query results
 import pandas as pd
 import numpy as np
 from fuzzywuzzy import fuzz
@@ -14,7 +14,7 @@ from fuzzywuzzy import fuzz
 ###################
 # Connect to WRDS #
 ###################
-conn = wrds.Connection()
+conn = CachedConnection() # set WRDS_REPLAY=1 to run offline from the cache
 
 conn.describe_table(library="crsp", table="msf")
 conn.describe_table(library="crsp", table="msenames")
@@ -10,7 +10,7 @@ In KLD dataset, 'companyname'-'year' is the unique identifier as some 'cusip's a
 
 # to create a linking table between CRSP and KLD
 # Output is a score reflecting the quality of the link
-# Score = 0 (best link) to Score = 6 (worst link)
+# Score = 0 (best link) to Score = 7 (worst link)
 #
 # More explanation on score system:
 # - 0: BEST match: using (cusip, cusip dates and company names)
@@ -21,19 +21,64 @@ In KLD dataset, 'companyname'-'year' is the unique identifier as some 'cusip's a
 # - 4: tickers and 6-digit cusips match but company names do not match
 # - 5: tickers and company names match but 6-digit cusips do not match
 # - 6: tickers match but company names and 6-digit cusips do not match
+# - 7: no cusip or ticker match; name ratio >= MIN_NAME_RATIO against CRSP names
+#       with overlapping dates (only with NAME_LINK)
 
 """
 
-import wrds
+from wrdsCache import CachedConnection # wrds.Connection() with a local cache of query results
+from wrdsPool import warmCache # concurrent pulls into the cache
+from pipeline import KLD_SQL, CRSP_CUSIP_SQL, CRSP_TICKER_SQL # the queries below
+from frameSchema import compactFrame # compact dtypes right after each fetch
 import pandas as pd
-import numpy as np
-from fuzzywuzzy import fuzz
-from cusipCorrection import cusipCorrection
+from nameRatioCache import NameRatioCache # persistent store of name ratios from earlier runs
+from msfStream import mergeMsf # chunked crsp.msf merge
+from yearShards import mergeByYear # year by year merges over a process pool
+from kldCrspLink import cleanKld, addKldDates, kldCusipDates, crspCusipNames, crspTickerNames
+from kldCrspLink import cusipCandidates, tickerCandidates, nameCandidates, finalizeLinks # Steps 1-3 of the link
+from linkStore import LinkStore # versioned link table, updated incrementally
+from kldCompLink import alignKldDates # KLD dates of the msf merge
+from cusipCorrection import cusipCorrectionFast
+from stageMetrics import startRun, stage # per-stage timings, memory and row counts
+from frameFingerprint import sameRows # order-independent comparison of the linked frames
+
+# Set STAGE_METRICS=<folder> to write the timings, peak memory and row counts of
+# each stage of this run as JSON (see 'stageMetrics.py')
+startRun('KLD_CRSP_Link')
 
 ###################
 # Connect to WRDS #
 ###################
-conn = wrds.Connection()
+conn = CachedConnection() # set WRDS_REPLAY=1 to run offline from the cache
+
+# With PREFETCH_CONNECTIONS, the WRDS queries of this script are pulled into the
+# cache at the same time over that many connections (see 'wrdsPool.py'), instead
+# of one after another below. The cached results are the same as those pulled
+# one after another. 0: no prefetch.
+PREFETCH_CONNECTIONS = 0
+if PREFETCH_CONNECTIONS:
+    warmCache(conn, [KLD_SQL, CRSP_CUSIP_SQL, CRSP_TICKER_SQL], connections=PREFETCH_CONNECTIONS)
+
+# Set NAME_CACHE to a file (e.g. 'name_ratio_cache.sqlite') to re-use the name
+# ratios scored in earlier runs (see 'nameRatioCache.py')
+NAME_CACHE = None
+name_cache = NameRatioCache(NAME_CACHE) if NAME_CACHE else None
+
+# With INCREMENTAL_LINK, Steps 1-3 only re-link the KLD companies that are new or
+# changed since the latest link table saved in LINK_STORE (see 'linkStore.py'). The
+# link table is the same as a full rebuild.
+INCREMENTAL_LINK = False
+LINK_STORE = 'link_store'
+
+# With NAME_LINK, the KLD companies linked neither by CUSIP nor by TICKER are linked
+# to the closest CRSP names with overlapping dates (score 7, see 'nameIndex.py') if
+# their name ratio is at least MIN_NAME_RATIO. The name links are approximate: only
+# the top_k names closest by shared words are scored, so a CRSP name tied with the
+# best one, or scoring just above the cutoff (ratios of 90-92), can be missed.
+# Off by default: the score-7 links are rows the CUSIP and TICKER link table
+# does not have.
+NAME_LINK = False
+MIN_NAME_RATIO = 90
 
 #########################
 # Step 1: Link by CUSIP #
@@ -43,42 +88,20 @@ conn = wrds.Connection()
 _kld1 = conn.raw_sql("""
                      select ticker, cusip, companyname, year from kld.history
                      """)
+_kld1 = compactFrame(_kld1, 'kld.history')
 
 # Correct wrongly shifted CUSIP
-_kld1 = cusipCorrection(_kld1)
-
-# set 'NA', '0', '#N/A#' CUSIPs and tickers to missing values
-_kld2 = _kld1.copy()
-_kld2['cusip'].replace({'NA':None, '0':None, '#N/A':None}, inplace=True)
-_kld2['ticker'].replace({'NA':None, '#N/A':None}, inplace=True)
-
-# set 'companyname' to uppercase. This will allow more backfill and forwardfill observations
-_kld2['companyname'] = _kld2['companyname'].str.upper()
-_kld2['ticker'] = _kld2['ticker'].str.upper()
-
-# Back fill and forward fill missing CUSIPs. Can also try bfill ticker.
-_kld2['cusip'] = _kld2.groupby(['companyname'])['cusip'].bfill().ffill()
-_kld2['ticker'] = _kld2.groupby(['companyname'])['ticker'].bfill().ffill()
+_kld1 = cusipCorrectionFast(_kld1)
 
+# set 'NA', '0', '#N/A#' CUSIPs and tickers to missing values, uppercase
+# names and tickers, fill CUSIPs and tickers within each company
+_kld2 = cleanKld(_kld1)
 
 # Construct dates pre-2000, month is Aug; from 2001, monnth is Dec, all days are 31.
-_kld2['month'] = '12'
-_kld2['day'] = '31'
-_kld2.loc[_kld2.year<=2000, 'month'] = '08' # commented out this has no effect on linking KLD-CRSP but affects linking with CCM-Link
-_kld2.year = _kld2.year.astype(int).astype(str)
-_kld2['date'] = pd.to_datetime(_kld2[['year', 'month', 'day']]).dt.date
-_kld2.drop(columns=['month', 'day'], inplace=True)
-
-_kld2_date = _kld2.groupby(['companyname', 'cusip']).date.agg(['min', 'max'])\
-.reset_index().rename(columns={'min':'fdate', 'max':'ldate'})
+_kld2 = addKldDates(_kld2)
 
-# merge fdate ldate back to _kld2 data
-_kld3 = pd.merge(_kld2, _kld2_date, how='left', on =['companyname','cusip'])
-_kld3 = _kld3.sort_values(by=['companyname','cusip','date'])
-
-# keep only the most recent company name
-# determined by having date = ldate
-_kld3 = _kld3.loc[_kld3.date == _kld3.ldate].drop(['date'], axis=1)
+# keep only the most recent company name of each CUSIP, with its first and last dates
+_kld3 = kldCusipDates(_kld2)
 
 
 # 1.2 CRSP: Get all permno-ncusip combinations
@@ -87,79 +110,15 @@ _crsp1 = conn.raw_sql("""
                       from crsp.stocknames
                       where ncusip != ''
                       """)
+_crsp1 = compactFrame(_crsp1, 'crsp.stocknames')
 
-# first namedt
-_crsp1_fnamedt = _crsp1.groupby(['permno','ncusip']).namedt.min().reset_index()
-
-# last nameenddt
-_crsp1_lnameenddt = _crsp1.groupby(['permno','ncusip']).nameenddt.max().reset_index()
-
-# merge both
-_crsp1_dtrange = pd.merge(_crsp1_fnamedt, _crsp1_lnameenddt, \
-                          on = ['permno','ncusip'], how='inner')
-
-# replace namedt and nameenddt with the version from the dtrange
-_crsp1 = _crsp1.drop(['namedt'],axis=1).rename(columns={'nameenddt':'enddt'})
-_crsp2 = pd.merge(_crsp1, _crsp1_dtrange, on =['permno','ncusip'], how='inner')
-
-# keep only most recent company name
-_crsp2 = _crsp2.loc[_crsp2.enddt ==_crsp2.nameenddt].drop(['enddt'], axis=1)
-
-
-# 1.3 Create CUSIP Link Table
-
-# Link by full cusip, company names and dates
-_link1_1 = pd.merge(_kld3, _crsp2, how='inner', left_on='cusip', right_on='ncusip')\
-.sort_values(['companyname','permno','ldate'])
-
-# Keep link with most recent company name
-_link1_1_tmp = _link1_1.groupby(['companyname','permno']).ldate.max().reset_index()
-_link1_2 = pd.merge(_link1_1, _link1_1_tmp, how='inner', on =['companyname', 'permno', 'ldate'])
-
-# Calculate name matching ratio using FuzzyWuzzy
+# first namedt and last nameenddt of each PERMNO-NCUSIP, on the most recent company name
+_crsp2 = crspCusipNames(_crsp1)
 
-# Note: fuzz ratio = 100 -> match perfectly
-#       fuzz ratio = 0   -> do not match at all
 
-# Comment: token_set_ratio is more flexible in matching the strings:
-# fuzz.token_set_ratio('AMAZON.COM INC',  'AMAZON COM INC')
-# returns value of 100
-
-# fuzz.ratio('AMAZON.COM INC',  'AMAZON COM INC')
-# returns value of 93
-
-_link1_2['name_ratio'] = _link1_2.apply(lambda x: fuzz.token_set_ratio(x.comnam, x.companyname), axis=1)
-
-# Note on parameters:
-# The following parameters are chosen to mimic the SAS macro %iclink
-# In %iclink, name_dist < 30 is assigned score = 0
-# where name_dist=30 is roughly 90% percentile in total distribution
-# and higher name_dist means more different names.
-# In name_ratio, I mimic this by choosing 10% percentile as cutoff to assign
-# score = 0
-
-# 10% percentile of the company name distance
-name_ratio_p10 = _link1_2.name_ratio.quantile(0.10)
-
-# Function to assign score for companies matched by:
-# full cusip and passing name_ratio
-# or meeting date range requirement
-
-def score1(row):
-    if (row['fdate']<=row['nameenddt']) & (row['ldate']>=row['namedt']) & (row['name_ratio'] >= name_ratio_p10):
-        score = 0
-    elif (row['fdate']<=row['nameenddt']) & (row['ldate']>=row['namedt']):
-        score = 1
-    elif row['name_ratio'] >= name_ratio_p10:
-        score = 2
-    else:
-        score = 3
-    return score
-
-# assign size portfolio
-_link1_2['score']=_link1_2.apply(score1, axis=1)
-_link1_2 = _link1_2[['cusip_x', 'ticker','permno','companyname','comnam','name_ratio','score']].rename(columns={'cusip_x':'cusip'})
-_link1_2 = _link1_2.drop_duplicates()
+# 1.3 Create CUSIP Link Table (see 'kldCrspLink.py')
+if not INCREMENTAL_LINK:
+    _link1_2 = cusipCandidates(_kld3, _crsp2, name_cache=name_cache)
 
 
 ##########################
@@ -168,87 +127,18 @@ _link1_2 = _link1_2.drop_duplicates()
 
 # Find links for the remaining unmatched cases using Exchange Ticker 
 
-# Identify remaining unmatched cases 
-_nomatch1 = pd.merge(_kld3[['companyname']], _link1_2[['permno','companyname']], on='companyname', how='left')
-_nomatch1 = _nomatch1.loc[_nomatch1.permno.isnull()].drop(['permno'], axis=1).drop_duplicates()
-
-# Add KLD identifying information
-kldid = _kld2
-kldid = kldid.loc[kldid.companyname.notna()]
-
-_nomatch2 = pd.merge(_nomatch1, kldid, how='inner', on=['companyname'])
-
-# Create first and last 'start dates' for Exchange Tickers
-# Label date range variables and keep only most recent company name
-
-_nomatch3 = _nomatch2.groupby(['companyname', 'ticker']).date.agg(['min', 'max'])\
-.reset_index().rename(columns={'min':'fdate', 'max':'ldate'})
-
-_nomatch3 = pd.merge(_nomatch2, _nomatch3, how='left', on=['companyname','ticker'])
-
-_nomatch3 = _nomatch3.loc[_nomatch3.date == _nomatch3.ldate]
-
 # Get entire list of CRSP stocks with Exchange Ticker information
 
 _crsp_n1 = conn.raw_sql(""" select ticker, comnam, permno, ncusip, namedt, nameenddt
                             from crsp.stocknames """)
-
-_crsp_n1 = _crsp_n1.loc[_crsp_n1.ticker.notna()].sort_values(by=['permno','ticker','namedt'])
+_crsp_n1 = compactFrame(_crsp_n1, 'crsp.stocknames')
 
 # Arrange effective dates for link by Exchange Ticker
+_crsp_n2 = crspTickerNames(_crsp_n1)
 
-_crsp_n1_namedt = _crsp_n1.groupby(['permno','ticker']).namedt.min().reset_index().rename(columns={'min':'namedt'})
-_crsp_n1_nameenddt = _crsp_n1.groupby(['permno','ticker']).nameenddt.max().reset_index().rename(columns={'max':'nameenddt'})
-
-_crsp_n1_dt = pd.merge(_crsp_n1_namedt, _crsp_n1_nameenddt, how = 'inner', on=['permno','ticker'])
-
-_crsp_n1 = _crsp_n1.rename(columns={'namedt': 'namedt_ind', 'nameenddt':'nameenddt_ind'})
-
-_crsp_n2 = pd.merge(_crsp_n1, _crsp_n1_dt, how ='left', on = ['permno','ticker'])
-
-_crsp_n2 = _crsp_n2.rename(columns={'ticker':'crsp_ticker'})
-_crsp_n2 = _crsp_n2.loc[_crsp_n2.nameenddt_ind == _crsp_n2.nameenddt].drop(['namedt_ind', 'nameenddt_ind'], axis=1)
-
-# Merge remaining unmatched cases using Exchange Ticker 
-# Note: Use ticker date ranges as exchange tickers are reused overtime
-
-_link2_1 = pd.merge(_nomatch3, _crsp_n2, how='inner', left_on=['ticker'], right_on=['crsp_ticker'])
-_link2_1 = _link2_1.loc[(_link2_1.ldate>=_link2_1.namedt) & (_link2_1.fdate<=_link2_1.nameenddt)]
-
-# Score using company name using 6-digit CUSIP and company name spelling distance
-_link2_1['name_ratio'] = _link2_1.apply(lambda x: fuzz.token_set_ratio(x.comnam, x.companyname), axis=1)
-
-_link2_2 = _link2_1
-_link2_2['cusip6'] = _link2_2[_link2_2['cusip'].notna()].apply(lambda x: x.cusip[:6], axis=1)
-_link2_2['ncusip6'] = _link2_2.apply(lambda x: x.ncusip[:6], axis=1)
-_link2_2['ncusip1_7'] = _link2_2.apply(lambda x: x.ncusip[1:7], axis=1)
-
-
-# Score using company name using 6-digit CUSIP and company name spelling distance
-
-def score2(row):
-    if ((row['cusip6']==row['ncusip6']) | (row['cusip6']==row['ncusip1_7'])) & (row['name_ratio'] >= name_ratio_p10):
-        score = 0
-    elif ((row['cusip6']==row['ncusip6']) | (row['cusip6']==row['ncusip1_7'])):
-        score = 4
-    elif row['name_ratio'] >= name_ratio_p10:
-        score = 5
-    else:
-        score = 6
-    return score
-
-# assign size portfolio
-_link2_2['score']=_link2_2.apply(score2, axis=1)
-
-# Some companies may have more than one TICKER-PERMNO link
-# so re-sort and keep the case (PERMNO & Company name from CRSP)
-# that gives the lowest score for each KLD TICKER 
-
-_link2_2 = _link2_2[['cusip','ticker','permno','companyname','comnam', 'name_ratio', 'score']].sort_values(by=['companyname','ticker','score'])
-_link2_2_score = _link2_2.groupby(['companyname', 'ticker']).score.min().reset_index()
-
-_link2_3 = pd.merge(_link2_2, _link2_2_score, how='inner', on=['companyname', 'ticker', 'score'])
-_link2_3 = _link2_3[['cusip','ticker','permno','companyname','comnam','name_ratio','score']].drop_duplicates()
+# Merge remaining unmatched cases using Exchange Ticker (see 'kldCrspLink.py')
+if not INCREMENTAL_LINK:
+    _link2_1 = tickerCandidates(_kld2, _kld3, _link1_2, _crsp_n2, name_cache=name_cache)
 
 #####################################
 # Step 3: Finalize Links and Scores #
@@ -256,7 +146,16 @@ _link2_3 = _link2_3[['cusip','ticker','permno','companyname','comnam','name_rati
 
 # Caution: This link is based uppercase of 'companyname' and 'ticker'. One need to convert 
 # 'companyname' in KLD data set before using this link to merge data sets.
-KLD_CRSP_link = _link1_2.append(_link2_3) # 9492 rows
+if INCREMENTAL_LINK:
+    KLD_CRSP_link = LinkStore(LINK_STORE).update(_kld2, _kld3, _crsp2, _crsp_n2, name_cache=name_cache,
+                                                 name_link=NAME_LINK, min_name_ratio=MIN_NAME_RATIO)
+else:
+    # Step 3 name link of the remaining unmatched cases (see 'kldCrspLink.py')
+    _link3_1 = nameCandidates(_kld2, _link1_2, _link2_1, _crsp2, name_cache=name_cache) if NAME_LINK else None
+    KLD_CRSP_link = finalizeLinks(_link1_2, _link2_1, _link3_1, min_name_ratio=MIN_NAME_RATIO) # 9492 rows without name links
+
+if name_cache is not None:
+    name_cache.close() # reports cache hits and misses
 
 
 ################################################
@@ -269,33 +168,59 @@ KLD_CRSP_link = _link1_2.append(_link2_3) # 9492 rows
 49606 merge by business day method 49559 if not consider pre-2000 Aug
 """
 
-KLD = _kld2.copy()
-KLD['monthly'] = pd.to_datetime(KLD.date).dt.to_period('M') # month method
-
-KLD['date'] = pd.to_datetime(KLD.date) + pd.offsets.BusinessMonthBegin(0) - pd.offsets.BusinessDay(1) # business day method
-KLD['date'] = KLD['date'].apply(lambda x: x.date()) # business day method
+# month method ('monthly') and business day method ('date')
+KLD = alignKldDates(_kld2)
 
 # CRSP Monthly Stock files
-crsp_msf = conn.raw_sql("""
-                        select distinct permno, date,
-                                       cusip
-                        from crsp.msf
-                        """)
-crsp_msf['monthly'] = pd.to_datetime(crsp_msf.date).dt.to_period('M') # month method
+# With STREAM_MSF, msf is fetched and merged in chunks of MSF_CHUNK_PERMNOS PERMNOs
+# of the link table (see 'msfStream.py') instead of loading the whole file. The
+# merged rows are the same as with the whole file.
+STREAM_MSF = False
+MSF_CHUNK_PERMNOS = 500
+
+# With SHARD_BY_YEAR, the merges on dates and years below run year by year over
+# SHARD_JOBS processes (see 'yearShards.py'). The result equals the serial merge.
+SHARD_BY_YEAR = False
+SHARD_JOBS = None # all cores
+
+if not STREAM_MSF:
+    crsp_msf = conn.raw_sql("""
+                            select distinct permno, date,
+                                           cusip
+                            from crsp.msf
+                            """)
+    crsp_msf = compactFrame(crsp_msf, 'crsp.msf')
+    crsp_msf['monthly'] = pd.to_datetime(crsp_msf.date).dt.to_period('M') # month method
 
 # Merge KLD with the link table
-KLD_linked = KLD.merge(KLD_CRSP_link, on=['companyname'],
-                       suffixes=('_KLD', '_LINK'))
+with stage('kld_linked.merge', KLD, KLD_CRSP_link) as s:
+    KLD_linked = KLD.merge(KLD_CRSP_link, on=['companyname'],
+                           suffixes=('_KLD', '_LINK'))
+    s.output(KLD_linked)
 # KLD_linked.drop(columns=[''], inplace=True)
 
 # Merge CRSP with the link table
-crsp_linked = crsp_msf.merge(KLD_CRSP_link, on='permno',
-                             suffixes=('_crsp', '_LINK'))
+with stage('crsp_linked.merge', KLD_CRSP_link) as s:
+    if STREAM_MSF:
+        crsp_linked = mergeMsf(conn, KLD_CRSP_link, on='permno', msf_side='left',
+                               chunk_permnos=MSF_CHUNK_PERMNOS, suffixes=('_crsp', '_LINK'))
+    else:
+        crsp_linked = crsp_msf.merge(KLD_CRSP_link, on='permno',
+                                     suffixes=('_crsp', '_LINK'))
+    s.output(crsp_linked)
 
 # 4 different merging methods give the same result:
-linked1 = KLD_linked.merge(crsp_linked, left_on=['companyname', 'date', 'permno', 'ticker_LINK'], 
-                           right_on=['companyname', 'date', 'permno', 'ticker'],
-                           suffixes=('_KLD_LINK', '_crsp_LINK'))
+with stage('linked1.merge', KLD_linked, crsp_linked) as s:
+    if SHARD_BY_YEAR:
+        linked1 = mergeByYear(KLD_linked, crsp_linked, 'date', n_jobs=SHARD_JOBS,
+                              left_on=['companyname', 'date', 'permno', 'ticker_LINK'],
+                              right_on=['companyname', 'date', 'permno', 'ticker'],
+                              suffixes=('_KLD_LINK', '_crsp_LINK'))
+    else:
+        linked1 = KLD_linked.merge(crsp_linked, left_on=['companyname', 'date', 'permno', 'ticker_LINK'], 
+                                   right_on=['companyname', 'date', 'permno', 'ticker'],
+                                   suffixes=('_KLD_LINK', '_crsp_LINK'))
+    s.output(linked1)
 linked1.drop(columns=['monthly_crsp_LINK', 'cusip_LINK_crsp_LINK', 'ticker',
                       'comnam_crsp_LINK', 'name_ratio_crsp_LINK', 'score_crsp_LINK'], inplace=True)
 linked1.rename(columns={'monthly_KLD_LINK':'monthly',
@@ -304,9 +229,17 @@ linked1.rename(columns={'monthly_KLD_LINK':'monthly',
                         'name_ratio_KLD_LINK':'name_ratio',
                         'score_KLD_LINK':'score'}, inplace=True)
 
-linked2 = crsp_linked.merge(KLD_linked, left_on=['companyname', 'date', 'permno', 'ticker'], 
-                            right_on=['companyname', 'date', 'permno', 'ticker_LINK'],
-                            suffixes=('_crsp_LINK', '_KLD_LINK'))
+with stage('linked2.merge', crsp_linked, KLD_linked) as s:
+    if SHARD_BY_YEAR:
+        linked2 = mergeByYear(crsp_linked, KLD_linked, 'date', n_jobs=SHARD_JOBS,
+                              left_on=['companyname', 'date', 'permno', 'ticker'],
+                              right_on=['companyname', 'date', 'permno', 'ticker_LINK'],
+                              suffixes=('_crsp_LINK', '_KLD_LINK'))
+    else:
+        linked2 = crsp_linked.merge(KLD_linked, left_on=['companyname', 'date', 'permno', 'ticker'], 
+                                    right_on=['companyname', 'date', 'permno', 'ticker_LINK'],
+                                    suffixes=('_crsp_LINK', '_KLD_LINK'))
+    s.output(linked2)
 linked2.drop(columns=['monthly_crsp_LINK', 'cusip_LINK_crsp_LINK', 'ticker',
                       'comnam_crsp_LINK', 'name_ratio_crsp_LINK', 'score_crsp_LINK'], inplace=True)
 linked2.rename(columns={'monthly_KLD_LINK':'monthly',
@@ -315,17 +248,35 @@ linked2.rename(columns={'monthly_KLD_LINK':'monthly',
                         'name_ratio_KLD_LINK':'name_ratio',
                         'score_KLD_LINK':'score'}, inplace=True)
 
-linked3 = KLD_linked.merge(crsp_msf, on=['permno', 'date'],
-                           suffixes=('_KLD_LINK', '_crsp'))
+with stage('linked3.merge', KLD_linked) as s:
+    if STREAM_MSF:
+        linked3 = mergeMsf(conn, KLD_linked, on=['permno', 'date'], permnos=KLD_CRSP_link.permno,
+                           chunk_permnos=MSF_CHUNK_PERMNOS, suffixes=('_KLD_LINK', '_crsp'))
+    elif SHARD_BY_YEAR:
+        linked3 = mergeByYear(KLD_linked, crsp_msf, 'date', n_jobs=SHARD_JOBS,
+                              on=['permno', 'date'], suffixes=('_KLD_LINK', '_crsp'))
+    else:
+        linked3 = KLD_linked.merge(crsp_msf, on=['permno', 'date'],
+                                   suffixes=('_KLD_LINK', '_crsp'))
+    s.output(linked3)
 linked3.drop(columns=['monthly_crsp'], inplace=True)
 linked3.rename(columns={'cusip':'cusip_crsp', 'monthly_KLD_LINK':'monthly'}, inplace=True)
 
-linked4 = KLD.merge(crsp_linked, on=['companyname', 'monthly'],
-                    suffixes=('_KLD', '_crsp_LINK'))
+with stage('linked4.merge', KLD, crsp_linked) as s:
+    if SHARD_BY_YEAR:
+        linked4 = mergeByYear(KLD, crsp_linked, 'monthly', n_jobs=SHARD_JOBS,
+                              on=['companyname', 'monthly'], suffixes=('_KLD', '_crsp_LINK'))
+    else:
+        linked4 = KLD.merge(crsp_linked, on=['companyname', 'monthly'],
+                            suffixes=('_KLD', '_crsp_LINK'))
+    s.output(linked4)
 linked4.drop(columns=['date_crsp_LINK'], inplace=True)
 linked4.rename(columns={'date_KLD':'date', 'cusip':'cusip_KLD', 'ticker_crsp_LINK':'ticker_LINK'}, inplace=True)
 
-# check if linked1, linked2, linked3, and linked4 identical (expect TRUE)
-linked2[sorted(linked2)].sort_values(list(linked2[sorted(linked2)].columns)).reset_index(drop=True).equals(linked1[sorted(linked1)].sort_values(list(linked1[sorted(linked1)].columns)).reset_index(drop=True))
-linked3[sorted(linked3)].sort_values(list(linked3[sorted(linked3)].columns)).reset_index(drop=True).equals(linked2[sorted(linked2)].sort_values(list(linked2[sorted(linked2)].columns)).reset_index(drop=True))
-linked4[sorted(linked4)].sort_values(list(linked4[sorted(linked4)].columns)).reset_index(drop=True).equals(linked3[sorted(linked3)].sort_values(list(linked3[sorted(linked3)].columns)).reset_index(drop=True))
+# check if linked1, linked2, linked3, and linked4 identical (expect TRUE), comparing
+# order-independent fingerprints of their rows instead of sorting them (see 'frameFingerprint.py').
+# On a difference, the rows in one frame only are printed by these keys.
+LINKED_KEYS = ['companyname', 'date', 'permno']
+assert sameRows(linked2, linked1, keys=LINKED_KEYS, names=('linked2', 'linked1'))
+assert sameRows(linked3, linked2, keys=LINKED_KEYS, names=('linked3', 'linked2'))
+assert sameRows(linked4, linked3, keys=LINKED_KEYS, names=('linked4', 'linked3'))
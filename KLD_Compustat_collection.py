@@ -9,30 +9,57 @@ This file collects KLD and Compustat from WRDS and merges them using link table
 constructed from 'KLD_Compustat_Link.py'.
 
 Before merging, KLD cleaning and correction is required.
+
+This is the 'panel' stage of 'pipeline.py'.
 """
 
-import wrds
+from wrdsCache import CachedConnection # wrds.Connection() with a local cache of query results
+from wrdsPool import warmCache # concurrent pulls into the cache
+from pipeline import KLD_HISTORY_SQL # the query below
+from frameSchema import compactFrame # compact dtypes right after each fetch
 import pandas as pd
 from fuzzywuzzy import fuzz
-from cusipCorrection import cusipCorrection # a function to correct wrongly shifted CUSIP
+from cusipCorrection import cusipCorrectionFast # a function to correct wrongly shifted CUSIP
+from kldCrspLink import cleanKld # KLD cleaning of 'KLD_Compustat_Link.py'
+from kldCompLink import mergePanel # merge with the link table
+from fundaManifest import fundaQuery, FUNDA_OUTPUTS # funda columns needed by each variable
+from tableStore import readTable, writeTable # CSV and/or year-partitioned Parquet outputs
+from stageMetrics import startRun # per-stage timings, memory and row counts
+
+# Output formats, see 'tableStore.py'. Drop 'parquet' for CSV only.
+OUTPUT_FORMATS = ('csv', 'parquet')
+
+# Set STAGE_METRICS=<folder> to write the timings, peak memory and row counts of
+# each stage of this run as JSON (see 'stageMetrics.py')
+startRun('KLD_Compustat_collection')
 
 ###################
 # Load Link table #
 ###################
-KLD_COMP_Link = pd.read_csv('KLD_CRSP_CCM_COMP_link.csv', dtype={'gvkey': str})
+# Parquet copy if 'KLD_Compustat_Link.py' wrote one, else the CSV
+KLD_COMP_Link = readTable('KLD_CRSP_CCM_COMP_Link.csv', dtype={'gvkey': str})
 print('Link table loaded.')
 
 ###################
 # Obtain data from WRDS #
 ###################
 print('Obtaining data')
-conn = wrds.Connection()
+conn = CachedConnection() # set WRDS_REPLAY=1 to run offline from the cache
+
+# With PREFETCH_CONNECTIONS, the WRDS queries of this script are pulled into the
+# cache at the same time over that many connections (see 'wrdsPool.py'), instead
+# of one after another below. The cached results are the same as those pulled
+# one after another. 0: no prefetch.
+PREFETCH_CONNECTIONS = 0
+if PREFETCH_CONNECTIONS:
+    warmCache(conn, [KLD_HISTORY_SQL, fundaQuery(FUNDA_OUTPUTS)], connections=PREFETCH_CONNECTIONS)
 
 # KLD: Get the list of Tickers, CUSIPs, Company Names and year in KLD
 KLD = conn.raw_sql("""
                    select *
                    from kld.history
                    """)
+KLD = compactFrame(KLD, 'kld.history')
                      
 # Compustat: Get Companies with non-missing Asset or Sales Item
 
@@ -52,21 +79,10 @@ KLD = conn.raw_sql("""
 #                      and datadate >= '1990-01-01'
 #                      """)
                      
-funda = conn.raw_sql("""
-                     select *
-                     from
-                     comp.funda
-                     where
-                     (sale > 0 or at > 0)
-                     and consol = 'C'
-                     and indfmt = 'INDL'
-                     and datafmt = 'STD'
-                     and popsrc = 'D'
-                     and curcd = 'USD'
-                     and final = 'Y'
-                     and fic = 'USA'
-                     and datadate >= '1990-01-01'
-                     """)
+# Only the funda columns needed for the ratios and controls built in
+# 'KLD_Compustat.ipynb' (see 'fundaManifest.py'), instead of 'select *':
+funda = conn.raw_sql(fundaQuery(FUNDA_OUTPUTS))
+funda = compactFrame(funda, 'comp.funda')
 conn.close()
 
 """
@@ -81,33 +97,19 @@ funda.to_csv('Compustat.csv', index=False)
 print('Cleaning and correcting KLD data')
 
 # Correct wrongly shifted CUSIP
-KLD = cusipCorrection(KLD)
+KLD = cusipCorrectionFast(KLD)
 
-# Set 'NA', '0', '#N/A#' CUSIPs and tickers to missing values
-KLD['cusip'].replace({'NA': None, '0': None, '#N/A': None}, inplace=True)
-KLD['ticker'].replace({'NA': None, '#N/A': None}, inplace=True)
-
-# Set 'companyname' to uppercase.
-# This will allow more backfill and forwardfill observations.
-KLD['companyname'] = KLD['companyname'].str.upper()
-KLD['ticker'] = KLD['ticker'].str.upper()
-
-# Back fill and forward fill missing CUSIPs. Can also try bfill ticker.
-KLD['cusip'] = KLD.groupby(['companyname'])['cusip'].bfill().ffill()
-KLD['ticker'] = KLD.groupby(['companyname'])['ticker'].bfill().ffill()
+# Set 'NA', '0', '#N/A#' CUSIPs and tickers to missing values, set 'companyname'
+# to uppercase, and back fill and forward fill missing CUSIPs and tickers.
+KLD = cleanKld(KLD)
 
 ###################
 # Merge data #
 ###################
 print('Merging data')
 
-df = KLD_COMP_Link.merge(KLD, left_on=['companyname', 'year', 'cusip_KLD', 'ticker_KLD'],
-                         right_on=['companyname', 'year', 'cusip', 'ticker'])
-
-df = df.merge(funda, on=['gvkey', 'fyear'])
-# df_dup = df[df.duplicated(['gvkey', 'fyear'], keep=False)] # duplicates due to domicile
-# df_dup.drop_duplicates(['gvkey', 'fyear'], keep='first', inplace=True)
-df.drop_duplicates(['gvkey', 'fyear'], keep='first', inplace=True)
+# one row per (gvkey, fyear), see 'kldCompLink.py'
+df = mergePanel(KLD_COMP_Link, KLD, funda)
 
 # Save merged dataset
-df.to_csv('KLD_Compustat.csv', index=False)
+writeTable(df, 'KLD_Compustat.csv', year='fyear', formats=OUTPUT_FORMATS)
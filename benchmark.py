@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Pak Shing Ho
+
+Benchmarks of the linking and merge steps on synthetic data (see
+'syntheticData.py'), at 1x, 10x and 100x the production size.
+
+Each step is timed on the output of the steps before it, in pipeline order:
+    cusip_correction       cusipCorrection (the original loops)
+    cusip_correction_fast  cusipCorrectionFast
+    kld_prepare            cleanKld, addKldDates, kldCusipDates
+    crsp_prepare           crspCusipNames, crspTickerNames
+    cusip_link             cusipCandidates (Step 1, no name ratio cache)
+    ticker_link            tickerCandidates (Step 2)
+    name_link              nameCandidates (name link of the remaining companies)
+    link_scores            finalizeLinks (Step 3)
+    msf_merge              linkMsf with msf in memory, one merge (Step 4)
+    msf_merge_sharded      linkMsf with msf in memory, merged year by year
+    msf_merge_stream       linkMsf streaming msf by PERMNO chunks over SQL
+    ccm_match              matchCcm
+    funda_merge            mergeCompFunda
+    panel_merge            mergePanel
+Table generation and extraction are not timed.
+
+The results are written to 'benchmark_results/<date>_<scale>x.json'. Compare
+two runs, e.g. before and after a change, with compareBenchmarks.
+
+Usage:
+    python benchmark.py --scales 1 10 --repeat 3
+    python benchmark.py --scales 1 --only cusip_link ticker_link
+    python benchmark.py --compare benchmark_results/before.json benchmark_results/after.json
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import time
+from contextlib import redirect_stdout
+from io import StringIO
+
+import pandas as pd
+
+from syntheticData import syntheticTables, SyntheticConnection
+from frameSchema import compactFrame
+from cusipCorrection import cusipCorrection, cusipCorrectionFast
+from kldCrspLink import cleanKld, addKldDates, kldCusipDates, crspCusipNames, crspTickerNames
+from kldCrspLink import cusipCandidates, tickerCandidates, nameCandidates, finalizeLinks
+from kldCompLink import alignKldDates, linkMsf, matchCcm, mergeCompFunda, compLink, mergePanel
+from fundaManifest import fundaQuery, FUNDA_OUTPUTS
+import pipeline
+
+
+STEPS = ['cusip_correction', 'cusip_correction_fast', 'kld_prepare', 'crsp_prepare',
+         'cusip_link', 'ticker_link', 'name_link', 'link_scores', 'msf_merge', 'msf_merge_sharded',
+         'msf_merge_stream', 'ccm_match', 'funda_merge', 'panel_merge']
+
+# The original cusipCorrection scans the frame once per candidate CUSIP
+MAX_SCALE = {'cusip_correction': 1}
+
+
+def _extract(conn):
+    """
+    The tables of the pipeline's extract stages, with compact dtypes.
+    """
+    queries = {'kld_raw': (pipeline.KLD_SQL, 'kld.history'),
+               'kld_history_raw': (pipeline.KLD_HISTORY_SQL, 'kld.history'),
+               'crsp_cusip_raw': (pipeline.CRSP_CUSIP_SQL, 'crsp.stocknames'),
+               'crsp_ticker_raw': (pipeline.CRSP_TICKER_SQL, 'crsp.stocknames'),
+               'ccm_link': (pipeline.CCM_SQL, 'ccm_link'),
+               'funda_link': (pipeline.FUNDA_LINK_SQL, 'comp.funda'),
+               'funda': (fundaQuery(FUNDA_OUTPUTS), 'comp.funda'),
+               'crsp_msf': ('select distinct permno, date, cusip from crsp.msf', 'crsp.msf')}
+    tables = {name: compactFrame(conn.raw_sql(sql), table)
+              for name, (sql, table) in queries.items()}
+    # the original cusipCorrection sets new values in 'cusip', which a categorical refuses
+    tables['kld_raw_object'] = tables['kld_raw'].astype({'cusip': object})
+    tables['crsp_msf']['monthly'] = pd.to_datetime(tables['crsp_msf'].date).dt.to_period('M')
+    return tables
+
+
+def _rows(result):
+    if isinstance(result, tuple):
+        return [len(r) for r in result]
+    return len(result)
+
+
+def _time(func, repeat):
+    """
+    Run 'func' 'repeat' times, its printing silenced. Returns the last result
+    and the wall times.
+    """
+    seconds = []
+    for _ in range(repeat):
+        with redirect_stdout(StringIO()):
+            start = time.perf_counter()
+            result = func()
+            seconds.append(time.perf_counter() - start)
+    return result, seconds
+
+
+def runBenchmark(scale=1, repeat=3, only=None, seed=0, output='benchmark_results'):
+    """
+    Time the STEPS (or the steps in 'only') at 'scale' times the production
+    size. Steps not in 'only' still run once, untimed, when later steps need
+    their output. Returns the results and writes them to 'output'.
+    """
+    print('Generating synthetic tables at %gx' % scale)
+    tables = syntheticTables(scale, seed)
+    conn = SyntheticConnection(tables)
+    t = _extract(conn)
+
+    steps = {
+        'cusip_correction': lambda: cusipCorrection(t['kld_raw_object']),
+        'cusip_correction_fast': lambda: cusipCorrectionFast(t['kld_raw']),
+        'kld_prepare': lambda: (lambda kld: (kld, kldCusipDates(kld)))(
+            addKldDates(cleanKld(t['kld_corrected']))),
+        'crsp_prepare': lambda: (crspCusipNames(t['crsp_cusip_raw']),
+                                 crspTickerNames(t['crsp_ticker_raw'])),
+        'cusip_link': lambda: cusipCandidates(t['kld_last'], t['crsp2']),
+        'ticker_link': lambda: tickerCandidates(t['kld'], t['kld_last'], t['cusip_candidates'],
+                                                t['crsp_n2']),
+        'name_link': lambda: nameCandidates(t['kld'], t['cusip_candidates'], t['ticker_candidates'],
+                                            t['crsp2']),
+        'link_scores': lambda: finalizeLinks(t['cusip_candidates'], t['ticker_candidates']),
+        'msf_merge': lambda: linkMsf(None, t['KLD'], t['kld_crsp_link'], crsp_msf=t['crsp_msf'],
+                                     shard_by_year=False),
+        'msf_merge_sharded': lambda: linkMsf(None, t['KLD'], t['kld_crsp_link'], crsp_msf=t['crsp_msf'],
+                                             shard_by_year=True),
+        'msf_merge_stream': lambda: linkMsf(conn, t['KLD'], t['kld_crsp_link']),
+        'ccm_match': lambda: matchCcm(t['linked3'], t['ccm_link'], shard_by_year=False),
+        'funda_merge': lambda: mergeCompFunda(t['kld_crsp_ccm'], t['funda_link'], shard_by_year=False),
+        'panel_merge': lambda: mergePanel(t['kld_comp_link'], t['kld_history'], t['funda']),
+    }
+    # where each step's output goes for the later steps
+    keep = {
+        'cusip_correction_fast': lambda r: t.update(
+            kld_corrected=r, kld_history=_time(lambda: cleanKld(cusipCorrectionFast(t['kld_history_raw'])), 1)[0]),
+        'kld_prepare': lambda r: t.update(kld=r[0], kld_last=r[1], KLD=alignKldDates(r[0])),
+        'crsp_prepare': lambda r: t.update(crsp2=r[0], crsp_n2=r[1]),
+        'cusip_link': lambda r: t.update(cusip_candidates=r),
+        'ticker_link': lambda r: t.update(ticker_candidates=r),
+        'link_scores': lambda r: t.update(kld_crsp_link=r),
+        'msf_merge': lambda r: t.update(linked3=r),
+        'ccm_match': lambda r: t.update(kld_crsp_ccm=r),
+        'funda_merge': lambda r: t.update(kld_comp_link=compLink(r)),
+    }
+
+    results = {}
+    for name in STEPS:
+        timed = only is None or name in only
+        if timed and scale > MAX_SCALE.get(name, scale):
+            print('%-22s skipped above %gx' % (name, MAX_SCALE[name]))
+            timed = False
+        if not timed and name not in keep:
+            continue
+        result, seconds = _time(steps[name], repeat if timed else 1)
+        if name in keep:
+            keep[name](result)
+        if timed:
+            results[name] = {'seconds': min(seconds),
+                             'median_seconds': sorted(seconds)[len(seconds) // 2],
+                             'repeat': repeat,
+                             'rows_out': _rows(result)}
+            print('%-22s %9.3f s  rows out %s' % (name, min(seconds), _rows(result)))
+
+    report = {'created': datetime.datetime.now().isoformat(timespec='seconds'),
+              'scale': scale,
+              'seed': seed,
+              'rows': {name: len(data) for name, data in tables.items()},
+              'python': platform.python_version(),
+              'pandas': pd.__version__,
+              'cpu_count': os.cpu_count(),
+              'results': results}
+    if output:
+        os.makedirs(output, exist_ok=True)
+        path = os.path.join(output, '%s_%gx.json' % (datetime.datetime.now().strftime('%Y%m%d_%H%M%S'), scale))
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=1)
+        print('Results written to ' + path)
+    return report
+
+
+def compareBenchmarks(before, after):
+    """
+    Table of the step times of two result files (or reports) and their ratio.
+    """
+    reports = []
+    for report in (before, after):
+        if isinstance(report, str):
+            with open(report) as f:
+                report = json.load(f)
+        reports.append(report)
+    before, after = reports
+    table = pd.DataFrame({'before': {k: v['seconds'] for k, v in before['results'].items()},
+                          'after': {k: v['seconds'] for k, v in after['results'].items()}})
+    table = table.reindex([s for s in STEPS if s in table.index])
+    table['ratio'] = table['after'] / table['before']
+    rows_before = {k: v['rows_out'] for k, v in before['results'].items()}
+    rows_after = {k: v['rows_out'] for k, v in after['results'].items()}
+    table['same_rows'] = [rows_before.get(s) == rows_after.get(s) for s in table.index]
+    return table
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the linking and merge steps on synthetic data')
+    parser.add_argument('--scales', type=float, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', nargs='+', choices=STEPS)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'))
+    args = parser.parse_args()
+
+    if args.compare:
+        print(compareBenchmarks(*args.compare).to_string())
+    else:
+        for scale in args.scales:
+            runBenchmark(scale, repeat=args.repeat, only=args.only, seed=args.seed, output=args.output)
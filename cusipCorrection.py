@@ -16,8 +16,18 @@ right and add "0"'s in front. Then take the first 8 digits and compare them to
 the original 8-digit-CUSIP. If there're sets of intersection, this means there
 are wrongly shifted CUSIPs. I collect this set of wrongly shifted CUSIPs and 
 create a dictionary to map them back to the correct CUSIPs correspondingly.
+
+cusipCorrectionFast does the same with groupby/drop_duplicates operations and
+a single mapping pass, which is much faster on the full kld.history, with the
+same output.
 """
 
+import numpy as np
+import pandas as pd
+
+from stageMetrics import stage # timings and row counts, when a run is recording
+
+
 def cusipCorrection(DataFrame):
     data = DataFrame.copy()
     data['0cusip7'] = '0' + data['cusip'].str[0:7]
@@ -103,4 +113,134 @@ def cusipCorrection(DataFrame):
     data.loc[data.cusip.str.len()==6, 'cusip'] = '000' + data.loc[data.cusip.str.len()==6, 'cusip'].str[0:5]
     print('Possible Correction Done!')
     
-    return data
\ No newline at end of file
+    return data
+
+
+def _shiftedCusipDict(cusip, shifted, previous=None, exclude=()):
+    """
+    Columnar version of one of the 'rcdict0'/'rcdict00'/'rcdict000' loops
+    above, with the same result.
+
+    'shifted' is the right-shifted CUSIP column ('0cusip7', '00cusip6' or
+    '000cusip5' of 'cusip'). A shifted value that is also an original CUSIP
+    is a correct CUSIP, and the unique original CUSIP producing it is the
+    wrong one. The candidates are visited in the order of the same set as in
+    the loops, and one produced by more than one original CUSIP re-uses the
+    '_c' of the previous candidate ('previous' for the first one), as they
+    do. Returns the dictionary and the last '_c'.
+    """
+    candidates = set(cusip.unique()) & set(shifted.unique())
+    for c in exclude:
+        candidates.discard(c)
+
+    # check if wrongly shifted cusip-8-digit is unique
+    pairs = pd.DataFrame({'cusip': cusip, 'shifted': shifted}).dropna().drop_duplicates()
+    producers = pairs.groupby('shifted')['cusip'].agg(['size', 'first'])
+    unique = dict(zip(producers.index[producers['size'] == 1],
+                      producers['first'][producers['size'] == 1]))
+
+    rcdict, _c = {}, previous
+    for c in candidates:
+        _c = unique.get(c, _c)
+        # cusipCorrection fails if the first candidate has no unique producer
+        if _c is not None:
+            rcdict[_c] = c
+    return rcdict, _c
+
+
+def _applyInOrder(cusipDict):
+    """
+    {CUSIP: corrected CUSIP} of the CUSIPs that the keys of 'cusipDict'
+    change when they are applied one after another, in dictionary order, as
+    cusipCorrection assigns them: a value that is also a later key is
+    changed again ('030710XY' -> '0030710X' -> '00030710'), one that is an
+    earlier key is not.
+    """
+    groups = {} # current CUSIP: the original CUSIPs now at it
+    for d, v in cusipDict.items():
+        groups.setdefault(v, []).extend([d] + groups.pop(d, []))
+    return {c: v for v, originals in groups.items() for c in originals}
+
+
+def _padShortCusip(c):
+    if len(c) == 7:
+        return '00' + c[0:6]
+    if len(c) == 6:
+        return '000' + c[0:5]
+    return c
+
+
+def _mapValues(series, func):
+    """
+    Apply 'func' once per distinct non-missing value of 'series' instead of
+    once per row. Categorical columns stay categorical.
+    """
+    codes, uniques = pd.factorize(series)
+    values = np.array([func(u) for u in uniques] + [np.nan], dtype=object)
+    mapped = pd.Series(values[codes], index=series.index, name=series.name)
+    mapped[codes == -1] = series[codes == -1]
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        mapped = mapped.astype('category')
+    return mapped
+
+
+def cusipCorrectionFast(DataFrame):
+    """
+    The correction of cusipCorrection, but the wrong CUSIPs are found with a
+    few drop_duplicates/groupby operations instead of scanning the whole frame
+    once per candidate, and all corrections are applied with one mapping pass
+    over the distinct CUSIPs.
+
+    The output is the same as cusipCorrection's, including where the latter
+    depends on the iteration order of Python sets (PYTHONHASHSEED): shifted
+    candidates produced by more than one original CUSIP and chains of
+    corrections. Where cusipCorrection fails (the first candidate is not
+    unique, or '00030710' is missing), the candidate is skipped instead.
+    Missing categorical CUSIPs are handled as the None of raw_sql frames.
+    """
+    data = DataFrame.copy()
+    cusip = data['cusip']
+    if isinstance(cusip.dtype, pd.CategoricalDtype):
+        cusip = cusip.astype(object).where(cusip.notna(), None)
+
+    # Create a column to store original CUSIP column:
+    data['cusip_orig'] = data['cusip']
+
+    # output: the number of wrong CUSIPs found
+    with stage('cusip_correction.shifted', data) as s:
+        rcdict0, _c = _shiftedCusipDict(cusip, '0' + cusip.str[0:7])
+        rcdict00, _c = _shiftedCusipDict(cusip, '00' + cusip.str[0:6], _c, exclude=['00030710'])
+        rcdict000, _c = _shiftedCusipDict(cusip, '000' + cusip.str[0:5], _c, exclude=['00030710'])
+        s.output(len(rcdict0) + len(rcdict00) + len(rcdict000))
+
+    # Some hand maps
+    cusip6Dict = {"18772103":"01877210",
+                  "01877230":"01877210",
+                  "886309":"00088630"}
+
+    # Merging all dictionaries above:
+    cusipDict = {**rcdict0, **rcdict00, **rcdict000, **cusip6Dict}
+
+    # Count total observations with wrong CUSIPs:
+    counter = data.cusip.isin(cusipDict.keys()).sum()
+    print('\nTotal number of distinct wrong CUSIP: ' + str(len(cusipDict)))
+    print('\nTotal wrong CUSIP observations: ' + str(counter))
+
+    # Correction by mapping according to the dictionary 'cusipDict' constructed above:
+    corrected = _applyInOrder(cusipDict)
+    with stage('cusip_correction.map', data) as s:
+        data['cusip'] = _mapValues(data['cusip'], lambda c: corrected.get(c, c))
+        s.output(data)
+
+    # Check any wrong Cusip observation left again after assignment:
+    print('Dictionary-Based Correction Done! Number of wrong CUSIP remain unassigned in dictionary-based method: ' 
+          +  str(len(data[data.cusip.isin(cusipDict.keys())])))
+
+    print('Number of wrong CUSIP remain unassigned that are also less than 8-digits: '
+          + str(sum(data.cusip.str.len()<8)))
+    print('For those only with 7 digits, add "00" in front and take first 6 digits;\n\
+          For those only with 6 digits add "000" in front and take first 5 digits')
+    data['cusip'] = _mapValues(data['cusip'], _padShortCusip)
+    print('Possible Correction Done!')
+    
+    return data
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Pak Shing Ho
+
+KLD strength/concern counts and ESG indices of 'KLD.ipynb' and
+'KLD_Compustat.ipynb', from a registry of the KLD item columns.
+
+The notebooks select the items of every aggregate with masks such as
+    data.columns.str.contains("env_str") & ~data.columns.str.contains("env_str_num")
+and sum each selection separately. Here each column name is parsed once into
+its category and polarity ('<category>_<str|con>_<item>', the '_num' totals
+excluded), every aggregate is a column of a 0/1 weight matrix over the items,
+and all sums and net indices come out of one matrix product over the item
+block (and the averages out of a second one, over its non-missing mask).
+
+    kldRegistry: category and polarity of each KLD item column
+    weightMatrix: items x aggregates weights of GROUPS, COMBINED and NETS
+    esgIndices: the counts, averages, net, average and normalized indices
+
+The sums equal the notebooks' data[cols].sum(axis=1) (missing items count 0)
+and the averages data[cols].mean(axis=1) (over the non-missing items). All
+columns are float64, as the sums over the float64 items of kld.history,
+also when the items have integer dtypes (see 'frameSchema.py').
+
+Usage:
+    indices = esgIndices(data)
+    indices = esgIndices(data, ['KLD Index', 'E Index', 'ESG_ENV'])
+"""
+
+import re
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+
+# KLD categories: strengths '<category>_str_*' and concerns '<category>_con_*'
+E_CATEGORIES = ['env']
+S_CATEGORIES = ['com', 'hum', 'emp', 'div', 'pro']
+G_CATEGORIES = ['cgov']
+CONTROVERSIES = ['alc', 'fir', 'gam', 'mil', 'nuc', 'tob']
+SUB_CATEGORIES = ['com', 'div', 'emp', 'env', 'hum', 'pro', 'cgov']
+
+_ITEM = re.compile(r'^(?P<category>[a-z]+)_(?P<polarity>str|con)_(?P<item>[a-z0-9]+)$')
+
+# Item groups summed (and averaged): name -> (categories, polarities), None for all
+GROUPS = {'positive': (None, ['str']),
+          'negative': (None, ['con']),
+          'E_pos': (E_CATEGORIES, ['str']), 'E_neg': (E_CATEGORIES, ['con']),
+          'S_pos': (S_CATEGORIES, ['str']), 'S_neg': (S_CATEGORIES, ['con']),
+          'G_pos': (G_CATEGORIES, ['str']), 'G_neg': (G_CATEGORIES, ['con']),
+          'Controv': (CONTROVERSIES, None), # Controversial business involvement, all concerns
+          'ESG_pos': (E_CATEGORIES + S_CATEGORIES + G_CATEGORIES, ['str']),
+          'ESG_A_ex_CG_pos': (E_CATEGORIES + S_CATEGORIES, ['str']),
+          'ESG_A_ex_CG_neg': (E_CATEGORIES + S_CATEGORIES, ['con']),
+          'ESG_A_pos': (E_CATEGORIES + S_CATEGORIES + G_CATEGORIES, ['str']),
+          'ESG_A_neg': (E_CATEGORIES + S_CATEGORIES + G_CATEGORIES, ['con'])}
+for _category in SUB_CATEGORIES:
+    GROUPS[_category.upper() + '_pos'] = ([_category], ['str'])
+    GROUPS[_category.upper() + '_neg'] = ([_category], ['con'])
+
+# Sums of groups: name -> groups
+COMBINED = {'ESG_neg': ['E_neg', 'S_neg', 'G_neg', 'Controv']}
+
+# Net indices: name -> (groups added, groups subtracted)
+NETS = {'KLD Index': (['positive'], ['negative']),
+        'E Index': (['E_pos'], ['E_neg']),
+        'S Index': (['S_pos'], ['S_neg']),
+        'G Index': (['G_pos'], ['G_neg']),
+        'Controv Index': ([], ['Controv']),
+        'ESG Pos-Neg Index': (['ESG_pos'], ['ESG_neg']),
+        'ESG Agg Index': (['E_pos', 'S_pos', 'G_pos'], ['E_neg', 'S_neg', 'G_neg', 'Controv']),
+        'ESG Pos-Neg Ex-CG Index': (['ESG_A_ex_CG_pos'], ['ESG_A_ex_CG_neg']),
+        'ESG Pos-Neg A Index': (['ESG_A_pos'], ['ESG_A_neg'])}
+for _category in SUB_CATEGORIES:
+    NETS['ESG_' + _category.upper()] = ([_category.upper() + '_pos'], [_category.upper() + '_neg'])
+
+# Average indices of 'KLD.ipynb': name -> (averages added, averages subtracted)
+AVERAGE_NETS = {'KLD Avg Index': (['positive_avg'], ['negative_avg']),
+                'E Avg Index': (['E_pos_avg'], ['E_neg_avg']),
+                'S Avg Index': (['S_pos_avg'], ['S_neg_avg']),
+                'G Avg Index': (['G_pos_avg'], ['G_neg_avg']),
+                'Controv Avg Index': ([], ['Controv_avg']),
+                'ESG Agg Avg Index': (['E_pos_avg', 'S_pos_avg', 'G_pos_avg'],
+                                      ['E_neg_avg', 'S_neg_avg', 'G_neg_avg', 'Controv_avg'])}
+
+# Normalized indices, (pos - neg)/(pos + neg) with 0 where there is no item:
+# name -> (positive group, negative group)
+NORMS = {'KLD Index Norm': ('positive', 'negative')}
+
+
+@lru_cache(maxsize=32)
+def _parse(columns):
+    rows = []
+    for column in columns:
+        match = _ITEM.match(column)
+        if match and match.group('item') != 'num':
+            rows.append((column, match.group('category'), match.group('polarity')))
+    return pd.DataFrame(rows, columns=['column', 'category', 'polarity']).set_index('column')
+
+
+def kldRegistry(columns):
+    """
+    Category and polarity ('str' or 'con') of the KLD item columns among
+    'columns', indexed by column name, in the order of 'columns'.
+    """
+    return _parse(tuple(columns)).copy()
+
+
+def _groupWeights(registry):
+    weights = {}
+    for name, (categories, polarities) in GROUPS.items():
+        member = np.ones(len(registry), dtype=bool)
+        if categories is not None:
+            member &= registry.category.isin(categories).to_numpy()
+        if polarities is not None:
+            member &= registry.polarity.isin(polarities).to_numpy()
+        weights[name] = member.astype('float64')
+    return weights
+
+
+def weightMatrix(registry):
+    """
+    Items x aggregates weight matrix: the GROUPS (0/1 membership), the
+    COMBINED groups and the NETS.
+    """
+    weights = _groupWeights(registry)
+    for name, groups in COMBINED.items():
+        weights[name] = sum(weights[g] for g in groups)
+    for name, (plus, minus) in NETS.items():
+        weights[name] = (sum((weights[g] for g in plus), np.zeros(len(registry)))
+                         - sum((weights[g] for g in minus), np.zeros(len(registry))))
+    return pd.DataFrame(weights, index=registry.index)
+
+
+def _itemBlock(data, registry):
+    """
+    The item block as float64, missing items 0, and its non-missing mask.
+    """
+    block = data[registry.index].to_numpy(dtype='float64', na_value=np.nan)
+    present = ~np.isnan(block)
+    np.nan_to_num(block, copy=False)
+    return block, present
+
+
+def esgIndices(data, names=None, registry=None, averages=True):
+    """
+    DataFrame (index of 'data') of the GROUPS and COMBINED sums, NETS, NORMS
+    and, with 'averages', the GROUPS averages ('<group>_avg') and AVERAGE_NETS,
+    or only the columns in 'names'. 'registry' (default: kldRegistry(data.columns))
+    lists the item columns.
+    """
+    if registry is None:
+        registry = kldRegistry(data.columns)
+    weights = weightMatrix(registry)
+    block, present = _itemBlock(data, registry)
+
+    sums = block @ weights.to_numpy()
+    result = pd.DataFrame(sums, index=data.index, columns=weights.columns)
+
+    for name, (pos, neg) in NORMS.items():
+        norm = (result[pos] - result[neg]) / (result[pos] + result[neg])
+        result[name] = norm.fillna(0) # set division by 0 result NaN to zero
+
+    if averages:
+        groups = list(GROUPS)
+        counts = present.astype('float64') @ weights[groups].to_numpy()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = np.where(counts > 0, result[groups].to_numpy(dtype='float64') / counts, np.nan)
+        means = pd.DataFrame(means, index=data.index, columns=[g + '_avg' for g in groups])
+        for name, (plus, minus) in AVERAGE_NETS.items():
+            means[name] = (sum((means[g] for g in plus), 0) - sum((means[g] for g in minus), 0))
+        result = pd.concat([result, means], axis=1)
+
+    if names is not None:
+        result = result[list(names)]
+    return result
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Pak Shing Ho
+
+Order-independent fingerprints of DataFrames, to check that two merges give
+the same rows (such as linked1 to linked4 of 'KLD_CRSP_Link.py') without
+sorting them.
+
+The check used to be
+    linked2[sorted(linked2)].sort_values(list(linked2[sorted(linked2)].columns)).reset_index(drop=True)\
+    .equals(linked1[sorted(linked1)].sort_values(list(linked1[sorted(linked1)].columns)).reset_index(drop=True))
+a sort of both frames on all their columns. Here each row is hashed once
+(pd.util.hash_pandas_object, columns in sorted order, index ignored) and
+the fingerprint is the number of rows and two sums of the row hashes
+(modulo 2**64), which do not depend on the order of the rows, with the
+column names and dtypes. Equal frames have equal fingerprints; two frames
+with equal fingerprints but different rows would need colliding 64-bit
+sums. As with DataFrame.equals, missing values are equal to each other.
+
+When the fingerprints differ, frameDifferences finds the rows in one frame
+but not the other (counting duplicates) from the row hashes, and sameRows
+reports them by the given key columns.
+
+Usage:
+    frameFingerprint(linked1)
+    assert sameRows(linked2, linked1, keys=['companyname', 'date', 'permno'])
+"""
+
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+
+Fingerprint = namedtuple('Fingerprint', ['columns', 'dtypes', 'rows', 'sum', 'mixed'])
+
+
+def rowHashes(DataFrame):
+    """
+    uint64 hash of each row, over the columns in sorted order.
+    """
+    return pd.util.hash_pandas_object(DataFrame[sorted(DataFrame)], index=False).to_numpy()
+
+
+def frameFingerprint(DataFrame):
+    """
+    Fingerprint of the rows of 'DataFrame', whatever their order.
+    """
+    hashes = rowHashes(DataFrame)
+    # a second sum of the hashes mixed, so that differences rarely cancel out in both
+    mixed = hashes * (hashes | np.uint64(1)) ^ (hashes >> np.uint64(29))
+    columns = sorted(DataFrame)
+    return Fingerprint(tuple(str(c) for c in columns), tuple(str(DataFrame[c].dtype) for c in columns),
+                       len(DataFrame), int(hashes.sum(dtype='uint64')), int(mixed.sum(dtype='uint64')))
+
+
+def frameDifferences(left, right):
+    """
+    (only_left, only_right): the rows of 'left' not in 'right' and those of
+    'right' not in 'left', as many times as they are in excess.
+    """
+    left_hashes, right_hashes = rowHashes(left), rowHashes(right)
+
+    def excess(hashes, other):
+        # the k-th occurrence of a hash is in excess if k >= its count in the other frame
+        occurrence = pd.Series(hashes).groupby(hashes).cumcount().to_numpy()
+        counts = pd.Series(other).value_counts()
+        return occurrence >= pd.Series(hashes).map(counts).fillna(0).to_numpy()
+
+    return left.loc[excess(left_hashes, right_hashes)], right.loc[excess(right_hashes, left_hashes)]
+
+
+def sameRows(left, right, keys=None, names=('left', 'right'), report=5):
+    """
+    True if 'left' and 'right' have the same columns and the same rows, in
+    any order. Otherwise prints the differing columns, or the number of rows
+    in one frame only and the first 'report' of them by 'keys' (default: all
+    columns), and returns False.
+    """
+    left_print, right_print = frameFingerprint(left), frameFingerprint(right)
+    if left_print == right_print:
+        return True
+    if left_print.columns != right_print.columns:
+        print('%s and %s differ in columns: %s only in %s, %s only in %s'
+              % (names[0], names[1],
+                 sorted(set(left_print.columns) - set(right_print.columns)), names[0],
+                 sorted(set(right_print.columns) - set(left_print.columns)), names[1]))
+        return False
+    if left_print.dtypes != right_print.dtypes:
+        print('%s and %s differ in dtypes: %s'
+              % (names[0], names[1], [(c, a, b) for c, a, b in zip(left_print.columns, left_print.dtypes,
+                                                                   right_print.dtypes) if a != b]))
+        return False
+
+    only_left, only_right = frameDifferences(left, right)
+    print('%s and %s differ: %d rows only in %s, %d rows only in %s'
+          % (names[0], names[1], len(only_left), names[0], len(only_right), names[1]))
+    keys = sorted(left) if keys is None else keys
+    for name, rows in [(names[0], only_left), (names[1], only_right)]:
+        if len(rows):
+            print('Only in %s:' % name)
+            print(rows[keys].head(report).to_string(index=False))
+    return False
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Pak Shing Ho
+
+Compact dtypes for the KLD, CRSP and Compustat tables.
+
+conn.raw_sql(...) returns identifiers and names as Python string objects,
+dates as datetime.date objects and every number as float64. compactFrame casts
+a freshly extracted table to:
+    - category for names and identifiers (companyname, comnam, conm, cusip,
+      ncusip, ticker, tic, gvkey, ...)
+    - int32 for permno/permco, int16 for year/fyear
+    - datetime64[ns] for dates (date, namedt, nameenddt, datadate, ...)
+    - int8 (Int8 if missing values) for the KLD strength/concern flags
+and, with verbose=True, prints the memory used before and after.
+
+Integer keys with missing values stay float64, as pandas cannot merge nullable
+integers with floats.
+
+Note: group by categorical columns with observed=True, otherwise pandas
+returns every combination of categories.
+"""
+
+import re
+
+import numpy as np
+import pandas as pd
+
+
+CATEGORY_COLUMNS = ['companyname', 'comnam', 'conm', 'cusip', 'ncusip', 'ticker',
+                    'tic', 'gvkey', 'iid', 'domicile', 'linktype', 'linkprim',
+                    'consol', 'indfmt', 'datafmt', 'popsrc', 'curcd', 'final', 'fic']
+INT32_COLUMNS = ['permno', 'permco', 'lpermno', 'lpermco', 'companyid']
+INT16_COLUMNS = ['year', 'fyear', 'fyr', 'sich', 'shrcd', 'exchcd']
+DATE_COLUMNS = ['date', 'namedt', 'nameenddt', 'datadate', 'linkdt', 'linkenddt']
+
+# KLD strength and concern indicators, e.g. 'env_str_a', 'alc_con_b', 'env_str_num'
+KLD_FLAG = re.compile(r'^[a-z]+_(str|con)_[a-z0-9]+$')
+
+
+def _integer(series, dtype):
+    values = pd.to_numeric(series, errors='coerce')
+    if values.isna().any() or not (values == values.round()).all():
+        return values
+    return values.astype(dtype)
+
+
+def compactColumn(series):
+    """
+    Compact dtype of one column, by column name. Unknown columns are returned
+    unchanged.
+    """
+    name = series.name
+    if name in DATE_COLUMNS:
+        return pd.to_datetime(series)
+    if name in INT32_COLUMNS:
+        return _integer(series, 'int32')
+    if name in INT16_COLUMNS:
+        return _integer(series, 'int16')
+    if name in CATEGORY_COLUMNS:
+        return series.astype('category')
+    if KLD_FLAG.match(str(name)) and pd.api.types.is_numeric_dtype(series):
+        if series.isna().any():
+            return series.astype('Int8')
+        return series.astype('int8')
+    return series
+
+
+def memoryMB(DataFrame):
+    return DataFrame.memory_usage(index=True, deep=True).sum() / 2**20
+
+
+def compactFrame(DataFrame, name='', verbose=False):
+    """
+    Cast the columns of a freshly extracted table to compact dtypes. With
+    'verbose', print the memory used by the table before and after.
+    """
+    before = memoryMB(DataFrame) if verbose else 0
+    data = DataFrame.copy()
+    for c in data.columns:
+        data[c] = compactColumn(data[c])
+    if verbose:
+        print('Compact dtypes %s: %.1f MB -> %.1f MB' % (name, before, memoryMB(data)))
+    return data
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Pak Shing Ho
+
+Variable manifest for the Compustat funda pull.
+
+Every variable built from funda in 'KLD_Compustat.ipynb' declares the funda
+columns (or other manifest variables) it is computed from, so that the funda
+query only selects the columns the requested outputs need instead of
+'select *' (hundreds of columns).
+
+Usage:
+    funda = conn.raw_sql(fundaQuery(FUNDA_OUTPUTS))
+"""
+
+from ratioLibrary import RATIOS
+
+
+# Identifiers kept in every pull, used for merging and by the notebooks
+FUNDA_KEYS = ['gvkey', 'datadate', 'fyear', 'conm', 'tic', 'cusip', 'sich']
+
+# Derived variable: inputs (funda columns or other derived variables), from the
+# declarations of the ratios and controls in 'ratioLibrary.py'
+FUNDA_VARIABLES = {name: ratio.inputs for name, ratio in RATIOS.items()}
+
+# Outputs of the KLD-Compustat panel: the derived variables above and the raw
+# funda columns kept as they are ('Comp_col_list' in 'KLD_Compustat.ipynb')
+FUNDA_OUTPUTS = list(FUNDA_VARIABLES) + ['sale', 'cogs', 'ppegt', 'xsga', 'xlr', 'emp',
+                                         'xad', 'xrd', 'at', 'sich', 'ppent', 'aqc',
+                                         'capx', 'capxv']
+
+
+def fundaColumns(outputs, keys=FUNDA_KEYS):
+    """
+    Minimal list of funda columns needed to build 'outputs'.
+    Names that are not in FUNDA_VARIABLES are taken to be funda columns.
+    """
+    columns = list(keys)
+    todo, seen = list(outputs), set()
+    while todo:
+        name = todo.pop(0)
+        if name in seen:
+            continue
+        seen.add(name)
+        # 'txditc' and 'ebitda' are both a funda column and a derived variable
+        if name not in FUNDA_VARIABLES or name in FUNDA_VARIABLES[name]:
+            if name not in columns:
+                columns.append(name)
+        todo.extend(FUNDA_VARIABLES.get(name, []))
+    return columns
+
+
+def fundaQuery(outputs, keys=FUNDA_KEYS, start='1990-01-01'):
+    """
+    The funda query of 'KLD_Compustat_collection.py', selecting only the
+    columns needed for 'outputs'.
+    """
+    return """
+           select {columns}
+           from
+           comp.funda
+           where
+           (sale > 0 or at > 0)
+           and consol = 'C'
+           and indfmt = 'INDL'
+           and datafmt = 'STD'
+           and popsrc = 'D'
+           and curcd = 'USD'
+           and final = 'Y'
+           and fic = 'USA'
+           and datadate >= '{start}'
+           """.format(columns=', '.join(fundaColumns(outputs, keys)), start=start)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Pak Shing Ho
+
+Step 4 and Parts 2-3 of 'KLD_Compustat_Link.py', and the merge of
+'KLD_Compustat_collection.py', as functions of their input tables.
+
+    alignKldDates: KLD dates moved to the last business day of the month, and
+        the 'monthly' period
+    linkMsf: KLD merged with the KLD-CRSP link table and crsp.msf (linked3)
+    matchCcm: linked3 matched with the CCM link by PERMNO and date
+    mergeCompFunda: KLD-CRSP-CCM merged with funda by (gvkey, fiscal year),
+        the best link of each (gvkey, year) kept (the detailed link table)
+    compLink: the KLD-Compustat link table, without the link details
+    mergePanel: KLD and funda merged with the KLD-Compustat link table
+
+Usage:
+    KLD = alignKldDates(_kld2)
+    linked3 = linkMsf(conn, KLD, KLD_CRSP_link)
+    KLD_CRSP_CCM = matchCcm(linked3, ccm_link)
+    KLD_CRSP_CCM_COMP = mergeCompFunda(KLD_CRSP_CCM, funda)
+    KLD_COMP_Link = compLink(KLD_CRSP_CCM_COMP)
+    df = mergePanel(KLD_COMP_Link, KLD, funda)
+"""
+
+import pandas as pd
+
+from msfStream import mergeMsf
+from yearShards import mergeByYear
+from stageMetrics import stage # timings and row counts, when a run is recording
+
+
+# Link details dropped from the detailed link table
+LINK_DETAIL_COLUMNS = ['cusip_orig', 'monthly', 'cusip_LINK', 'ticker_LINK', 'comnam',
+                       'name_ratio', 'score', 'cusip_crsp', 'conm']
+
+
+def alignKldDates(_kld2):
+    """
+    KLD with 'monthly' (month of 'date') and 'date' moved to the last
+    business day of its month, the dates of crsp.msf.
+    """
+    KLD = _kld2.copy()
+    KLD['monthly'] = pd.to_datetime(KLD.date).dt.to_period('M') # month method
+    KLD['date'] = pd.to_datetime(KLD.date) + pd.offsets.BusinessMonthBegin(0) - pd.offsets.BusinessDay(1) # business day method
+    return KLD
+
+
+def linkMsf(conn, KLD, KLD_CRSP_link, crsp_msf=None, chunk_permnos=500,
+            shard_by_year=False, n_jobs=None):
+    """
+    KLD linked to the link table first, then merged with CRSP (linked3).
+    Without 'crsp_msf', msf is streamed from 'conn' in chunks of PERMNOs of the
+    link table (see 'msfStream.py').
+    """
+    # Merge KLD with the link table
+    with stage('link_msf.merge_link', KLD, KLD_CRSP_link) as s:
+        KLD_linked = KLD.merge(KLD_CRSP_link, on=['companyname'],
+                               suffixes=('_KLD', '_LINK'))
+        s.output(KLD_linked)
+
+    with stage('link_msf.merge_msf', KLD_linked) as s:
+        if crsp_msf is None:
+            linked3 = mergeMsf(conn, KLD_linked, on=['permno', 'date'], permnos=KLD_CRSP_link.permno,
+                               chunk_permnos=chunk_permnos, suffixes=('_KLD_LINK', '_crsp'))
+        elif shard_by_year:
+            linked3 = mergeByYear(KLD_linked, crsp_msf, 'date', n_jobs=n_jobs,
+                                  on=['permno', 'date'], suffixes=('_KLD_LINK', '_crsp'))
+        else:
+            linked3 = KLD_linked.merge(crsp_msf, on=['permno', 'date'],
+                                       suffixes=('_KLD_LINK', '_crsp'))
+        s.output(linked3)
+    linked3.drop(columns=['monthly_crsp'], inplace=True)
+    linked3.rename(columns={'cusip':'cusip_crsp', 'monthly_KLD_LINK':'monthly'}, inplace=True)
+    return linked3
+
+
+def matchCcm(linked3, ccm_link, shard_by_year=False, n_jobs=None):
+    """
+    KLD-CRSP rows matched with the CCM link by PERMNO and date.
+    """
+    linked3 = linked3.copy()
+    linked3.year = linked3.year.astype(int)
+    with stage('match_ccm.merge', linked3, ccm_link) as s:
+        if shard_by_year:
+            KLD_CRSP_CCM = mergeByYear(linked3, ccm_link, 'date', n_jobs=n_jobs,
+                                       left_on=['permno', 'date'], right_on=['permno', 'date'])
+        else:
+            KLD_CRSP_CCM = linked3.merge(ccm_link, left_on=['permno', 'date'], right_on=['permno', 'date']) # 44968, 44905 if not Aug
+        s.output(KLD_CRSP_CCM)
+    return KLD_CRSP_CCM
+
+
+def mergeCompFunda(KLD_CRSP_CCM, funda, shard_by_year=False, n_jobs=None):
+    """
+    KLD-CRSP-CCM merged with funda on (gvkey, year = fyear), keeping the best
+    link (lowest score, then highest name ratio) of each (gvkey, year).
+    """
+    funda = funda.sort_values(['gvkey', 'datadate']).reset_index(drop=True)
+    KLD_CRSP_CCM = KLD_CRSP_CCM.sort_values(['gvkey', 'year', 'score', 'name_ratio'],
+                                            ascending=[True, True, True, False]) # 44968
+    with stage('merge_comp_funda.merge', KLD_CRSP_CCM, funda) as s:
+        if shard_by_year:
+            KLD_CRSP_CCM_COMP = mergeByYear(KLD_CRSP_CCM, funda, 'year', 'fyear', n_jobs=n_jobs,
+                                            left_on=['gvkey', 'year'], right_on=['gvkey', 'fyear'])
+        else:
+            KLD_CRSP_CCM_COMP = pd.merge(KLD_CRSP_CCM, funda, left_on=['gvkey', 'year'], right_on=['gvkey', 'fyear'])
+        s.output(KLD_CRSP_CCM_COMP)
+    with stage('merge_comp_funda.drop_duplicates', KLD_CRSP_CCM_COMP) as s:
+        KLD_CRSP_CCM_COMP.sort_values(['gvkey', 'year', 'score', 'name_ratio'],
+                                      ascending=[True, True, True, False],
+                                      inplace=True)
+        KLD_CRSP_CCM_COMP.drop_duplicates(subset=['gvkey', 'year'], keep='first', inplace=True) # 43327, 43331
+        s.output(KLD_CRSP_CCM_COMP)
+    return KLD_CRSP_CCM_COMP
+
+
+def compLink(KLD_CRSP_CCM_COMP):
+    """
+    The KLD-Compustat link table: the detailed link table without
+    LINK_DETAIL_COLUMNS.
+    """
+    return KLD_CRSP_CCM_COMP.drop(columns=LINK_DETAIL_COLUMNS)
+
+
+def mergePanel(KLD_COMP_Link, KLD, funda):
+    """
+    Cleaned KLD (all columns) and funda merged with the KLD-Compustat link
+    table, one row per (gvkey, fyear).
+    """
+    with stage('merge_panel.merge_kld', KLD_COMP_Link, KLD) as s:
+        df = KLD_COMP_Link.merge(KLD, left_on=['companyname', 'year', 'cusip_KLD', 'ticker_KLD'],
+                                 right_on=['companyname', 'year', 'cusip', 'ticker'])
+        s.output(df)
+
+    with stage('merge_panel.merge_funda', df, funda) as s:
+        df = df.merge(funda, on=['gvkey', 'fyear'])
+        s.output(df)
+    # df_dup = df[df.duplicated(['gvkey', 'fyear'], keep=False)] # duplicates due to domicile
+    # df_dup.drop_duplicates(['gvkey', 'fyear'], keep='first', inplace=True)
+    with stage('merge_panel.drop_duplicates', df) as s:
+        df.drop_duplicates(['gvkey', 'fyear'], keep='first', inplace=True)
+        s.output(df)
+    return df
@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Pak Shing Ho
+
+Steps 1-3 of the KLD-CRSP link in 'KLD_CRSP_Link.py' and 'KLD_Compustat_Link.py'.
+
+Inputs:
+    cleanKld, addKldDates, kldCusipDates: KLD names, CUSIPs, tickers and
+        dates (_kld2, _kld3) after the CUSIP correction
+    crspCusipNames, crspTickerNames: CRSP names by NCUSIP (_crsp2) and by
+        ticker (_crsp_n2) with their date ranges
+
+The link is built in two passes:
+    cusipCandidates, tickerCandidates: the CUSIP and TICKER link candidates of
+        each KLD company, with their name ratios (the costly part). These only
+        depend on the company's own KLD rows and the CRSP rows of its CUSIPs
+        and tickers, so they can be built for a subset of companies.
+    nameCandidates: optionally, the NAME link candidates of the companies
+        with neither: the closest CRSP names (see 'nameIndex.py') with
+        overlapping dates, and their name ratios.
+    finalizeLinks: scores all candidates against the 10% percentile (default
+        'name_ratio_quantile') of the CUSIP name ratios and keeps the best links.
+        Name links are kept with score 7 if their name ratio is at least
+        'min_name_ratio' (the best ones of each company).
+
+Usage:
+    _kld2 = addKldDates(cleanKld(cusipCorrectionFast(_kld1)))
+    _kld3 = kldCusipDates(_kld2)
+    _crsp2 = crspCusipNames(_crsp1)
+    _crsp_n2 = crspTickerNames(_crsp_n1)
+    _link1_2 = cusipCandidates(_kld3, _crsp2, name_cache=name_cache)
+    _link2_1 = tickerCandidates(_kld2, _kld3, _link1_2, _crsp_n2, name_cache=name_cache)
+    _link3_1 = nameCandidates(_kld2, _link1_2, _link2_1, _crsp2, name_cache=name_cache)
+    KLD_CRSP_link = finalizeLinks(_link1_2, _link2_1, _link3_1)
+"""
+
+import pandas as pd
+from fuzzywuzzy import fuzz
+
+from nameRatio import nameRatio
+from linkScore import scoreCusipLink, scoreTickerLink, addCusipSubstrings, NAME_LINK_SCORE
+from tickerIndex import TickerIntervals
+from nameIndex import NameTokenIndex
+from stageMetrics import stage # timings and row counts, when a run is recording
+
+
+def cleanKld(_kld1):
+    """
+    Missing and uppercase CUSIPs, tickers and company names of KLD, filled
+    within each company.
+    """
+    # set 'NA', '0', '#N/A#' CUSIPs and tickers to missing values
+    _kld2 = _kld1.copy()
+    _kld2['cusip'].replace({'NA':None, '0':None, '#N/A':None}, inplace=True)
+    _kld2['ticker'].replace({'NA':None, '#N/A':None}, inplace=True)
+
+    # set 'companyname' to uppercase. This will allow more backfill and forwardfill observations
+    _kld2['companyname'] = _kld2['companyname'].str.upper()
+    _kld2['ticker'] = _kld2['ticker'].str.upper()
+
+    # Back fill and forward fill missing CUSIPs. Can also try bfill ticker.
+    with stage('clean_kld.fill', _kld2) as s:
+        _kld2['cusip'] = _kld2.groupby(['companyname'], observed=True)['cusip'].bfill().ffill()
+        _kld2['ticker'] = _kld2.groupby(['companyname'], observed=True)['ticker'].bfill().ffill()
+        s.output(_kld2)
+    return _kld2
+
+
+def addKldDates(_kld2):
+    """
+    KLD 'date' of each year, with 'year' as string.
+    """
+    # Construct dates pre-2000, month is Aug; from 2001, monnth is Dec, all days are 31.
+    _kld2 = _kld2.copy()
+    _kld2['month'] = '12'
+    _kld2['day'] = '31'
+    _kld2.loc[_kld2.year<=2000, 'month'] = '08' # commented out this has no effect on linking KLD-CRSP but affects linking with CCM-Link
+    _kld2.year = _kld2.year.astype(int).astype(str)
+    _kld2['date'] = pd.to_datetime(_kld2[['year', 'month', 'day']])
+    _kld2.drop(columns=['month', 'day'], inplace=True)
+    return _kld2
+
+
+def kldCusipDates(_kld2):
+    """
+    First and last date of each KLD company name and CUSIP, on the row of the
+    last date (_kld3).
+    """
+    with stage('kld_cusip_dates.groupby', _kld2) as s:
+        _kld2_date = _kld2.groupby(['companyname', 'cusip'], observed=True).date.agg(['min', 'max'])\
+        .reset_index().rename(columns={'min':'fdate', 'max':'ldate'})
+        s.output(_kld2_date)
+
+    # merge fdate ldate back to _kld2 data
+    with stage('kld_cusip_dates.merge', _kld2, _kld2_date) as s:
+        _kld3 = pd.merge(_kld2, _kld2_date, how='left', on =['companyname','cusip'])
+        _kld3 = _kld3.sort_values(by=['companyname','cusip','date'])
+        s.output(_kld3)
+
+    # keep only the most recent company name
+    # determined by having date = ldate
+    return _kld3.loc[_kld3.date == _kld3.ldate].drop(['date'], axis=1)
+
+
+def crspCusipNames(_crsp1):
+    """
+    Most recent CRSP company name of each PERMNO-NCUSIP, with the first
+    'namedt' and last 'nameenddt' (_crsp2).
+    """
+    with stage('crsp_cusip_names.groupby', _crsp1) as s:
+        # first namedt
+        _crsp1_fnamedt = _crsp1.groupby(['permno','ncusip'], observed=True).namedt.min().reset_index()
+
+        # last nameenddt
+        _crsp1_lnameenddt = _crsp1.groupby(['permno','ncusip'], observed=True).nameenddt.max().reset_index()
+
+        # merge both
+        _crsp1_dtrange = pd.merge(_crsp1_fnamedt, _crsp1_lnameenddt, \
+                                  on = ['permno','ncusip'], how='inner')
+        s.output(_crsp1_dtrange)
+
+    # replace namedt and nameenddt with the version from the dtrange
+    _crsp1 = _crsp1.drop(['namedt'],axis=1).rename(columns={'nameenddt':'enddt'})
+    with stage('crsp_cusip_names.merge', _crsp1, _crsp1_dtrange) as s:
+        _crsp2 = pd.merge(_crsp1, _crsp1_dtrange, on =['permno','ncusip'], how='inner')
+        s.output(_crsp2)
+
+    # keep only most recent company name
+    return _crsp2.loc[_crsp2.enddt ==_crsp2.nameenddt].drop(['enddt'], axis=1)
+
+
+def crspTickerNames(_crsp_n1):
+    """
+    Most recent CRSP company name of each PERMNO-ticker, with the effective
+    dates of the ticker (_crsp_n2).
+    """
+    _crsp_n1 = _crsp_n1.loc[_crsp_n1.ticker.notna()].sort_values(by=['permno','ticker','namedt'])
+
+    # Arrange effective dates for link by Exchange Ticker
+
+    with stage('crsp_ticker_names.groupby', _crsp_n1) as s:
+        _crsp_n1_namedt = _crsp_n1.groupby(['permno','ticker'], observed=True).namedt.min().reset_index().rename(columns={'min':'namedt'})
+        _crsp_n1_nameenddt = _crsp_n1.groupby(['permno','ticker'], observed=True).nameenddt.max().reset_index().rename(columns={'max':'nameenddt'})
+
+        _crsp_n1_dt = pd.merge(_crsp_n1_namedt, _crsp_n1_nameenddt, how = 'inner', on=['permno','ticker'])
+        s.output(_crsp_n1_dt)
+
+    _crsp_n1 = _crsp_n1.rename(columns={'namedt': 'namedt_ind', 'nameenddt':'nameenddt_ind'})
+
+    with stage('crsp_ticker_names.merge', _crsp_n1, _crsp_n1_dt) as s:
+        _crsp_n2 = pd.merge(_crsp_n1, _crsp_n1_dt, how ='left', on = ['permno','ticker'])
+        s.output(_crsp_n2)
+
+    _crsp_n2 = _crsp_n2.rename(columns={'ticker':'crsp_ticker'})
+    return _crsp_n2.loc[_crsp_n2.nameenddt_ind == _crsp_n2.nameenddt].drop(['namedt_ind', 'nameenddt_ind'], axis=1)
+
+
+def _companies(DataFrame, companies):
+    if companies is None:
+        return DataFrame
+    return DataFrame.loc[DataFrame.companyname.isin(companies)]
+
+
+def cusipCandidates(_kld3, _crsp2, name_cache=None, companies=None, scorer=fuzz.token_set_ratio):
+    """
+    Step 1.3: KLD-CRSP CUSIP link candidates, before scoring, of all KLD
+    companies or only of 'companies'.
+    """
+    _kld3 = _companies(_kld3, companies)
+
+    # Link by full cusip, company names and dates
+    with stage('cusip_candidates.merge_ncusip', _kld3, _crsp2) as s:
+        _link1_1 = pd.merge(_kld3, _crsp2, how='inner', left_on='cusip', right_on='ncusip')\
+        .sort_values(['companyname','permno','ldate'])
+        s.output(_link1_1)
+
+    # Keep link with most recent company name
+    with stage('cusip_candidates.latest_name', _link1_1) as s:
+        _link1_1_tmp = _link1_1.groupby(['companyname','permno'], observed=True).ldate.max().reset_index()
+        _link1_2 = pd.merge(_link1_1, _link1_1_tmp, how='inner', on =['companyname', 'permno', 'ldate'])
+        s.output(_link1_2)
+
+    # Calculate name matching ratio using FuzzyWuzzy
+
+    # Note: fuzz ratio = 100 -> match perfectly
+    #       fuzz ratio = 0   -> do not match at all
+
+    # Comment: token_set_ratio is more flexible in matching the strings:
+    # fuzz.token_set_ratio('AMAZON.COM INC',  'AMAZON COM INC')
+    # returns value of 100
+
+    # fuzz.ratio('AMAZON.COM INC',  'AMAZON COM INC')
+    # returns value of 93
+
+    _link1_2['name_ratio'] = nameRatio(_link1_2, 'comnam', 'companyname', scorer=scorer, cache=name_cache)
+    return _link1_2
+
+
+def tickerCandidates(_kld2, _kld3, _link1_2, _crsp_n2, name_cache=None, companies=None,
+                     scorer=fuzz.token_set_ratio):
+    """
+    Step 2: KLD-CRSP TICKER link candidates, before scoring, of the companies
+    without a CUSIP link candidate in '_link1_2' (all KLD companies or only
+    'companies').
+    """
+    _kld2, _kld3 = _companies(_kld2, companies), _companies(_kld3, companies)
+
+    # Identify remaining unmatched cases
+    with stage('ticker_candidates.unmatched', _kld3, _link1_2) as s:
+        _nomatch1 = pd.merge(_kld3[['companyname']], _link1_2[['permno','companyname']], on='companyname', how='left')
+        _nomatch1 = _nomatch1.loc[_nomatch1.permno.isnull()].drop(['permno'], axis=1).drop_duplicates()
+        s.output(_nomatch1)
+
+    # Add KLD identifying information
+    kldid = _kld2
+    kldid = kldid.loc[kldid.companyname.notna()]
+
+    with stage('ticker_candidates.merge_kld', _nomatch1, kldid) as s:
+        _nomatch2 = pd.merge(_nomatch1, kldid, how='inner', on=['companyname'])
+        s.output(_nomatch2)
+
+    # Create first and last 'start dates' for Exchange Tickers
+    # Label date range variables and keep only most recent company name
+
+    with stage('ticker_candidates.ticker_dates', _nomatch2) as s:
+        _nomatch3 = _nomatch2.groupby(['companyname', 'ticker'], observed=True).date.agg(['min', 'max'])\
+        .reset_index().rename(columns={'min':'fdate', 'max':'ldate'})
+
+        _nomatch3 = pd.merge(_nomatch2, _nomatch3, how='left', on=['companyname','ticker'])
+
+        _nomatch3 = _nomatch3.loc[_nomatch3.date == _nomatch3.ldate]
+        s.output(_nomatch3)
+
+    # Merge remaining unmatched cases using Exchange Ticker
+    # Note: Use ticker date ranges as exchange tickers are reused overtime
+    # (only the ticker pairs with ldate>=namedt & fdate<=nameenddt are built,
+    # see 'tickerIndex.py')
+
+    with stage('ticker_candidates.merge_ticker', _nomatch3, _crsp_n2) as s:
+        _link2_1 = TickerIntervals(_crsp_n2).merge(_nomatch3, 'ticker', 'fdate', 'ldate')
+        s.output(_link2_1)
+
+    # Score using company name using 6-digit CUSIP and company name spelling distance
+    _link2_1['name_ratio'] = nameRatio(_link2_1, 'comnam', 'companyname', scorer=scorer, cache=name_cache)
+    return _link2_1
+
+
+def nameCandidates(_kld2, _link1_2, _link2_1, _crsp2, name_cache=None, companies=None,
+                   top_k=10, max_postings=1000, scorer=fuzz.token_set_ratio):
+    """
+    Step 3 (name link): KLD-CRSP NAME link candidates of the companies
+    without a CUSIP or TICKER link candidate (all KLD companies or only
+    'companies'): the CRSP names of '_crsp2' among the 'top_k' closest to the
+    company name (see 'nameIndex.py') whose dates overlap the company's.
+    """
+    _kld2 = _companies(_kld2, companies)
+    linked = pd.concat([_link1_2.companyname.astype(object), _link2_1.companyname.astype(object)])
+
+    # Identify remaining unmatched cases, with the first and last KLD date of the name
+    with stage('name_candidates.unmatched', _kld2) as s:
+        _nomatch1 = _kld2.loc[_kld2.companyname.notna() & ~_kld2.companyname.isin(linked)]
+        _nomatch1_date = _nomatch1.groupby(['companyname'], observed=True).date.agg(['min', 'max'])\
+        .reset_index().rename(columns={'min':'fdate', 'max':'ldate'})
+        _nomatch2 = pd.merge(_nomatch1, _nomatch1_date, how='left', on=['companyname'])
+        _nomatch2 = _nomatch2.loc[_nomatch2.date == _nomatch2.ldate]\
+        .drop_duplicates(['companyname']).drop(['date'], axis=1)
+        s.output(_nomatch2)
+
+    # Closest CRSP names, and only those with overlapping dates
+    with stage('name_candidates.name_index', _nomatch2, _crsp2) as s:
+        query, row, similarity = NameTokenIndex(_crsp2.comnam, max_postings=max_postings)\
+        .query(_nomatch2.companyname, top_k=top_k)
+        _link3_1 = pd.merge(_nomatch2.iloc[query].reset_index(drop=True),
+                            _crsp2.iloc[row].reset_index(drop=True),
+                            left_index=True, right_index=True)
+        _link3_1 = _link3_1.loc[(_link3_1.ldate>=_link3_1.namedt) & (_link3_1.fdate<=_link3_1.nameenddt)]
+        s.output(_link3_1)
+
+    # Score the candidates with the exact name ratio
+    _link3_1 = _link3_1.reset_index(drop=True)
+    _link3_1['name_ratio'] = nameRatio(_link3_1, 'comnam', 'companyname', scorer=scorer, cache=name_cache)
+    return _link3_1
+
+
+def finalizeLinks(_link1_2, _link2_1, _link3_1=None, name_ratio_quantile=0.10, min_name_ratio=90):
+    """
+    Score the CUSIP and TICKER link candidates and keep the best links
+    (Step 3), and the best NAME link candidates of '_link3_1' with a name
+    ratio of at least 'min_name_ratio'. Returns the KLD-CRSP link table.
+    """
+    # Note on parameters:
+    # The following parameters are chosen to mimic the SAS macro %iclink
+    # In %iclink, name_dist < 30 is assigned score = 0
+    # where name_dist=30 is roughly 90% percentile in total distribution
+    # and higher name_dist means more different names.
+    # In name_ratio, I mimic this by choosing 10% percentile as cutoff to assign
+    # score = 0
+
+    # 10% percentile of the company name distance
+    name_ratio_p10 = _link1_2.name_ratio.quantile(name_ratio_quantile)
+
+    # Function to assign score for companies matched by:
+    # full cusip and passing name_ratio
+    # or meeting date range requirement
+    _link1_2 = _link1_2.copy()
+    _link1_2['score'] = scoreCusipLink(_link1_2, name_ratio_p10)
+    _link1_2 = _link1_2[['cusip_x', 'ticker','permno','companyname','comnam','name_ratio','score']].rename(columns={'cusip_x':'cusip'})
+    with stage('finalize_links.drop_duplicates', _link1_2) as s:
+        _link1_2 = _link1_2.drop_duplicates()
+        s.output(_link1_2)
+
+    _link2_2 = addCusipSubstrings(_link2_1.copy()) # 'cusip6', 'ncusip6' and 'ncusip1_7'
+
+    # Score using company name using 6-digit CUSIP and company name spelling distance
+    _link2_2['score'] = scoreTickerLink(_link2_2, name_ratio_p10)
+
+    # Some companies may have more than one TICKER-PERMNO link
+    # so re-sort and keep the case (PERMNO & Company name from CRSP)
+    # that gives the lowest score for each KLD TICKER
+
+    _link2_2 = _link2_2[['cusip','ticker','permno','companyname','comnam', 'name_ratio', 'score']].sort_values(by=['companyname','ticker','score'])
+    with stage('finalize_links.best_ticker', _link2_2) as s:
+        _link2_2_score = _link2_2.groupby(['companyname', 'ticker'], observed=True).score.min().reset_index()
+
+        _link2_3 = pd.merge(_link2_2, _link2_2_score, how='inner', on=['companyname', 'ticker', 'score'])
+        _link2_3 = _link2_3[['cusip','ticker','permno','companyname','comnam','name_ratio','score']].drop_duplicates()
+        s.output(_link2_3)
+
+    # Caution: This link is based uppercase of 'companyname' and 'ticker'. One need to convert
+    # 'companyname' in KLD data set before using this link to merge data sets.
+    if _link3_1 is None:
+        return pd.concat([_link1_2, _link2_3])
+
+    # Name links: keep the candidates with the highest name ratio of each company,
+    # if it is at least 'min_name_ratio'
+    with stage('finalize_links.best_name', _link3_1) as s:
+        _link3_2 = _link3_1.loc[_link3_1.name_ratio >= min_name_ratio]
+        best = _link3_2.groupby(['companyname'], observed=True).name_ratio.transform('max')
+        _link3_2 = _link3_2.loc[_link3_2.name_ratio == best].assign(score=NAME_LINK_SCORE)
+        _link3_2 = _link3_2[['cusip_x','ticker','permno','companyname','comnam','name_ratio','score']]\
+        .rename(columns={'cusip_x':'cusip'}).drop_duplicates()
+        s.output(_link3_2)
+    return pd.concat([_link1_2, _link2_3, _link3_2])
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Pak Shing Ho
+
+Columnar versions of the row-wise 'score1' and 'score2' functions used in the
+KLD-CRSP link, giving the same 0-6 link score with array operations.
+
+# Score = 0 (best link) to Score = 6 (worst link)
+# - 0: BEST match: using (cusip, cusip dates and company names)
+#          or (exchange ticker, company names and 6-digit cusip)
+# - 1: Cusips and cusip dates match but company names do not match
+# - 2: Cusips and company names match but cusip dates do not match
+# - 3: Cusips match but cusip dates and company names do not match
+# - 4: tickers and 6-digit cusips match but company names do not match
+# - 5: tickers and company names match but 6-digit cusips do not match
+# - 6: tickers match but company names and 6-digit cusips do not match
+# - 7: company names and name dates match only (no cusip or ticker link)
+"""
+
+import numpy as np
+import pandas as pd
+
+
+# Score of the name links (Step 3), below every CUSIP and TICKER link
+NAME_LINK_SCORE = 7
+
+
+def scoreCusipLink(DataFrame, name_ratio_p10):
+    """
+    Step 1 (CUSIP) score for companies matched by full cusip and passing
+    name_ratio or meeting the date range requirement. Same as
+        DataFrame.apply(score1, axis=1)
+    """
+    dates = ((DataFrame['fdate'] <= DataFrame['nameenddt'])
+             & (DataFrame['ldate'] >= DataFrame['namedt'])).to_numpy()
+    names = (DataFrame['name_ratio'] >= name_ratio_p10).to_numpy()
+    score = np.select([dates & names, dates, names], [0, 1, 2], default=3)
+    return pd.Series(score, index=DataFrame.index)
+
+
+def addCusipSubstrings(DataFrame):
+    """
+    Add the 'cusip6', 'ncusip6' and 'ncusip1_7' columns compared in step 2.
+    """
+    DataFrame['cusip6'] = DataFrame['cusip'].str[:6]
+    DataFrame['ncusip6'] = DataFrame['ncusip'].str[:6]
+    DataFrame['ncusip1_7'] = DataFrame['ncusip'].str[1:7]
+    return DataFrame
+
+
+def scoreTickerLink(DataFrame, name_ratio_p10):
+    """
+    Step 2 (TICKER) score using the 6-digit CUSIP and the company name spelling
+    distance. Same as
+        DataFrame.apply(score2, axis=1)
+    Missing CUSIPs never match, as NaN != NaN in the row-wise version.
+    """
+    cusip6 = DataFrame['cusip6']
+    cusips = ((cusip6 == DataFrame['ncusip6'])
+              | (cusip6 == DataFrame['ncusip1_7'])).to_numpy()
+    names = (DataFrame['name_ratio'] >= name_ratio_p10).to_numpy()
+    score = np.select([cusips & names, cusips, names], [0, 4, 5], default=6)
+    return pd.Series(score, index=DataFrame.index)
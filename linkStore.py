@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Pak Shing Ho
+
+Versioned store of the KLD-CRSP link table, for incremental updates when a new
+KLD vintage arrives.
+
+Each version keeps, in its own folder of 'path':
+    cusip.parquet      CUSIP link candidates of every KLD company (Step 1.3)
+    ticker.parquet     TICKER link candidates (Step 2)
+    signature.parquet  one hash per KLD company of everything its candidates
+                       depend on: its own KLD rows and the CRSP rows of its
+                       CUSIPs and tickers
+    name.parquet       NAME link candidates (Step 3), with 'name_link'
+    link.parquet       the finalized KLD-CRSP link table
+and 'versions.json' lists the versions.
+
+LinkStore.update(...) compares the company hashes with the latest version,
+builds candidates (and name ratios) only for new or changed companies, drops
+removed companies, and re-scores all candidates with 'finalizeLinks', as the
+name ratio percentile used in the scores is taken over all companies. The
+link table is the same as a full rebuild. A new 'name_ratio_quantile' only
+re-scores the stored candidates.
+
+With 'name_link', the companies without CUSIP or TICKER candidates are also
+linked by name ('nameCandidates'). Their candidates depend on all CRSP names,
+so they are rebuilt at each update (the name ratios come from the cache), and
+a change of the CRSP names (a hash of '_crsp2') triggers an update.
+
+Usage:
+    KLD_CRSP_link = LinkStore('link_store').update(_kld2, _kld3, _crsp2, _crsp_n2,
+                                                   name_cache=name_cache)
+"""
+
+import datetime
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from fuzzywuzzy import fuzz
+
+from kldCrspLink import cusipCandidates, tickerCandidates, nameCandidates, finalizeLinks
+from nameRatioCache import scorerId
+
+
+def _rowHashes(DataFrame, by):
+    """
+    Hash of each row, including its position among the rows with the same 'by'.
+    """
+    data = DataFrame.assign(_pos=DataFrame.groupby(by, sort=False, observed=True).cumcount())
+    return pd.util.hash_pandas_object(data, index=False).to_numpy()
+
+
+def _sumBy(keys, hashes):
+    """
+    Sum of hashes (modulo 2**64) by key, as a Series indexed by key.
+    """
+    codes, uniques = pd.factorize(pd.Series(keys, dtype=object))
+    total = np.zeros(len(uniques), dtype='uint64')
+    np.add.at(total, codes[codes >= 0], hashes[codes >= 0])
+    return pd.Series(total, index=uniques)
+
+
+def companySignatures(_kld2, _kld3, _crsp2, _crsp_n2):
+    """
+    One hash per KLD company of the inputs of its link candidates.
+    """
+    kld3 = _kld3.loc[_kld3.companyname.notna()]
+    kld2 = _kld2.loc[_kld2.companyname.notna()]
+
+    # CRSP rows by CUSIP (Step 1) and by ticker (Step 2)
+    by_cusip = _sumBy(_crsp2.ncusip, _rowHashes(_crsp2, 'ncusip'))
+    by_ticker = _sumBy(_crsp_n2.crsp_ticker, _rowHashes(_crsp_n2, 'crsp_ticker'))
+    crsp_cusip = kld3.cusip.astype(object).map(by_cusip).fillna(0).astype('uint64').to_numpy()
+    crsp_ticker = kld2.ticker.astype(object).map(by_ticker).fillna(0).astype('uint64').to_numpy()
+
+    signature = _sumBy(kld3.companyname, _rowHashes(kld3, 'companyname'))
+    for keys, hashes in [(kld2.companyname, _rowHashes(kld2, 'companyname')),
+                         (kld3.companyname, crsp_cusip),
+                         (kld2.companyname, crsp_ticker)]:
+        part = _sumBy(keys, hashes).reindex(signature.index, fill_value=0)
+        signature = pd.Series(signature.to_numpy() + part.to_numpy().astype('uint64'),
+                              index=signature.index)
+    return signature.rename_axis('companyname').rename('signature').reset_index()
+
+
+def crspNamesSignature(_crsp2):
+    """
+    Hash of the CRSP names the NAME link candidates are drawn from.
+    """
+    return '%016x' % pd.util.hash_pandas_object(_crsp2, index=False).to_numpy().sum()
+
+
+def _sortCusipCandidates(_link1_2, _kld3):
+    """
+    Order of the CUSIP candidates of a full rebuild: sorted by company name,
+    PERMNO and last date, ties in the order in which the CUSIPs first appear
+    in '_kld3' (the order of the merge in 'cusipCandidates').
+    """
+    first = pd.Series(_kld3.cusip.astype(object).drop_duplicates().to_numpy())
+    rank = pd.Series(first.index, index=first.to_numpy())
+    _link1_2 = _link1_2.assign(_rank=_link1_2.cusip_x.astype(object).map(rank).to_numpy())
+    _link1_2 = _link1_2.sort_values(['companyname', 'permno', 'ldate', '_rank'], kind='mergesort')
+    return _link1_2.drop(columns=['_rank']).reset_index(drop=True)
+
+
+class LinkStore:
+
+    def __init__(self, path='link_store'):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    @property
+    def versions(self):
+        index = os.path.join(self.path, 'versions.json')
+        if not os.path.exists(index):
+            return []
+        with open(index) as f:
+            return json.load(f)
+
+    def _file(self, version, part):
+        return os.path.join(self.path, 'v%04d' % version, part + '.parquet')
+
+    def load(self, part='link', version=None):
+        """
+        One part ('link', 'cusip', 'ticker', 'signature' or 'name') of a version,
+        by default of the latest. None if the store is empty.
+        """
+        versions = self.versions
+        if not versions:
+            return None
+        if version is None:
+            version = versions[-1]['version']
+        return pd.read_parquet(self._file(version, part))
+
+    def update(self, _kld2, _kld3, _crsp2, _crsp_n2, name_cache=None,
+               scorer=fuzz.token_set_ratio, name_ratio_quantile=0.10,
+               name_link=False, min_name_ratio=90):
+        """
+        Bring the link table up to date with the current KLD and CRSP tables,
+        re-linking only the companies that are new or changed since the latest
+        version. The name ratios of the candidates are scored with 'scorer';
+        a different scorer than the latest version's re-links every company.
+        Saves a new version if anything changed and returns the KLD-CRSP link
+        table.
+        """
+        signature = companySignatures(_kld2, _kld3, _crsp2, _crsp_n2)
+        names = crspNamesSignature(_crsp2) if name_link else None
+        versions = self.versions
+        latest = versions[-1] if versions else None
+
+        if latest is None or latest['scorer'] != scorerId(scorer):
+            old = None
+            changed = set(signature.companyname)
+            removed = set()
+        else:
+            old = self.load('signature')
+            old_signature = dict(zip(old.companyname, old.signature))
+            changed = set(c for c, s in zip(signature.companyname, signature.signature)
+                          if old_signature.get(c) != s)
+            removed = set(old.companyname) - set(signature.companyname)
+
+        print('Link store: %d companies, %d new or changed, %d removed'
+              % (len(signature), len(changed), len(removed)))
+        if (latest is not None and not changed and not removed
+                and latest.get('name_ratio_quantile') == name_ratio_quantile
+                and latest.get('crsp_names') == names
+                and (not name_link or latest.get('min_name_ratio') == min_name_ratio)):
+            return self.load('link')
+
+        if old is None:
+            cusip = cusipCandidates(_kld3, _crsp2, name_cache=name_cache, scorer=scorer)
+            ticker = tickerCandidates(_kld2, _kld3, cusip, _crsp_n2, name_cache=name_cache,
+                                      scorer=scorer)
+        else:
+            drop = changed | removed
+            cusip, ticker = self.load('cusip'), self.load('ticker')
+            cusip = cusip.loc[~cusip.companyname.isin(drop)]
+            ticker = ticker.loc[~ticker.companyname.isin(drop)]
+            if changed:
+                cusip_new = cusipCandidates(_kld3, _crsp2, name_cache=name_cache, companies=changed,
+                                            scorer=scorer)
+                ticker_new = tickerCandidates(_kld2, _kld3, cusip_new, _crsp_n2,
+                                              name_cache=name_cache, companies=changed, scorer=scorer)
+                cusip = pd.concat([cusip, cusip_new], ignore_index=True)
+                ticker = pd.concat([ticker, ticker_new], ignore_index=True)
+        cusip = _sortCusipCandidates(cusip, _kld3)
+        ticker = ticker.reset_index(drop=True)
+        name = (nameCandidates(_kld2, cusip, ticker, _crsp2, name_cache=name_cache, scorer=scorer)
+                if name_link else None)
+        link = finalizeLinks(cusip, ticker, name, name_ratio_quantile=name_ratio_quantile,
+                             min_name_ratio=min_name_ratio)
+
+        version = latest['version'] + 1 if latest else 1
+        os.makedirs(os.path.dirname(self._file(version, 'link')), exist_ok=True)
+        parts = [('cusip', cusip), ('ticker', ticker), ('signature', signature), ('link', link)]
+        if name_link:
+            parts.append(('name', name))
+        for part, data in parts:
+            data.to_parquet(self._file(version, part), index=False)
+        versions.append({'version': version,
+                         'created': datetime.datetime.now().isoformat(timespec='seconds'),
+                         'scorer': scorerId(scorer),
+                         'name_ratio_quantile': name_ratio_quantile,
+                         'crsp_names': names,
+                         'min_name_ratio': min_name_ratio if name_link else None,
+                         'companies': len(signature),
+                         'changed': len(changed),
+                         'removed': len(removed),
+                         'links': len(link)})
+        with open(os.path.join(self.path, 'versions.json'), 'w') as f:
+            json.dump(versions, f, indent=1)
+        return link
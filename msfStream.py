@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Pak Shing Ho
+
+Streaming version of the crsp.msf pull in step 4 of 'KLD_CRSP_Link.py' and
+'KLD_Compustat_Link.py'.
+
+Instead of loading all of
+    select distinct permno, date, cusip from crsp.msf
+into one DataFrame, msf is fetched in chunks of 'chunk_permnos' PERMNOs
+(restricted to the PERMNOs of the link table when given), each chunk is merged
+and only the merged rows are kept. Peak memory is bounded by the chunk size
+plus the result. Since PERMNO is part of every chunk, 'distinct' per chunk is
+the same as 'distinct' over the whole file.
+
+Usage:
+    linked3 = mergeMsf(conn, KLD_linked, on=['permno', 'date'],
+                       permnos=KLD_CRSP_link.permno, suffixes=('_KLD_LINK', '_crsp'))
+"""
+
+import pandas as pd
+
+from frameSchema import compactFrame
+from parallel import numberRows, concatInOrder # serial merge order
+
+
+def msfPermnos(conn):
+    return conn.raw_sql("select distinct permno from crsp.msf").permno
+
+
+def msfChunks(conn, permnos=None, chunk_permnos=500):
+    """
+    Yield crsp.msf (permno, date, cusip, monthly) in chunks of PERMNOs, with
+    the compact dtypes of 'frameSchema.py'.
+    """
+    if permnos is None:
+        permnos = msfPermnos(conn)
+    permnos = sorted(set(int(p) for p in pd.Series(permnos).dropna()))
+
+    for i in range(0, len(permnos), chunk_permnos):
+        chunk = conn.raw_sql("""
+                             select distinct permno, date,
+                                            cusip
+                             from crsp.msf
+                             where permno in ({})
+                             """.format(', '.join(str(p) for p in permnos[i:i + chunk_permnos])))
+        chunk = compactFrame(chunk)
+        chunk['monthly'] = pd.to_datetime(chunk.date).dt.to_period('M') # month method
+        yield chunk
+
+
+def mergeMsf(conn, other, on, permnos=None, msf_side='right', chunk_permnos=500,
+             suffixes=('_x', '_y')):
+    """
+    Same rows as the inner merge of 'other' with the whole msf, e.g.
+        other.merge(crsp_msf, on=on, suffixes=suffixes)       (msf_side='right')
+        crsp_msf.merge(other, on=on, suffixes=suffixes)       (msf_side='left')
+    but msf is merged chunk by chunk. 'on' must include 'permno'. Rows keep
+    the order of 'other' (msf_side='right') or of msf (msf_side='left').
+    """
+    if permnos is None:
+        permnos = other.permno
+    other = numberRows(other, on)
+
+    merged = []
+    for chunk in msfChunks(conn, permnos, chunk_permnos):
+        part = other[other.permno.isin(chunk.permno.unique())]
+        if msf_side == 'right':
+            merged.append(part.merge(chunk, on=on, suffixes=suffixes))
+        else:
+            merged.append(chunk.merge(part, on=on, suffixes=suffixes))
+
+    if not merged:
+        chunk = pd.DataFrame(columns=['permno', 'date', 'cusip', 'monthly'])
+        chunk = chunk.astype({k: other[k].dtype for k in pd.Index(on).intersection(chunk.columns)})
+        merged = [other.iloc[0:0].merge(chunk, on=on, suffixes=suffixes) if msf_side == 'right'
+                  else chunk.merge(other.iloc[0:0], on=on, suffixes=suffixes)]
+    return concatInOrder(merged, sort=msf_side == 'right')
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Pak Shing Ho
+
+Dictionary of company names (companyname, comnam, conm), each interned once
+to an integer ID with its words and canonical form.
+
+The words of a name are those fuzz.token_set_ratio compares: utils.full_process
+of the name (ASCII, lowercase, punctuation as spaces) split on spaces. The
+canonical form is the sorted distinct words without the legal suffixes
+(INC, CORP, CO, LTD, ...), which are kept aside as a bit mask. Equal
+canonical forms share one canonical ID.
+
+Most name pairs of the link are the same name up to punctuation and legal
+suffixes. token_set_ratio is 100 when the words of one name are all in the
+other, so a pair with equal canonical IDs and one suffix mask within the
+other is an exact match and is not scored (see 'nameRatio.py'). Other
+pairs with equal canonical IDs, e.g. 'APPLE INC' and 'APPLE CORP', are
+still scored, as their ratio is below 100.
+
+Usage:
+    names = NameDictionary()
+    left, right = names.intern(_link.comnam), names.intern(_link.companyname)
+    exact = names.exactMatch(left, right)
+"""
+
+import numpy as np
+import pandas as pd
+from fuzzywuzzy import fuzz, utils
+
+
+LEGAL_SUFFIXES = ('inc', 'incorporated', 'corp', 'corporation', 'co', 'company',
+                  'ltd', 'limited', 'plc', 'llc', 'lp', 'sa', 'ag', 'nv')
+_SUFFIX_BITS = {suffix: np.int64(1) << i for i, suffix in enumerate(LEGAL_SUFFIXES)}
+
+# Scorers that are 100 when the words of one name are all in the other
+EXACT_SCORERS = {fuzz.token_set_ratio, fuzz.partial_token_set_ratio}
+
+
+class NameDictionary:
+    """
+    Integer IDs of names, with their words, canonical forms and suffixes.
+    """
+
+    def __init__(self):
+        self.ids = {}          # name: ID
+        self.names = []        # by ID
+        self.words = []        # by ID, the distinct words
+        self._canonical = []   # by ID, canonical ID
+        self._suffixes = []    # by ID, mask of the legal suffixes
+        self._empty = []       # by ID, no words (scored 0 by the token scorers)
+        self.canonical_ids = {} # canonical form: canonical ID
+
+    def __len__(self):
+        return len(self.names)
+
+    def _add(self, name):
+        words = sorted(set(utils.full_process(name, force_ascii=True).split()))
+        canonical = ' '.join(w for w in words if w not in _SUFFIX_BITS)
+        self.ids[name] = len(self.names)
+        self.names.append(name)
+        self.words.append(tuple(words))
+        self._canonical.append(self.canonical_ids.setdefault(canonical, len(self.canonical_ids)))
+        self._suffixes.append(sum(_SUFFIX_BITS.get(w, 0) for w in words))
+        self._empty.append(not words)
+
+    def intern(self, names):
+        """
+        IDs of 'names' (-1 for missing names), adding the new ones.
+        """
+        codes, uniques = pd.factorize(pd.Series(names).astype(object))
+        for name in uniques:
+            if name not in self.ids:
+                self._add(name)
+        ids = np.array([self.ids[name] for name in uniques] + [-1], dtype='int64')
+        return ids[codes] # code -1 (missing) takes the last entry
+
+    def canonical(self, ids):
+        """
+        Canonical IDs of the name 'ids' (-1 for missing names).
+        """
+        ids = np.asarray(ids, dtype='int64')
+        canonical = np.append(np.asarray(self._canonical, dtype='int64'), -1)
+        return canonical[ids]
+
+    def exactMatch(self, left, right):
+        """
+        True for the pairs of name IDs on which token_set_ratio is 100
+        without scoring: equal canonical IDs and the suffixes of one name
+        all in the other.
+        """
+        left, right = np.asarray(left, dtype='int64'), np.asarray(right, dtype='int64')
+        if not len(self):
+            return np.zeros(len(left), dtype=bool)
+        suffixes = np.asarray(self._suffixes, dtype='int64')
+        empty = np.asarray(self._empty, dtype=bool)
+        valid = (left >= 0) & (right >= 0)
+        left, right = np.where(valid, left, 0), np.where(valid, right, 0)
+        common = suffixes[left] & suffixes[right]
+        return (valid & (self.canonical(left) == self.canonical(right))
+                & ~empty[left] & ~empty[right]
+                & ((common == suffixes[left]) | (common == suffixes[right])))
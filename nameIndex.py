@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Pak Shing Ho
+
+Inverted index of company names by their words, to find the closest CRSP
+names of the KLD companies linked neither by CUSIP nor by ticker (the name
+link of 'kldCrspLink.py').
+
+Scoring every KLD name against every CRSP name with fuzz.token_set_ratio
+costs one call per pair. NameTokenIndex splits the distinct names into
+lowercase words, as fuzz.utils.full_process does, and weights each word by
+its inverse document frequency (TF-IDF). A query name is only compared with
+the names sharing one of its rarer words: words in more than 'max_postings'
+names ('INC', 'CORP', 'CO', ...) are not used to find candidates, so each
+query touches at most a few thousand names. The candidates are ranked by the
+cosine similarity of their weighted words (all words, common ones included)
+and the 'top_k' best names are kept for the exact scorer.
+
+Usage:
+    index = NameTokenIndex(_crsp2.comnam)
+    query, row, similarity = index.query(_nomatch.companyname, top_k=10)
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+def nameTokens(names):
+    """
+    (name position, word code) of the distinct words of each name, and the
+    words. Missing names have no words.
+    """
+    words = (pd.Series(names, dtype=object).str.lower()
+             .str.replace(r'[^a-z0-9]+', ' ', regex=True).str.split().explode().dropna())
+    pairs = pd.DataFrame({'name': words.index.to_numpy(), 'word': words.to_numpy()}).drop_duplicates()
+    codes, vocabulary = pd.factorize(pairs.word)
+    return pairs.name.to_numpy(dtype='int64'), codes, vocabulary
+
+
+def _unitRows(rows, columns, weights, shape):
+    """
+    Sparse matrix of the word 'weights' with rows scaled to unit length.
+    """
+    matrix = sparse.csr_matrix((weights, (rows, columns)), shape=shape)
+    norm = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norm[norm == 0] = 1
+    return sparse.diags(1 / norm) @ matrix
+
+
+class NameTokenIndex:
+    """
+    Index of the rows of 'names' by the words of their name.
+    """
+
+    def __init__(self, names, max_postings=1000):
+        self.codes, self.names = pd.factorize(pd.Series(names).astype(object))
+        self.max_postings = max_postings
+
+        name, word, self.words = nameTokens(self.names)
+        self.frequency = np.bincount(word, minlength=len(self.words))
+        self.idf = np.log((len(self.names) + 1) / (self.frequency + 1)) + 1
+        self.matrix = _unitRows(name, word, self.idf[word], (len(self.names), len(self.words)))
+        # the names containing each word used to find candidates
+        rare = self.frequency <= max_postings
+        self.postings = sparse.diags(rare.astype('float64')) @ (self.matrix.T.tocsr() > 0)
+
+        # rows of each distinct name
+        named = np.flatnonzero(self.codes >= 0)
+        valid = self.codes[named]
+        self.rows = named[np.argsort(valid, kind='stable')]
+        self.bounds = np.concatenate([[0], np.cumsum(np.bincount(valid, minlength=len(self.names)))])
+
+    def _vectors(self, names):
+        """
+        Unit word vectors of 'names' over the words of the index. Words
+        missing from the index count in the length with the largest weight.
+        """
+        name, word, words = nameTokens(names)
+        known = self.words.get_indexer(words)[word]
+        weight = np.where(known >= 0, self.idf[np.maximum(known, 0)], np.log(len(self.names) + 1) + 1)
+        norm = np.sqrt(np.bincount(name, weights=weight ** 2, minlength=len(names)))
+        norm[norm == 0] = 1
+        keep = known >= 0
+        return sparse.csr_matrix((weight[keep] / norm[name[keep]], (name[keep], known[keep])),
+                                 shape=(len(names), len(self.words)))
+
+    def similar(self, names, top_k=10):
+        """
+        (query, name, similarity): the 'top_k' distinct names of the index
+        most similar to each of 'names', by query and decreasing similarity.
+        """
+        names = pd.Series(names).astype(object).to_numpy()
+        vectors = self._vectors(names)
+        # pairs sharing at least one rare word
+        shared = ((vectors > 0).astype('float64') @ self.postings).tocoo()
+        query, name = shared.row.astype('int64'), shared.col.astype('int64')
+        similarity = np.asarray(vectors[query].multiply(self.matrix[name]).sum(axis=1)).ravel()
+
+        order = np.lexsort((name, -similarity, query))
+        query, name, similarity = query[order], name[order], similarity[order]
+        first = np.searchsorted(query, query) # position of each query's best name
+        keep = np.arange(len(query)) - first < top_k
+        return query[keep], name[keep], similarity[keep]
+
+    def query(self, names, top_k=10):
+        """
+        (query, row, similarity): the rows of the 'top_k' distinct names most
+        similar to each of 'names', by query, decreasing similarity and row.
+        """
+        query, name, similarity = self.similar(names, top_k)
+        counts = self.bounds[name + 1] - self.bounds[name]
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        rows = self.rows[np.repeat(self.bounds[name], counts) + offsets]
+        return np.repeat(query, counts), rows, np.repeat(similarity, counts)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Pak Shing Ho
+
+Input: a DataFrame and the two company name columns to compare
+Output: return a Series of name matching ratios aligned with the DataFrame
+
+Computing 'name_ratio' with
+    data.apply(lambda x: fuzz.token_set_ratio(x.comnam, x.companyname), axis=1)
+calls the scorer once per row, although most (comnam, companyname) pairs repeat
+across years. Here the distinct pairs are scored once, in batches spread over a
+process pool, and the scores are broadcast back to every row. The scores are
+exactly those of the scorer (fuzz.token_set_ratio by default).
+
+The names are interned in a NameDictionary ('nameDictionary.py'), so the
+distinct pairs are found on integer IDs, and with the token set scorers the
+pairs that are the same name up to punctuation and legal suffixes are given
+100 without being scored. Each call has its own dictionary unless one is
+passed in.
+
+The batches are scored over the forked process pool of 'parallel.py'.
+"""
+
+import numpy as np
+import pandas as pd
+from fuzzywuzzy import fuzz
+
+from nameDictionary import NameDictionary, EXACT_SCORERS
+from nameRatioCache import normalizer
+from parallel import mapTasks # forked process pool
+from stageMetrics import stage # timings and row counts, when a run is recording
+
+
+def _scoreBatch(args):
+    scorer, left, right = args
+    return [scorer(a, b) for a, b in zip(left, right)]
+
+
+def scorePairs(left, right, scorer=fuzz.token_set_ratio, n_jobs=None,
+               batch_size=5000):
+    """
+    Score two equally long lists of names pairwise, in batches of 'batch_size'
+    over 'n_jobs' processes (default: all cores). Returns a list of scores.
+    """
+    left, right = list(left), list(right)
+    batches = [(scorer, left[i:i + batch_size], right[i:i + batch_size])
+               for i in range(0, len(left), batch_size)]
+    return [s for scores in mapTasks(_scoreBatch, batches, n_jobs) for s in scores]
+
+
+def _cachedScores(left, right, scorer, cache, n_jobs, batch_size):
+    """
+    Score distinct pairs, looking them up in a NameRatioCache first. Only the
+    pairs missing from the cache are scored, and their scores are stored.
+    Pairs with a missing name are always scored directly.
+    """
+    norm = normalizer(scorer)
+    keys = [None if pd.isnull(a) or pd.isnull(b) else (norm(a), norm(b))
+            for a, b in zip(left, right)]
+
+    distinct = {}
+    for a, b, key in zip(left, right, keys):
+        if key is not None and key not in distinct:
+            distinct[key] = (a, b)
+    known = cache.get(scorer, list(distinct))
+
+    todo = [key for key in distinct if key not in known]
+    print('Name ratio cache: %d hits, %d misses' % (len(known), len(todo)))
+    scored = scorePairs([distinct[key][0] for key in todo],
+                        [distinct[key][1] for key in todo],
+                        scorer=scorer, n_jobs=n_jobs, batch_size=batch_size)
+    new = dict(zip(todo, scored))
+    cache.put(scorer, new)
+    known.update(new)
+
+    return [scorer(a, b) if key is None else known[key]
+            for a, b, key in zip(left, right, keys)]
+
+
+def nameRatio(DataFrame, left='comnam', right='companyname',
+              scorer=fuzz.token_set_ratio, n_jobs=None, batch_size=5000,
+              cache=None, names=None):
+    """
+    Equivalent to
+        DataFrame.apply(lambda x: scorer(x[left], x[right]), axis=1)
+    but each distinct (left, right) pair is scored only once, and exact
+    matches (see 'nameDictionary.py') are not scored. If a NameRatioCache is
+    given, pairs scored in earlier runs are not re-scored. The names are
+    interned in 'names', a NameDictionary that several calls can share (by
+    default, a new one).
+    """
+    if names is None:
+        names = NameDictionary()
+    left_ids, right_ids = names.intern(DataFrame[left]), names.intern(DataFrame[right])
+    codes, unique = pd.factorize((left_ids + 1) * (len(names) + 1) + right_ids + 1)
+    unique_left, unique_right = unique // (len(names) + 1) - 1, unique % (len(names) + 1) - 1
+    if scorer in EXACT_SCORERS:
+        exact = names.exactMatch(unique_left, unique_right)
+    else:
+        exact = np.zeros(len(unique), dtype=bool)
+    print('Name ratio: %d distinct pairs, %d exact matches' % (len(unique), exact.sum()))
+
+    # missing names as None, which the fuzz scorers score 0 (NaN would be scored as 'nan')
+    strings = np.array(names.names + [None], dtype=object)
+    todo_left, todo_right = strings[unique_left[~exact]], strings[unique_right[~exact]]
+
+    # input rows, and the distinct pairs scored (or looked up in the cache)
+    with stage('name_ratio', DataFrame) as s:
+        scores = np.full(len(unique), 100, dtype='int64')
+        if cache is None:
+            scores[~exact] = scorePairs(todo_left, todo_right, scorer=scorer,
+                                        n_jobs=n_jobs, batch_size=batch_size)
+        else:
+            scores[~exact] = _cachedScores(list(todo_left), list(todo_right), scorer,
+                                           cache, n_jobs, batch_size)
+        s.output(scores)
+    return pd.Series(scores[codes], index=DataFrame.index)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Pak Shing Ho
+
+A persistent store of company-name similarity scores, so that reruns of
+'KLD_CRSP_Link.py' / 'KLD_Compustat_Link.py' only score new name pairs.
+
+Scores are kept in a SQLite file keyed on (scorer, left name, right name).
+The scorer is identified by its module, name and the fuzzywuzzy version. Names
+are normalized the way the scorer itself pre-processes them (utils.full_process
+for the token/WRatio scorers), so differently punctuated spellings share one
+entry without changing the score. Other scorers are keyed on the raw strings.
+
+The store holds at most 'max_entries' scores; the least recently used ones are
+evicted as soon as new scores are stored. The cache is only used when a file
+is given (NAME_CACHE in the link scripts, name_cache in 'pipeline.py').
+
+Usage:
+    cache = NameRatioCache('name_ratio_cache.sqlite')
+    _link['name_ratio'] = nameRatio(_link, 'comnam', 'companyname', cache=cache)
+    cache.close()
+"""
+
+import sqlite3
+import time
+
+import fuzzywuzzy
+from fuzzywuzzy import fuzz, utils
+
+
+# Scorers whose result only depends on utils.full_process of both names
+_FULL_PROCESS_SCORERS = {fuzz.token_set_ratio, fuzz.token_sort_ratio,
+                         fuzz.partial_token_set_ratio, fuzz.partial_token_sort_ratio,
+                         fuzz.WRatio, fuzz.QRatio, fuzz.UWRatio, fuzz.UQRatio}
+
+
+def scorerId(scorer):
+    return '%s.%s@%s' % (scorer.__module__, scorer.__qualname__,
+                         fuzzywuzzy.__version__)
+
+
+def normalizer(scorer):
+    """
+    Return the function mapping a name to its cache key for 'scorer'.
+    """
+    if scorer in _FULL_PROCESS_SCORERS:
+        force_ascii = scorer not in (fuzz.UWRatio, fuzz.UQRatio)
+        return lambda s: utils.full_process(s, force_ascii=force_ascii)
+    return lambda s: s
+
+
+class NameRatioCache:
+
+    def __init__(self, path='name_ratio_cache.sqlite', max_entries=2000000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("""
+                          create table if not exists ratios
+                          (scorer text, name1 text, name2 text, score integer, used real,
+                          primary key (scorer, name1, name2))
+                          """)
+        self.conn.execute("create index if not exists ratios_used on ratios (used)")
+
+    def get(self, scorer, keys):
+        """
+        Look up a list of (left, right) keys. Returns a dict of the cached ones
+        and marks them as recently used.
+        """
+        sid = scorerId(scorer)
+        cur = self.conn.cursor()
+        cur.execute("create temp table if not exists _keys (name1 text, name2 text)")
+        cur.execute("delete from _keys")
+        cur.executemany("insert into _keys values (?, ?)", keys)
+        found = cur.execute("""
+                            select r.name1, r.name2, r.score
+                            from ratios as r, _keys as k
+                            where r.scorer = ? and r.name1 = k.name1 and r.name2 = k.name2
+                            """, (sid,)).fetchall()
+        now = time.time()
+        cur.executemany("update ratios set used = ? where scorer = ? and name1 = ? and name2 = ?",
+                        [(now, sid, left, right) for left, right, _ in found])
+        cur.execute("delete from _keys")
+        self.conn.commit()
+
+        found = {(left, right): score for left, right, score in found}
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put(self, scorer, scores):
+        """
+        Store a dict mapping (left, right) keys to scores, evicting the least
+        recently used ones beyond 'max_entries'.
+        """
+        sid, now = scorerId(scorer), time.time()
+        self.conn.executemany("insert or replace into ratios values (?, ?, ?, ?, ?)",
+                              [(sid, left, right, int(score), now)
+                               for (left, right), score in scores.items()])
+        self.conn.commit()
+        self.flush()
+
+    def flush(self):
+        """
+        Evict the least recently used scores beyond 'max_entries'.
+        """
+        n = self.conn.execute("select count(*) from ratios").fetchone()[0]
+        if n > self.max_entries:
+            self.conn.execute("""
+                              delete from ratios where rowid in
+                              (select rowid from ratios order by used limit ?)
+                              """, (n - self.max_entries,))
+            self.conn.commit()
+
+    def report(self):
+        print('Name ratio cache total: %d hits, %d misses' % (self.hits, self.misses))
+
+    def close(self):
+        self.flush()
+        self.report()
+        self.conn.close()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Pak Shing Ho
+
+Batches of PanelOLS regressions on one panel, such as the specifications of
+'stats_analysis.ipynb' or robustness grids over dependent variables,
+controls and effects.
+
+Fitting each specification with PanelOLS.from_formula(spec, data).fit()
+parses its formula, converts the panel and drops its missing rows from
+scratch. Here:
+    - each formula is parsed once ('dep ~ 1 + x1 + x2 + EntityEffects'),
+    - the variables are converted to float64 once, with one 'Intercept'
+      column, and the missing-value mask of every variable is computed once,
+    - the sample of a specification is the rows complete in its variables;
+      specifications with the same sample share one copy of its rows, and
+      each gets its dependent and exog columns from it through the PanelOLS
+      constructor,
+    - the groups of specifications with the same sample are fitted over
+      the forked process pool of 'parallel.py'.
+The models are plain PanelOLS models, so the estimates, standard errors and
+R2 measures are those of PanelOLS.from_formula. Formulas with other terms
+(transformations, interactions) are fitted with PanelOLS.from_formula.
+
+Usage:
+    data = df_wins.set_index(['sic2', 'fyear'])
+    specs = ['markup ~ 1 + ESGIndex',
+             'markup ~ 1 + size + ESGIndex + EntityEffects + TimeEffects']
+    results = fitSpecs(data, specs, cov_type='kernel') # {'1': ..., '2': ...}
+    print(compareSpecs(data, specs, cov_type='kernel').summary)
+"""
+
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from linearmodels import PanelOLS
+from linearmodels.panel import compare
+
+from parallel import mapTasks # forked process pool
+
+
+Spec = namedtuple('Spec', ['dependent', 'exog', 'constant', 'entity_effects', 'time_effects'])
+
+_EFFECTS = {'EntityEffects': 'entity_effects', 'FixedEffects': 'entity_effects',
+            'TimeEffects': 'time_effects'}
+_NAME = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+@lru_cache(maxsize=None)
+def parseSpec(formula):
+    """
+    Spec of a formula 'dep ~ 1 + x1 + x2 [+ EntityEffects] [+ TimeEffects]'
+    (column names, a constant and effects only), None for other formulas.
+    """
+    if formula.count('~') != 1:
+        return None
+    dependent, terms = (side.strip() for side in formula.split('~'))
+    exog, constant, effects = [], False, {'entity_effects': False, 'time_effects': False}
+    for term in terms.split('+'):
+        term = term.strip()
+        if term == '1':
+            constant = True
+        elif term in _EFFECTS:
+            effects[_EFFECTS[term]] = True
+        elif _NAME.match(term) and term not in exog:
+            exog.append(term)
+        else:
+            return None
+    if not _NAME.match(dependent) or not (exog or constant):
+        return None
+    return Spec(dependent, tuple(exog), constant, **effects)
+
+
+def _fitGroup(frame, specs, fit_options):
+    """
+    Fit the (name, formula, Spec) 'specs', all on the rows of 'frame'.
+    """
+    results = {}
+    for name, formula, spec in specs:
+        exog = (['Intercept'] if spec.constant else []) + list(spec.exog)
+        model = PanelOLS(frame[spec.dependent], frame[exog],
+                         entity_effects=spec.entity_effects, time_effects=spec.time_effects)
+        model.formula = formula
+        results[name] = model.fit(**fit_options)
+    return results
+
+
+# The panel and the groups of specifications, inherited by the forked workers
+_BATCH = None
+
+
+def _fitBatchGroup(i):
+    frame, groups, fit_options = _BATCH
+    rows, specs = groups[i]
+    return _fitGroup(frame.iloc[rows], specs, fit_options)
+
+
+def fitSpecs(data, specs, n_jobs=None, **fit_options):
+    """
+    Fit the PanelOLS specifications 'specs' (a list of formulas, named '1',
+    '2', ..., or a dict of name: formula) on the panel 'data' (indexed by
+    entity and time), with PanelOLS.fit keyword arguments 'fit_options'
+    (e.g. cov_type='kernel'). Groups of specifications with the same sample
+    are fitted over 'n_jobs' processes (default: all cores). Returns a dict
+    of name: PanelEffectsResults, in the order of 'specs'.
+    """
+    global _BATCH
+    if not isinstance(specs, dict):
+        specs = {str(i + 1): formula for i, formula in enumerate(specs)}
+    parsed = {name: parseSpec(formula) for name, formula in specs.items()}
+    variables = sorted({v for s in parsed.values() if s is not None for v in (s.dependent,) + s.exog})
+    # variables PanelData would expand into dummies go through from_formula
+    numeric = {v for v in variables if v in data and pd.api.types.is_numeric_dtype(data[v].dtype)}
+    parsed = {name: s if s is not None and {s.dependent, *s.exog} <= numeric else None
+              for name, s in parsed.items()}
+
+    frame = data[sorted(numeric)].astype('float64')
+    frame.insert(0, 'Intercept', 1.0)
+    present = frame.notna().to_numpy()
+    position = {c: j for j, c in enumerate(frame.columns)}
+
+    # specifications by sample: the rows complete in all their variables
+    groups = {}
+    for name, spec in parsed.items():
+        if spec is None:
+            continue
+        rows = present[:, [position[v] for v in (spec.dependent,) + spec.exog]].all(axis=1)
+        key = np.packbits(rows).tobytes()
+        groups.setdefault(key, (np.flatnonzero(rows), []))[1].append((name, specs[name], spec))
+    groups = list(groups.values())
+    print('%d specifications, %d samples' % (len(specs), len(groups)))
+
+    fitted = {}
+    _BATCH = (frame, groups, fit_options)
+    try:
+        for results in mapTasks(_fitBatchGroup, range(len(groups)), n_jobs):
+            fitted.update(results)
+    finally:
+        _BATCH = None
+
+    for name, spec in parsed.items():
+        if spec is None:
+            fitted[name] = PanelOLS.from_formula(specs[name], data=data).fit(**fit_options)
+    return {name: fitted[name] for name in specs}
+
+
+def compareSpecs(data, specs, n_jobs=None, precision='pvalues', **fit_options):
+    """
+    compare() table of fitSpecs(data, specs, n_jobs, **fit_options).
+    """
+    return compare(fitSpecs(data, specs, n_jobs, **fit_options), precision=precision)
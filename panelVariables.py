@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Pak Shing Ho
+
+KLD indices and Compustat ratios and controls of 'KLD_Compustat.ipynb', as
+functions of the merged KLD-Compustat table.
+
+    kldIndices: strength/concern counts and the KLD, E, S, G, controversy,
+        ESG and sub-category indices (KLD_COLUMNS)
+    fundaRatios: the ratios of the SAS WRDS financial ratio suite and the
+        markup variables (COMP_COLUMNS), and the controls (CONTROL_COLUMNS,
+        except the CAPM beta 'b_mkt')
+    attachBetas: the CAPM beta 'b_mkt' of the WRDS Beta Suite file
+        'data/CAPM_beta.csv.gz' known at each fiscal year end
+
+The beta file is far larger than the panel. attachBetas reads it in chunks,
+keeps only the PERMNOs and dates of the panel, parses the dates with their
+fixed format, and joins each row to the last beta of its PERMNO on or before
+its 'datadate' (point in time, within 'tolerance').
+
+Usage:
+    data = readTable('KLD_Compustat.csv', dtype={'gvkey': str})
+    data = fundaRatios(kldIndices(data))
+    data = attachBetas(data)
+"""
+
+import numpy as np
+import pandas as pd
+
+from esgIndices import esgIndices
+from ratioLibrary import evaluateRatios
+
+
+KLD_COLUMNS = ['positive', 'negative', 'positive_avg', 'negative_avg',
+               'KLD Index', 'KLD Index Norm',
+               'E_pos', 'E_neg', 'E Index', 'S_pos', 'S_neg', 'S Index',
+               'G_pos', 'G_neg', 'G Index', 'Controv Index',
+               'COM_pos', 'COM_neg', 'ESG_COM', 'DIV_pos', 'DIV_neg', 'ESG_DIV',
+               'EMP_pos', 'EMP_neg', 'ESG_EMP', 'ENV_pos', 'ENV_neg', 'ESG_ENV',
+               'HUM_pos', 'HUM_neg', 'ESG_HUM', 'PRO_pos', 'PRO_neg', 'ESG_PRO',
+               'CGOV_pos', 'CGOV_neg', 'ESG_CGOV',
+               'ESG_A_ex_CG_pos', 'ESG_A_ex_CG_neg', 'ESG Pos-Neg Ex-CG Index',
+               'ESG_A_pos', 'ESG_A_neg', 'ESG Pos-Neg A Index']
+
+COMP_COLUMNS = ['sale', 'cogs', 'ppegt', 'xsga', 'xlr', 'emp', 'xad', 'xrd', 'at', 'sich',
+                'ppent', 'aqc', 'capx', 'capxv',
+                'gpm', 'npm', 'roa', 'roe', 'bm', 'evm', 'pe_exi', 'pe_inc', 'pe_ib', 'pe_ni',
+                'rd_sale', 'adv_sale', 'xsga_sale',
+                'markup_acct', 'market_sale', 'div_sale', 'markup', 'markup_overhead',
+                'econ_profit', 'profit_rate', 'op_profit_rate', 'econ_roa']
+
+CONTROL_COLUMNS = ['size', 'lev', 'rdi', 'adi']
+
+BETA_FILE = 'data/CAPM_beta.csv.gz'
+
+# Columns set by fundaRatios, in the order of 'KLD_Compustat.ipynb'
+FUNDA_RATIO_COLUMNS = ['gpm', 'npm', 'roa', 'ps', 'txditc', 'be', 'roe', 'bm', 'ebitda', 'ev', 'evm',
+                       'pe_exi', 'pe_inc', 'pe_ib', 'pe_ni', 'rd_sale', 'adv_sale', 'xsga_sale',
+                       'markup_acct', 'market_sale', 'div_sale', 'markup', 'markup_overhead',
+                       'econ_profit', 'profit_rate', 'op_profit_rate', 'econ_roa',
+                       'size', 'lev', 'rdi', 'adi']
+
+# Columns added by kldIndices, in the order of 'KLD_Compustat.ipynb'
+KLD_INDEX_COLUMNS = ['positive', 'negative', 'positive_avg', 'negative_avg',
+                     'KLD Index', 'KLD Index Norm',
+                     'E_pos', 'E_neg', 'E Index', 'S_pos', 'S_neg', 'S Index',
+                     'G_pos', 'G_neg', 'G Index', 'Controv', 'Controv Index',
+                     'ESG_pos', 'ESG_neg', 'ESG Pos-Neg Index', 'ESG Agg Index',
+                     'COM_pos', 'COM_neg', 'ESG_COM', 'DIV_pos', 'DIV_neg', 'ESG_DIV',
+                     'EMP_pos', 'EMP_neg', 'ESG_EMP', 'ENV_pos', 'ENV_neg', 'ESG_ENV',
+                     'HUM_pos', 'HUM_neg', 'ESG_HUM', 'PRO_pos', 'PRO_neg', 'ESG_PRO',
+                     'CGOV_pos', 'CGOV_neg', 'ESG_CGOV',
+                     'ESG_A_ex_CG_pos', 'ESG_A_ex_CG_neg', 'ESG Pos-Neg Ex-CG Index',
+                     'ESG_A_pos', 'ESG_A_neg', 'ESG Pos-Neg A Index']
+
+
+def kldIndices(data):
+    """
+    KLD counts and indices of 'KLD_Compustat.ipynb' (KLD_COLUMNS), from one
+    pass over the KLD items (see 'esgIndices.py').
+    """
+    indices = esgIndices(data, KLD_INDEX_COLUMNS)
+    return pd.concat([data.drop(columns=data.columns.intersection(KLD_INDEX_COLUMNS)), indices], axis=1)
+
+
+def fundaRatios(data):
+    """
+    Compustat ratios (COMP_COLUMNS) and controls (CONTROL_COLUMNS) of
+    'KLD_Compustat.ipynb', with the intermediate 'ps', 'be' and 'ev', and
+    'txditc' and 'ebitda' replaced by their coalesced values (see
+    'ratioLibrary.py').
+    """
+    ratios = evaluateRatios(data, FUNDA_RATIO_COLUMNS)
+    data = data.copy(deep=False) # the columns below are replaced, not written to
+    for c in ratios.columns:
+        data[c] = ratios[c].to_numpy()
+    return data
+
+
+def betaChunks(path=BETA_FILE, permnos=None, start=None, end=None,
+               chunksize=1000000, date_format='%Y/%m/%d'):
+    """
+    Yield the (permno, date, b_mkt) rows of the beta file in chunks, only
+    those of 'permnos' and dated between 'start' and 'end' when given.
+    """
+    if permnos is not None:
+        permnos = pd.Index(permnos).astype('int64')
+    for chunk in pd.read_csv(path, usecols=['PERMNO', 'DATE', 'b_mkt'], chunksize=chunksize,
+                             dtype={'PERMNO': 'float64', 'DATE': str, 'b_mkt': 'float64'}):
+        if permnos is not None:
+            chunk = chunk[chunk.PERMNO.isin(permnos)]
+        chunk = pd.DataFrame({'permno': chunk.PERMNO.to_numpy(),
+                              'date': pd.to_datetime(chunk.DATE, format=date_format).to_numpy(),
+                              'b_mkt': chunk.b_mkt.to_numpy()})
+        if start is not None:
+            chunk = chunk[chunk.date >= start]
+        if end is not None:
+            chunk = chunk[chunk.date <= end]
+        yield chunk
+
+
+def attachBetas(data, path=BETA_FILE, on='datadate', tolerance='366D',
+                chunksize=1000000, date_format='%Y/%m/%d'):
+    """
+    'data' with 'b_mkt': the last beta of the row's PERMNO dated on or
+    before its fiscal year end 'on', and at most 'tolerance' before it
+    (missing otherwise). The beta file is streamed in chunks of 'chunksize'
+    rows (see betaChunks). Rows keep their order.
+    """
+    dates = data[on]
+    if not pd.api.types.is_datetime64_any_dtype(dates):
+        dates = pd.to_datetime(dates, format='%Y-%m-%d')
+    tolerance = pd.Timedelta(tolerance)
+    keys = pd.DataFrame({'permno': data.permno.to_numpy(dtype='float64', na_value=np.nan),
+                         'date': dates.to_numpy(), 'row': np.arange(len(data))})
+    keys = keys.dropna(subset=['permno', 'date']).astype({'permno': 'int64'})
+
+    betas = pd.concat(betaChunks(path, keys.permno.unique(), keys.date.min() - tolerance,
+                                 keys.date.max(), chunksize, date_format), ignore_index=True)
+    print('Betas kept: %d rows, %d PERMNOs' % (len(betas), betas.permno.nunique()))
+    betas = betas.dropna(subset=['permno', 'date']).astype({'permno': 'int64'})
+    betas = betas.sort_values('date', kind='stable')
+
+    linked = pd.merge_asof(keys.sort_values('date', kind='stable'), betas, on='date', by='permno',
+                           direction='backward', tolerance=tolerance)
+    b_mkt = np.full(len(data), np.nan)
+    b_mkt[linked.row.to_numpy()] = linked.b_mkt.to_numpy()
+    data = data.copy(deep=False) # the column below is replaced, not written to
+    data['b_mkt'] = b_mkt
+    return data
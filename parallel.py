@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Pak Shing Ho
+
+Process pool and row order shared by the parallel steps ('nameRatio.py',
+'yearShards.py', 'msfStream.py', 'panelRegressions.py').
+
+mapTasks runs a function over a list of tasks on a pool of forked processes.
+Worker processes are only used where the 'fork' start method exists. With
+'spawn' (Windows, macOS default) every worker would re-import and re-run the
+calling script, so the tasks run in this process instead. Forked workers
+inherit the module globals set before the call, so large inputs kept there
+are not pickled.
+
+pandas' inner merge keeps the left rows grouped by key, in the order in which
+the keys first appear. A merge done in parts (years, PERMNO chunks) gets the
+rows of the serial merge back by numbering the left rows with numberRows
+before, and concatenating the parts with concatInOrder after.
+
+Usage:
+    scores = mapTasks(_scoreBatch, batches, n_jobs=4)
+    left = numberRows(left, on=['permno', 'date'])
+    merged = concatInOrder([part.merge(right, on=['permno', 'date']) for part in parts])
+"""
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+
+def mapTasks(func, tasks, n_jobs=None):
+    """
+    [func(task) for task in tasks], over 'n_jobs' forked processes (default:
+    all cores), or in this process with one task, one job or without 'fork'.
+    """
+    tasks = list(tasks)
+    n_jobs = os.cpu_count() if n_jobs is None else n_jobs
+    if (n_jobs <= 1 or len(tasks) <= 1
+            or 'fork' not in multiprocessing.get_all_start_methods()):
+        return [func(task) for task in tasks]
+
+    with ProcessPoolExecutor(max_workers=min(n_jobs, len(tasks)),
+                             mp_context=multiprocessing.get_context('fork')) as pool:
+        return list(pool.map(func, tasks))
+
+
+def numberRows(DataFrame, on):
+    """
+    'DataFrame' with its row number ('_row') and the number of its 'on' key
+    in order of first appearance ('_key').
+    """
+    return DataFrame.assign(_row=np.arange(len(DataFrame)),
+                            _key=DataFrame.groupby(on, sort=False, dropna=False, observed=True)
+                            .ngroup().to_numpy())
+
+
+def concatInOrder(parts, sort=True):
+    """
+    The merged 'parts' of a frame numbered by numberRows, as one frame in the
+    row order of the serial merge (or in the order of the parts if not
+    'sort'), without '_row' and '_key'.
+    """
+    merged = pd.concat(parts, ignore_index=True)
+    if sort:
+        merged = merged.sort_values(['_key', '_row'], kind='mergesort')
+    return merged.drop(columns=['_row', '_key']).reset_index(drop=True)
@@ -0,0 +1,460 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Pak Shing Ho
+
+The KLD-Compustat pipeline as a graph of stages:
+
+    extract_*      WRDS pulls (kld.history, crsp.stocknames, CCM link, funda)
+    cusip_correct  CUSIP correction and cleaning of KLD
+    cusip_link     KLD-CRSP link candidates by CUSIP (Step 1)
+    ticker_link    KLD-CRSP link candidates by ticker (Step 2)
+    name_link      KLD-CRSP link candidates by company name, of the companies
+                   without CUSIP or ticker candidates (empty unless 'enabled')
+    link_scores    final KLD-CRSP link table and scores (Step 3)
+    ccm_match      KLD-CRSP merged with crsp.msf and the CCM link (Part 2)
+    funda_merge    KLD-CRSP-CCM merged with funda, the link tables (Part 3)
+    panel          KLD and funda merged with the link table
+                   ('KLD_Compustat_collection.py')
+    index_ratio    KLD indices and Compustat ratios ('KLD_Compustat.ipynb')
+
+Each stage declares the tables it reads and writes, its parameters, and its
+execution options (chunk sizes, processes), which do not change the result.
+Tables are kept as Parquet files in 'pipeline_store/', with 'manifest.json'
+holding, for each stage, a fingerprint of its code, parameters and the content
+hashes of its inputs. A stage runs only if its fingerprint changed (or its
+outputs are missing); if it re-runs and its outputs come out the same, the
+stages after it are skipped too. So changing the 'name_ratio_quantile' of
+'link_scores' re-runs link_scores and the stages after it, but not the WRDS
+pulls nor the name ratios.
+
+The extract stages only depend on their SQL: WRDS data is pulled again when
+the query changes, or with 'force', e.g. force=['extract_funda']; the pulls run
+at the same time over a pool of connections (see 'wrdsPool.py'). msf is read
+inside 'ccm_match', streamed through the WRDS cache of 'wrdsCache.py'. After
+changing the helper modules of a stage, force the stage.
+
+Usage:
+    python pipeline.py
+    tables = runPipeline(targets=['kld_crsp_ccm_comp_link'],
+                         params={'link_scores': {'name_ratio_quantile': 0.10}})
+"""
+
+import datetime
+import hashlib
+import inspect
+import json
+import os
+import time
+
+import pandas as pd
+
+from wrdsCache import CachedConnection
+from wrdsPool import extractTables
+from frameSchema import compactFrame
+from nameRatioCache import NameRatioCache
+from cusipCorrection import cusipCorrectionFast
+from kldCrspLink import cleanKld, addKldDates, kldCusipDates, crspCusipNames, crspTickerNames
+from kldCrspLink import cusipCandidates, tickerCandidates, nameCandidates, finalizeLinks
+from kldCompLink import alignKldDates, linkMsf, matchCcm, mergeCompFunda, compLink, mergePanel
+from panelVariables import kldIndices, fundaRatios
+from fundaManifest import fundaQuery, FUNDA_OUTPUTS
+from tableStore import writeTable
+import stageMetrics
+
+
+KLD_SQL = """
+          select ticker, cusip, companyname, year from kld.history
+          """
+
+KLD_HISTORY_SQL = """
+                  select *
+                  from kld.history
+                  """
+
+CRSP_CUSIP_SQL = """
+                 select permno, ncusip, cusip, comnam, namedt, nameenddt
+                 from crsp.stocknames
+                 where ncusip != ''
+                 """
+
+CRSP_TICKER_SQL = """ select ticker, comnam, permno, ncusip, namedt, nameenddt
+                      from crsp.stocknames """
+
+CCM_SQL = """
+          select distinct a.permno, gvkey, date
+          from
+          crsp.msf as a,
+          crsp.msenames as b,
+          crsp.Ccmxpf_linktable as c
+          where
+          shrcd in (10,11)
+          and linktype in ('LU','LC')
+          and LINKPRIM in ('P','C')
+          and USEDFLAG=1
+          and a.permno = b.permno and b.permno = lpermno
+          and NAMEDT <= date and date <= NAMEENDT
+          and linkdt <= date and date <= coalesce(linkenddt, current_date)
+          """
+
+FUNDA_LINK_SQL = """
+                 select gvkey, datadate, fyear, conm
+                 from
+                 comp.funda
+                 where
+                 (sale > 0 or at > 0)
+                 and consol = 'C'
+                 and indfmt = 'INDL'
+                 and datafmt = 'STD'
+                 and popsrc = 'D'
+                 and curcd = 'USD'
+                 and final = 'Y'
+                 and fic = 'USA'
+                 and datadate >= '1990-01-01'
+                 """
+
+
+class Stage:
+
+    def __init__(self, name, func, inputs=(), outputs=(), params=None, options=None):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.params = dict(params or {})
+        self.options = dict(options or {})
+
+    def __repr__(self):
+        return 'Stage(%r, %s -> %s)' % (self.name, self.inputs, self.outputs)
+
+
+class _Context:
+    """
+    Resources shared by the stages, opened on first use.
+    """
+
+    def __init__(self, name_cache=None, conn=None, connect=None):
+        self.name_cache_path = name_cache
+        self.refresh = False
+        self.extracted = {} # SQL: table pulled ahead by runPipeline
+        self._conn = conn
+        self._name_cache = None
+        if connect is None and conn is None:
+            connect = CachedConnection
+        self.connect = connect
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = CachedConnection() # set WRDS_REPLAY=1 to run offline from the cache
+        return self._conn
+
+    @property
+    def name_cache(self):
+        if self._name_cache is None and self.name_cache_path:
+            self._name_cache = NameRatioCache(self.name_cache_path)
+        return self._name_cache
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+        if self._name_cache is not None:
+            self._name_cache.close() # reports cache hits and misses
+
+
+############
+# Stages #
+############
+
+def _extract(ctx, sql, table):
+    if sql in ctx.extracted:
+        return ctx.extracted.pop(sql)
+    if ctx.refresh and hasattr(ctx.conn, 'invalidate'):
+        ctx.conn.invalidate(sql)
+    return compactFrame(ctx.conn.raw_sql(sql), table)
+
+
+def _cusipCorrect(ctx, kld_raw, kld_history_raw):
+    kld = addKldDates(cleanKld(cusipCorrectionFast(kld_raw)))
+    return kld, kldCusipDates(kld), cleanKld(cusipCorrectionFast(kld_history_raw))
+
+
+def _cusipLink(ctx, kld_last, crsp_cusip_raw):
+    return cusipCandidates(kld_last, crspCusipNames(crsp_cusip_raw), name_cache=ctx.name_cache)
+
+
+def _tickerLink(ctx, kld, kld_last, cusip_candidates, crsp_ticker_raw):
+    return tickerCandidates(kld, kld_last, cusip_candidates, crspTickerNames(crsp_ticker_raw),
+                            name_cache=ctx.name_cache)
+
+
+def _nameLink(ctx, kld, cusip_candidates, ticker_candidates, crsp_cusip_raw, enabled, top_k):
+    if not enabled:
+        return pd.DataFrame()
+    return nameCandidates(kld, cusip_candidates, ticker_candidates, crspCusipNames(crsp_cusip_raw),
+                          name_cache=ctx.name_cache, top_k=top_k)
+
+
+def _linkScores(ctx, cusip_candidates, ticker_candidates, name_candidates, name_ratio_quantile,
+                min_name_ratio):
+    return finalizeLinks(cusip_candidates, ticker_candidates,
+                         name_candidates if len(name_candidates.columns) else None,
+                         name_ratio_quantile=name_ratio_quantile, min_name_ratio=min_name_ratio)
+
+
+def _ccmMatch(ctx, kld, kld_crsp_link, ccm_link, chunk_permnos, shard_by_year, n_jobs):
+    linked3 = linkMsf(ctx.conn, alignKldDates(kld), kld_crsp_link, chunk_permnos=chunk_permnos,
+                      shard_by_year=shard_by_year, n_jobs=n_jobs)
+    return matchCcm(linked3, ccm_link, shard_by_year=shard_by_year, n_jobs=n_jobs)
+
+
+def _fundaMerge(ctx, kld_crsp_ccm, funda_link, shard_by_year, n_jobs):
+    detailed = mergeCompFunda(kld_crsp_ccm, funda_link, shard_by_year=shard_by_year, n_jobs=n_jobs)
+    return detailed, compLink(detailed)
+
+
+def _panel(ctx, kld_crsp_ccm_comp_link, kld_history, funda):
+    return mergePanel(kld_crsp_ccm_comp_link, kld_history, funda)
+
+
+def _indexRatio(ctx, kld_compustat):
+    return fundaRatios(kldIndices(kld_compustat))
+
+
+def _extractStage(name, output, sql, table):
+    return Stage(name, _extract, outputs=[output], params={'sql': sql, 'table': table})
+
+
+# In order: every stage comes after the stages of its inputs
+STAGES = [
+    _extractStage('extract_kld', 'kld_raw', KLD_SQL, 'kld.history'),
+    _extractStage('extract_kld_history', 'kld_history_raw', KLD_HISTORY_SQL, 'kld.history'),
+    _extractStage('extract_crsp_cusip', 'crsp_cusip_raw', CRSP_CUSIP_SQL, 'crsp.stocknames'),
+    _extractStage('extract_crsp_ticker', 'crsp_ticker_raw', CRSP_TICKER_SQL, 'crsp.stocknames'),
+    _extractStage('extract_ccm', 'ccm_link', CCM_SQL, 'ccm_link'),
+    _extractStage('extract_funda_link', 'funda_link', FUNDA_LINK_SQL, 'comp.funda'),
+    _extractStage('extract_funda', 'funda', fundaQuery(FUNDA_OUTPUTS), 'comp.funda'),
+    Stage('cusip_correct', _cusipCorrect,
+          inputs=['kld_raw', 'kld_history_raw'],
+          outputs=['kld', 'kld_last', 'kld_history']),
+    Stage('cusip_link', _cusipLink,
+          inputs=['kld_last', 'crsp_cusip_raw'],
+          outputs=['cusip_candidates']),
+    Stage('ticker_link', _tickerLink,
+          inputs=['kld', 'kld_last', 'cusip_candidates', 'crsp_ticker_raw'],
+          outputs=['ticker_candidates']),
+    Stage('name_link', _nameLink,
+          inputs=['kld', 'cusip_candidates', 'ticker_candidates', 'crsp_cusip_raw'],
+          outputs=['name_candidates'],
+          params={'enabled': False, 'top_k': 10}),
+    Stage('link_scores', _linkScores,
+          inputs=['cusip_candidates', 'ticker_candidates', 'name_candidates'],
+          outputs=['kld_crsp_link'],
+          params={'name_ratio_quantile': 0.10, 'min_name_ratio': 90}),
+    Stage('ccm_match', _ccmMatch,
+          inputs=['kld', 'kld_crsp_link', 'ccm_link'],
+          outputs=['kld_crsp_ccm'],
+          options={'chunk_permnos': 500, 'shard_by_year': False, 'n_jobs': None}),
+    Stage('funda_merge', _fundaMerge,
+          inputs=['kld_crsp_ccm', 'funda_link'],
+          outputs=['kld_crsp_ccm_comp_detailed', 'kld_crsp_ccm_comp_link'],
+          options={'shard_by_year': False, 'n_jobs': None}),
+    Stage('panel', _panel,
+          inputs=['kld_crsp_ccm_comp_link', 'kld_history', 'funda'],
+          outputs=['kld_compustat']),
+    Stage('index_ratio', _indexRatio,
+          inputs=['kld_compustat'],
+          outputs=['kld_compustat_panel']),
+]
+
+# Tables also written as the files of the scripts: (path, year column)
+EXPORTS = {
+    'kld_crsp_link': ('KLD_CRSP_Link.csv', None),
+    'kld_crsp_ccm_comp_detailed': ('KLD_CRSP_CCM_COMP_detailed.csv', 'year'),
+    'kld_crsp_ccm_comp_link': ('KLD_CRSP_CCM_COMP_Link.csv', 'year'),
+    'kld_compustat': ('KLD_Compustat.csv', 'fyear'),
+    'kld_compustat_panel': ('KLD_Compustat_panel.csv', 'fyear'),
+}
+
+
+##############
+# Runner #
+##############
+
+def frameHash(DataFrame):
+    """
+    Content hash of a table: column names, dtypes and values, in row order.
+    """
+    h = hashlib.sha256()
+    h.update(json.dumps([[str(c) for c in DataFrame.columns],
+                         [str(t) for t in DataFrame.dtypes]]).encode('utf-8'))
+    h.update(pd.util.hash_pandas_object(DataFrame, index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+def stageFingerprint(stage, params, input_hashes):
+    """
+    Hash of the stage's code, parameters and input contents.
+    """
+    text = json.dumps({'stage': stage.name,
+                       'code': inspect.getsource(stage.func),
+                       'params': params,
+                       'inputs': [input_hashes[i] for i in stage.inputs]},
+                      sort_keys=True, default=str)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _neededStages(targets):
+    """
+    The stages producing 'targets' (table or stage names) and their ancestors,
+    in the order of STAGES.
+    """
+    producer = {o: s for s in STAGES for o in s.outputs}
+    by_name = {s.name: s for s in STAGES}
+    todo = [by_name[t] if t in by_name else producer[t] for t in targets]
+    needed = set()
+    while todo:
+        stage = todo.pop()
+        if stage.name not in needed:
+            needed.add(stage.name)
+            todo.extend(producer[i] for i in stage.inputs)
+    return [s for s in STAGES if s.name in needed]
+
+
+class _Store:
+    """
+    Parquet files of the tables and the manifest of 'pipeline_store/'.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.manifest_path = os.path.join(path, 'manifest.json')
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+        else:
+            self.manifest = {'stages': {}, 'tables': {}}
+
+    def file(self, table):
+        return os.path.join(self.path, table + '.parquet')
+
+    def exists(self, table):
+        return table in self.manifest['tables'] and os.path.exists(self.file(table))
+
+    def load(self, table):
+        return pd.read_parquet(self.file(table))
+
+    def save(self, table, DataFrame, content_hash):
+        DataFrame.to_parquet(self.file(table) + '.tmp', index=False)
+        os.replace(self.file(table) + '.tmp', self.file(table))
+        self.manifest['tables'][table] = content_hash
+
+    def commit(self):
+        with open(self.manifest_path + '.tmp', 'w') as f:
+            json.dump(self.manifest, f, indent=1)
+        os.replace(self.manifest_path + '.tmp', self.manifest_path)
+
+
+def runPipeline(targets=None, params=None, options=None, store='pipeline_store', force=(),
+                formats=('csv',), name_cache=None, conn=None, metrics=None,
+                connect=None, extract_connections=4):
+    """
+    Bring 'targets' (table or stage names, default: every stage) up to date,
+    running only the stages whose fingerprint changed. 'params' and 'options'
+    override the defaults of the stages by stage name, 'force' lists stages
+    to run anyway. The tables in EXPORTS are written in 'formats' when they
+    change. With 'name_cache' (a SQLite file), the name ratios scored in
+    earlier runs are re-used (see 'nameRatioCache.py'). 'conn' replaces the
+    cached WRDS connection, e.g. a
+    SyntheticConnection (see 'syntheticData.py') or a SqlBackend over local
+    copies of the WRDS tables (see 'sqlBackend.py'). With 'metrics' (a folder or
+    '.json' path, default: STAGE_METRICS), the timings, memory and rows of
+    the stages are reported (see 'stageMetrics.py'). The extract stages to run
+    are pulled at the same time over up to 'extract_connections' connections
+    opened by 'connect()' (default: CachedConnection, unless 'conn' is given),
+    see 'wrdsPool.py'. Returns the target tables.
+    """
+    params, options = params or {}, options or {}
+    if targets is None:
+        targets = [s.name for s in STAGES]
+    stages = _neededStages(targets)
+    store = _Store(store)
+    ctx = _Context(name_cache, conn, connect)
+    tables = {}
+    changed = set()
+    own_run = stageMetrics.startRun('pipeline', metrics)
+
+    def table(name):
+        if name not in tables:
+            tables[name] = store.load(name)
+        return tables[name].copy()
+
+    def upToDate(stage, fingerprint):
+        done = store.manifest['stages'].get(stage.name, {})
+        return (stage.name not in force and done.get('fingerprint') == fingerprint
+                and all(store.exists(o) for o in stage.outputs))
+
+    try:
+        # the extract stages have no inputs: those to run are pulled together up front
+        pulls = {}
+        for stage in stages:
+            if stage.func is not _extract:
+                continue
+            stage_params = dict(stage.params, **params.get(stage.name, {}))
+            if not upToDate(stage, stageFingerprint(stage, stage_params, store.manifest['tables'])):
+                pulls[stage.name] = (stage_params['sql'], stage_params['table'])
+        if len(pulls) > 1 and ctx.connect is not None and extract_connections:
+            with stageMetrics.stage('extract') as metric:
+                extracted = extractTables(pulls, ctx.connect, connections=extract_connections,
+                                          refresh=[name for name in pulls if name in force])
+                metric.output(*extracted.values())
+            ctx.extracted = {pulls[name][0]: data for name, data in extracted.items()}
+
+        for stage in stages:
+            stage_params = dict(stage.params, **params.get(stage.name, {}))
+            fingerprint = stageFingerprint(stage, stage_params, store.manifest['tables'])
+            if upToDate(stage, fingerprint):
+                print('Stage %s: up to date' % stage.name)
+                continue
+
+            print('Stage %s: running' % stage.name)
+            start_time = time.time()
+            ctx.refresh = stage.name in force
+            inputs = [table(i) for i in stage.inputs]
+            with stageMetrics.stage(stage.name, *inputs) as metric:
+                result = stage.func(ctx, *inputs,
+                                    **stage_params, **dict(stage.options, **options.get(stage.name, {})))
+                if len(stage.outputs) == 1:
+                    result = (result,)
+                metric.output(*result)
+            for name, data in zip(stage.outputs, result):
+                data = data.reset_index(drop=True)
+                content_hash = frameHash(data)
+                if store.manifest['tables'].get(name) != content_hash or not store.exists(name):
+                    changed.add(name)
+                store.save(name, data, content_hash)
+                tables[name] = data
+            store.manifest['stages'][stage.name] = {
+                'fingerprint': fingerprint,
+                'finished': datetime.datetime.now().isoformat(timespec='seconds'),
+                'seconds': round(time.time() - start_time, 3)}
+            store.commit()
+    finally:
+        ctx.close()
+
+    for name, (path, year) in EXPORTS.items():
+        if name in store.manifest['tables'] and any(name in s.outputs for s in stages):
+            if name in changed or not os.path.exists(path):
+                writeTable(table(name), path, year=year, formats=formats)
+
+    if own_run:
+        stageMetrics.finishRun()
+
+    outputs = [o for s in STAGES if s.name in targets for o in s.outputs]
+    outputs += [t for t in targets if t in store.manifest['tables']]
+    return {o: table(o) for o in outputs}
+
+
+if __name__ == '__main__':
+    runPipeline()
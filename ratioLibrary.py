@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Pak Shing Ho
+
+The Compustat ratios and controls of 'KLD_Compustat.ipynb' as declarations,
+and an evaluator computing any of them on a funda-sized frame.
+
+Each variable is declared like its SAS comment,
+    'gpm': Ratio('gp', 'revt - cogs', 'sale - cogs', over='sale')
+for gpm=coalesce(gp,revt-cogs,sale-cogs)/sale, with the semantics of the
+notebook's chain of np.where(x.isnull(), ...):
+    - the first numerator over the denominator where the first numerator is
+      not missing, else the second numerator over the denominator,
+    - then each further numerator over the denominator where the ratio is
+      still missing.
+Without fallbacks a declaration is a plain expression, e.g.
+Ratio('prcc_f * csho', over='ib'). Expressions use + - * /, numbers, log()
+and names: funda columns or other declared variables. A variable's own name
+in its declaration is the funda column ('txditc', 'ebitda').
+
+evaluateRatios computes the requested variables (and the variables they use)
+in one pass, in dependency order. Each variable is written in place into one
+preallocated block, the operations re-use their temporary arrays, and the
+fallbacks are only evaluated on the rows still missing. The results equal the
+notebook's pandas statements.
+
+Usage:
+    ratios = evaluateRatios(funda, ['gpm', 'roa', 'bm'])
+    ratioInputs('evm') # ['ev', 'ebitda']
+"""
+
+import ast
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+
+class Ratio:
+    """
+    coalesce(numerators)/over, see the module docstring. With 'positive',
+    values that are not > 0 are set to missing.
+    """
+
+    def __init__(self, *numerators, over=None, positive=False):
+        self.numerators = numerators
+        self.over = over
+        self.positive = positive
+
+    @property
+    def inputs(self):
+        """
+        Names used by the declaration, in order of appearance.
+        """
+        names = []
+        for expression in self.numerators + ((self.over,) if self.over else ()):
+            for name in _names(expression):
+                if name not in names:
+                    names.append(name)
+        return names
+
+    def __repr__(self):
+        text = ', '.join(repr(n) for n in self.numerators)
+        if self.over:
+            text += ', over=%r' % self.over
+        if self.positive:
+            text += ', positive=True'
+        return 'Ratio(%s)' % text
+
+
+# Ratios and controls of 'KLD_Compustat.ipynb', SAS definitions in the comments
+RATIOS = {
+    'gpm': Ratio('gp', 'revt - cogs', 'sale - cogs', over='sale'),      # coalesce(gp,revt-cogs,sale-cogs)/sale
+    'npm': Ratio('ib', over='sale'),
+    'roa': Ratio('oibdp', 'sale - xopr', 'revt - xopr', over='at'),     # coalesce(oibdp,sale-xopr,revt-xopr)/at
+    'ps': Ratio('pstkrv', 'pstkl', 'pstk', '0'),                        # coalesce(pstkrv,pstkl,pstk,0)
+    'txditc': Ratio('txditc', 'txdb + itcb', '0'),                      # coalesce(txditc,sum(txdb,itcb),0)
+    'be': Ratio('seq + txditc - ps', positive=True),
+    'roe': Ratio('ib', over='be'),
+    'bm': Ratio('be', over='prcc_f * csho'),                            # BE/(prcc_f*csho)
+    'ebitda': Ratio('ebitda', 'oibdp', 'sale - cogs - xsga'),           # coalesce(ebitda,oibdp,sale-cogs-xsga)
+    'ev': Ratio('dltt + dlc + mib + ps + prcc_f * csho'),               # sum(dltt,dlc,mib,ps,prcc_f*csho)
+    'evm': Ratio('ev', over='ebitda'),
+    'pe_exi': Ratio('prcc_f', over='epsfx'),
+    'pe_inc': Ratio('prcc_f', over='epsfi'),
+    'pe_ib': Ratio('prcc_f * csho', over='ib'),
+    'pe_ni': Ratio('prcc_f * csho', over='ni'),
+    'rd_sale': Ratio('xrd + 0', over='sale'),
+    'adv_sale': Ratio('xad + 0', over='sale'),
+    'xsga_sale': Ratio('xsga + 0', over='sale'),
+    'markup_acct': Ratio('sale', over='cogs'),
+    'market_sale': Ratio('prcc_f * csho', over='sale'),
+    'div_sale': Ratio('dvc', over='sale'),
+    'markup': Ratio('0.85 * sale', over='cogs'),
+    'markup_overhead': Ratio('0.95 * sale', over='cogs + xsga'),
+    'econ_profit': Ratio('sale - cogs - 0.12 * ppegt - xsga'),
+    'profit_rate': Ratio('econ_profit', over='sale'),
+    'op_profit_rate': Ratio('sale - cogs - xsga', over='sale'),
+    'econ_roa': Ratio('econ_profit', over='at'),
+    # Controls
+    'size': Ratio('log(at)'),
+    'lev': Ratio('dltt + dlc', over='prcc_f * csho'),
+    'rdi': Ratio('xrd', over='sale'),
+    'adi': Ratio('xad', over='sale'),
+}
+
+_OPERATORS = {ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply, ast.Div: np.divide}
+_FUNCTIONS = {'log': np.log}
+
+
+@lru_cache(maxsize=None)
+def _parse(expression):
+    tree = ast.parse(expression, mode='eval').body
+    for node in ast.walk(tree):
+        if not isinstance(node, (ast.BinOp, ast.UnaryOp, ast.USub, ast.Call, ast.Name,
+                                 ast.Constant, ast.Load) + tuple(_OPERATORS)):
+            raise ValueError('Unsupported expression: %s' % expression)
+        if isinstance(node, ast.Call) and (not isinstance(node.func, ast.Name)
+                                           or node.func.id not in _FUNCTIONS):
+            raise ValueError('Unsupported function in: %s' % expression)
+    return tree
+
+
+def _names(expression):
+    # ast.walk is breadth first, keep the order of the text
+    nodes = sorted((node.col_offset, node.id) for node in ast.walk(_parse(expression))
+                   if isinstance(node, ast.Name) and node.id not in _FUNCTIONS)
+    names = []
+    for _, name in nodes:
+        if name not in names:
+            names.append(name)
+    return names
+
+
+def ratioInputs(name, ratios=RATIOS):
+    """
+    Names (funda columns or other variables) the variable 'name' uses.
+    """
+    return ratios[name].inputs
+
+
+def ratioOrder(names, ratios=RATIOS):
+    """
+    The variables 'names' and the variables they use, each after its inputs.
+    """
+    order = []
+
+    def visit(name, path):
+        if name in order:
+            return
+        if name in path:
+            raise ValueError('Circular ratio definition: ' + ' -> '.join(path + [name]))
+        for i in ratios[name].inputs:
+            if i in ratios and i != name:
+                visit(i, path + [name])
+        order.append(name)
+
+    for name in names:
+        visit(name, [])
+    return order
+
+
+def _evaluate(node, values, rows):
+    """
+    Value of the expression 'node' on 'rows' (None for all rows), and whether
+    it is a temporary array the caller may overwrite.
+    """
+    if isinstance(node, ast.Constant):
+        return float(node.value), False
+    if isinstance(node, ast.Name):
+        column = values[node.id]
+        if rows is None:
+            return column, False
+        return column[rows], True
+    if isinstance(node, ast.UnaryOp):
+        operand, temporary = _evaluate(node.operand, values, rows)
+        if np.isscalar(operand):
+            return -operand, False
+        return np.negative(operand, out=operand if temporary else None), True
+    if isinstance(node, ast.Call):
+        argument, temporary = _evaluate(node.args[0], values, rows)
+        if np.isscalar(argument):
+            return float(_FUNCTIONS[node.func.id](argument)), False
+        return _FUNCTIONS[node.func.id](argument, out=argument if temporary else None), True
+
+    left, left_temporary = _evaluate(node.left, values, rows)
+    right, right_temporary = _evaluate(node.right, values, rows)
+    operator = _OPERATORS[type(node.op)]
+    if np.isscalar(left) and np.isscalar(right):
+        return float(operator(left, right)), False
+    out = left if left_temporary else right if right_temporary else None
+    return operator(left, right, out=out), True
+
+
+def _value(expression, values, rows, size):
+    value, _ = _evaluate(_parse(expression), values, rows)
+    if np.isscalar(value):
+        return np.full(size, value)
+    return value
+
+
+def _evaluateRatio(ratio, values, out):
+    """
+    Write the values of 'ratio' into the float64 array 'out'.
+    """
+    n = len(out)
+    first = _value(ratio.numerators[0], values, None, n)
+    if ratio.over is None:
+        out[:] = first
+    else:
+        np.divide(first, _value(ratio.over, values, None, n), out=out)
+
+    for k, numerator in enumerate(ratio.numerators[1:]):
+        # the second numerator where the first is missing, the later ones
+        # where the ratio is still missing
+        rows = np.flatnonzero(np.isnan(first if k == 0 else out))
+        if not len(rows):
+            continue
+        value = _value(numerator, values, rows, len(rows))
+        if ratio.over is not None:
+            value = value / _value(ratio.over, values, rows, len(rows))
+        out[rows] = value
+
+    if ratio.positive:
+        out[~(out > 0)] = np.nan
+
+
+def evaluateRatios(data, names=None, ratios=RATIOS):
+    """
+    DataFrame (index of 'data') of the variables 'names' (default: all of
+    'ratios'), computed from the funda columns of 'data' as float64.
+    """
+    names = list(ratios) if names is None else list(names)
+    order = ratioOrder(names, ratios)
+    block = np.empty((len(data), len(order)), dtype='float64', order='F')
+    computed = {}
+    columns = {}
+
+    class _Values(dict):
+        # funda columns as float64 arrays, converted on first use
+        def __missing__(self, name):
+            if name not in columns:
+                series = data[name]
+                if series.dtype == 'float64':
+                    columns[name] = series.to_numpy() # no copy, never written to
+                else:
+                    columns[name] = series.to_numpy(dtype='float64', na_value=np.nan)
+            return columns[name]
+
+    with np.errstate(all='ignore'):
+        for j, name in enumerate(order):
+            # the variables computed so far; its own name is still the funda column
+            _evaluateRatio(ratios[name], _Values(computed), block[:, j])
+            computed[name] = block[:, j]
+
+    result = pd.DataFrame(block, index=data.index, columns=order)
+    return result[names] if names != order else result
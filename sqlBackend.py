@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Pak Shing Ho
+
+SQL backend of the KLD-CRSP link, run by an embedded DuckDB database over
+local tables.
+
+'Compustat_CRSP_Link.py' joins msf, msenames and security (and the CCM link)
+in SQL on the WRDS server, while 'kldCrspLink.py' builds the KLD-CRSP link
+candidates as chains of pandas merges and groupbys. SqlBackend runs both as
+SQL on this machine:
+    - raw_sql(sql) runs the SQL of the scripts (e.g. the CCM link of
+      'pipeline.py', the CUSIP link of 'Compustat_CRSP_Link.py') over local
+      copies of the WRDS tables, registered as DataFrames or as Parquet files
+      (e.g. dumps of crsp.msf), which DuckDB scans without loading them,
+    - crspCusipNames, crspTickerNames, kldCusipDates, cusipCandidates and
+      tickerCandidates are Steps 1-2 of the link, one SQL statement each
+      (LINK_SQL), with the same arguments and rows as the functions of
+      'kldCrspLink.py' (the rows come in another order). The name ratios are
+      scored in Python, as in 'nameRatio.py'.
+DuckDB runs the joins and aggregations on all cores ('threads') and spills
+to 'temp_directory' beyond 'memory_limit'.
+
+compareBackends runs the pandas and SQL versions of Steps 1-3 on the same
+tables and checks that every step gives the same rows (see
+'frameFingerprint.py').
+
+DuckDB is only needed for this backend (pip install duckdb).
+
+Usage:
+    backend = SqlBackend({'crsp.msf': 'wrds_tables/msf/*.parquet',
+                          'crsp.msenames': msenames, 'crsp.ccmxpf_linktable': ccm})
+    ccm_link = backend.raw_sql(CCM_SQL)
+    _crsp2 = backend.crspCusipNames(_crsp1)
+    _link1_2 = backend.cusipCandidates(_kld3, _crsp2, name_cache=name_cache)
+    compareBackends(backend, _kld2, _crsp1, _crsp_n1)
+"""
+
+import itertools
+import re
+
+import pandas as pd
+from fuzzywuzzy import fuzz
+
+import kldCrspLink
+from frameFingerprint import sameRows
+from kldCrspLink import _companies, finalizeLinks
+from nameRatio import nameRatio
+from stageMetrics import stage # timings and row counts, when a run is recording
+
+
+# Column names of the WRDS tables that DuckDB reads as keywords
+_KEYWORD_COLUMNS = re.compile(r'(?<![\w."\'])(at)(?![\w"\'])', re.IGNORECASE)
+
+# Steps 1-2 of 'kldCrspLink.py'. {columns} are the columns of the pandas merges
+# of the same step, named as pandas names them (see _mergeColumns).
+LINK_SQL = {
+    # first namedt and last nameenddt of each PERMNO-NCUSIP, on the most recent company name
+    'crsp_cusip_names': """
+        with dtrange as (
+            select permno, ncusip, min(namedt) as namedt, max(nameenddt) as nameenddt
+            from crsp1
+            where permno is not null and ncusip is not null
+            group by permno, ncusip)
+        select c.* exclude (namedt, nameenddt), d.namedt, d.nameenddt
+        from crsp1 as c
+        join dtrange as d
+        on c.permno = d.permno and c.ncusip = d.ncusip and c.nameenddt = d.nameenddt
+        """,
+
+    # effective dates of each PERMNO-ticker, on the most recent company name
+    'crsp_ticker_names': """
+        with names as (select * from crsp_n1 where ticker is not null),
+        dt as (
+            select permno, ticker, min(namedt) as namedt, max(nameenddt) as nameenddt
+            from names
+            where permno is not null
+            group by permno, ticker)
+        select n.* exclude (namedt, nameenddt) rename (ticker as crsp_ticker), d.namedt, d.nameenddt
+        from names as n
+        join dt as d
+        on n.permno = d.permno and n.ticker = d.ticker and n.nameenddt = d.nameenddt
+        """,
+
+    # first and last date of each KLD company name and CUSIP, on the row of the last date
+    'kld_cusip_dates': """
+        with dates as (
+            select companyname, cusip, min("date") as fdate, max("date") as ldate
+            from kld2
+            where companyname is not null and cusip is not null
+            group by companyname, cusip)
+        select k.* exclude ("date"), d.fdate, d.ldate
+        from kld2 as k
+        join dates as d
+        on k.companyname = d.companyname and k.cusip = d.cusip and k."date" = d.ldate
+        """,
+
+    # Step 1.3: link by full cusip, keeping the link with the most recent company name
+    'cusip_candidates': """
+        select {columns}
+        from kld3 as l
+        join crsp2 as r
+        on l.cusip = r.ncusip
+        qualify l.ldate = max(l.ldate) over (partition by l.companyname, r.permno)
+        """,
+
+    # Step 2: remaining unmatched cases, linked by ticker with overlapping date ranges
+    'ticker_candidates': """
+        with unmatched as (
+            select distinct companyname
+            from kld3 as k
+            where companyname is not null
+            and not exists (select 1 from link1_2 as c where c.companyname = k.companyname)),
+        nomatch2 as (
+            select u.companyname, k.* exclude (companyname)
+            from unmatched as u
+            join kld2 as k
+            on u.companyname = k.companyname),
+        dates as (
+            select companyname, ticker, min("date") as fdate, max("date") as ldate
+            from nomatch2
+            where ticker is not null
+            group by companyname, ticker),
+        nomatch3 as (
+            select n.*, d.fdate, d.ldate
+            from nomatch2 as n
+            join dates as d
+            on n.companyname = d.companyname and n.ticker = d.ticker and n."date" = d.ldate)
+        select {columns}
+        from nomatch3 as l
+        join crsp_n2 as r
+        on l.ticker = r.crsp_ticker and l.ldate >= r.namedt and l.fdate <= r.nameenddt
+        """,
+}
+
+
+def duckdbSql(sql):
+    """
+    WRDS (PostgreSQL) 'sql' for DuckDB: the WRDS column names that are DuckDB
+    keywords (funda's 'at') are quoted.
+    """
+    return _KEYWORD_COLUMNS.sub(lambda m: '"%s"' % m.group(0), sql)
+
+
+def _mergeColumns(left, right, on=(), suffixes=('_x', '_y')):
+    """
+    Select list (from tables 'l' and 'r') of the columns of
+    pd.merge(left, right, on=on, ...) in pandas' order and names: the left
+    columns, then the right ones, the 'on' keys once and the other shared
+    names with 'suffixes'.
+    """
+    right_columns = [c for c in right if c not in on]
+    shared = set(left) & set(right_columns)
+    return ', '.join(['l."%s" as "%s"' % (c, c + suffixes[0] if c in shared else c) for c in left]
+                     + ['r."%s" as "%s"' % (c, c + suffixes[1] if c in shared else c)
+                        for c in right_columns])
+
+
+class SqlBackend:
+    """
+    Embedded DuckDB database over local tables ({name: DataFrame or Parquet
+    path or glob}, named as on WRDS, e.g. 'crsp.msf').
+    """
+
+    def __init__(self, tables=None, database=':memory:', threads=None, memory_limit=None,
+                 temp_directory=None):
+        import duckdb
+        config = {k: v for k, v in [('threads', threads), ('memory_limit', memory_limit),
+                                    ('temp_directory', temp_directory)] if v is not None}
+        self.db = duckdb.connect(database, config=config)
+        self._frames = itertools.count()
+        for name, table in (tables or {}).items():
+            self.register(name, table)
+
+    def register(self, name, table):
+        """
+        Make 'table' (a DataFrame, or a Parquet path or glob) queryable as
+        'name' ('schema.table' or 'table').
+        """
+        if '.' in name:
+            self.db.execute('create schema if not exists %s' % name.split('.')[0])
+        if isinstance(table, pd.DataFrame):
+            frame = '_frame%d' % next(self._frames)
+            self.db.register(frame, table)
+            self.db.execute('create or replace view %s as select * from %s' % (name, frame))
+        else:
+            self.db.execute("create or replace view %s as select * from read_parquet('%s')"
+                            % (name, str(table).replace("'", "''")))
+
+    def raw_sql(self, sql, **kwargs):
+        """
+        Result of 'sql' over the registered tables, like conn.raw_sql(sql).
+        """
+        return self.db.execute(duckdbSql(sql)).df()
+
+    def query(self, sql, **frames):
+        """
+        Result of 'sql' with the DataFrames 'frames' as tables of their
+        argument names.
+        """
+        for name, frame in frames.items():
+            self.db.register(name, frame)
+        try:
+            return self.db.execute(sql).df()
+        finally:
+            for name in frames:
+                self.db.unregister(name)
+
+    def close(self):
+        self.db.close()
+
+    ######################
+    # Steps 1-2 in SQL #
+    ######################
+
+    def crspCusipNames(self, _crsp1):
+        with stage('sql.crsp_cusip_names', _crsp1) as s:
+            _crsp2 = self.query(LINK_SQL['crsp_cusip_names'], crsp1=_crsp1)
+            s.output(_crsp2)
+        return _crsp2
+
+    def crspTickerNames(self, _crsp_n1):
+        with stage('sql.crsp_ticker_names', _crsp_n1) as s:
+            _crsp_n2 = self.query(LINK_SQL['crsp_ticker_names'], crsp_n1=_crsp_n1)
+            s.output(_crsp_n2)
+        return _crsp_n2
+
+    def kldCusipDates(self, _kld2):
+        with stage('sql.kld_cusip_dates', _kld2) as s:
+            _kld3 = self.query(LINK_SQL['kld_cusip_dates'], kld2=_kld2)
+            s.output(_kld3)
+        return _kld3
+
+    def cusipCandidates(self, _kld3, _crsp2, name_cache=None, companies=None,
+                        scorer=fuzz.token_set_ratio):
+        _kld3 = _companies(_kld3, companies)
+        with stage('sql.cusip_candidates', _kld3, _crsp2) as s:
+            sql = LINK_SQL['cusip_candidates'].format(columns=_mergeColumns(_kld3, _crsp2))
+            _link1_2 = self.query(sql, kld3=_kld3, crsp2=_crsp2)
+            s.output(_link1_2)
+        _link1_2['name_ratio'] = nameRatio(_link1_2, 'comnam', 'companyname', scorer=scorer, cache=name_cache)
+        return _link1_2
+
+    def tickerCandidates(self, _kld2, _kld3, _link1_2, _crsp_n2, name_cache=None, companies=None,
+                         scorer=fuzz.token_set_ratio):
+        _kld2, _kld3 = _companies(_kld2, companies), _companies(_kld3, companies)
+        nomatch3 = pd.DataFrame(columns=['companyname'] + [c for c in _kld2 if c != 'companyname']
+                                + ['fdate', 'ldate'])
+        with stage('sql.ticker_candidates', _kld3, _crsp_n2) as s:
+            sql = LINK_SQL['ticker_candidates'].format(columns=_mergeColumns(nomatch3, _crsp_n2))
+            _link2_1 = self.query(sql, kld2=_kld2, kld3=_kld3, link1_2=_link1_2[['companyname']],
+                                  crsp_n2=_crsp_n2)
+            s.output(_link2_1)
+        _link2_1['name_ratio'] = nameRatio(_link2_1, 'comnam', 'companyname', scorer=scorer, cache=name_cache)
+        return _link2_1
+
+
+def _comparable(DataFrame):
+    """
+    'DataFrame' with the dtypes both backends can give a column made the
+    same: categories as objects (missing as None), integers as int64 (Int64
+    if nullable) and dates as datetime64[ns].
+    """
+    data = DataFrame.reset_index(drop=True)
+    for c in data.columns:
+        if pd.api.types.is_categorical_dtype(data[c]) or data[c].dtype == object:
+            data[c] = data[c].astype(object)
+            data[c] = data[c].where(data[c].notna(), None)
+        elif pd.api.types.is_integer_dtype(data[c]):
+            data[c] = data[c].astype('Int64' if pd.api.types.is_extension_array_dtype(data[c]) else 'int64')
+        elif pd.api.types.is_datetime64_any_dtype(data[c]):
+            data[c] = data[c].astype('datetime64[ns]')
+    return data
+
+
+def compareBackends(backend, _kld2, _crsp1, _crsp_n1, name_cache=None):
+    """
+    Run Steps 1-3 of the link with pandas ('kldCrspLink.py') and with the
+    SQL 'backend' on the same tables, and compare the rows of every step.
+    Returns {step: True if the rows are the same}.
+    """
+    results = []
+    for steps in (kldCrspLink, backend): # the same functions
+        t = {'crsp2': steps.crspCusipNames(_crsp1),
+             'crsp_n2': steps.crspTickerNames(_crsp_n1),
+             'kld3': steps.kldCusipDates(_kld2)}
+        t['cusip_candidates'] = steps.cusipCandidates(t['kld3'], t['crsp2'], name_cache=name_cache)
+        t['ticker_candidates'] = steps.tickerCandidates(_kld2, t['kld3'], t['cusip_candidates'],
+                                                        t['crsp_n2'], name_cache=name_cache)
+        t['link'] = finalizeLinks(t['cusip_candidates'], t['ticker_candidates'])
+        results.append(t)
+
+    same = {}
+    for step, data in results[0].items():
+        same[step] = sameRows(_comparable(results[1][step]), _comparable(data),
+                              names=('sql ' + step, 'pandas ' + step))
+        print('%-18s %8d rows  %s' % (step, len(data), 'same' if same[step] else 'DIFFERENT'))
+    return same
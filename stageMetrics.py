@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Pak Shing Ho
+
+Per-stage timings, memory and row counts.
+
+Each named stage (a merge, groupby, drop_duplicates, a fuzzy scoring pass, or
+a whole step) is wrapped in
+    with stage('cusip_link.merge_ncusip', _kld3, _crsp2) as s:
+        _link1_1 = pd.merge(_kld3, _crsp2, ...)
+        s.output(_link1_1)
+which records its wall time, CPU time (including forked worker processes),
+peak resident memory, and the rows of its inputs and outputs. Stages nest:
+a stage opened inside another is recorded as '<outer>/<inner>'.
+
+Recording is off unless a run is started. With no run, stage() returns one
+shared do-nothing object, so the instrumented code runs as before.
+
+A run writes one JSON report:
+    startRun('KLD_Compustat_Link')      # in a script; written at exit
+    with recordRun('pipeline', path):   # around a block
+        ...
+startRun reads the report folder from the environment variable
+STAGE_METRICS, and does nothing when it is not set:
+    STAGE_METRICS=metrics python KLD_Compustat_Link.py
+
+Row-count drift: with 'baseline' (an earlier report), the stages whose output
+rows changed by more than 'tolerance' (a fraction) are listed in the report
+under 'row_drift' and printed (see rowDrift).
+
+Peak memory is the resident set high-water mark of this process during the
+stage, reset at the start of each stage where Linux allows it
+(/proc/self/clear_refs). Elsewhere it is the process peak so far. Memory of
+worker processes is not included.
+"""
+
+import atexit
+import datetime
+import json
+import os
+import platform
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+
+# The recording run; None when recording is off
+_RUN = None
+
+
+class _NullStage:
+    """
+    Stand-in for a stage when recording is off.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def output(self, *frames):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+def _rows(frames):
+    return [f if isinstance(f, int) else len(f) for f in frames]
+
+
+def _cpuTime():
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+def _resetPeak():
+    """
+    Reset the resident set high-water mark (Linux). Returns True on success.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _peakRssMB():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024**2 if platform.system() == 'Darwin' else peak / 1024 # bytes on macOS
+
+
+class _Stage:
+    """
+    One recorded stage.
+    """
+
+    def __init__(self, run, name, inputs):
+        self.run = run
+        self.name = name
+        self.rows_in = _rows(inputs)
+        self.rows_out = None
+
+    def output(self, *frames):
+        self.rows_out = _rows(frames)
+
+    def __enter__(self):
+        run = self.run
+        self.parent = run.stack[-1] if run.stack else None
+        self.path = self.name if self.parent is None else self.parent.path + '/' + self.name
+        if self.parent is not None and run.peak_scope == 'stage':
+            self.parent.peak = max(self.parent.peak or 0, _peakRssMB() or 0)
+        if run.peak_scope == 'stage':
+            _resetPeak()
+        self.peak = None
+        run.stack.append(self)
+        self.started = time.perf_counter()
+        self.cpu_started = _cpuTime()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self.started
+        cpu = _cpuTime() - self.cpu_started
+        peak = _peakRssMB()
+        if peak is not None:
+            self.peak = max(self.peak or 0, peak)
+        run = self.run
+        run.stack.pop()
+        if self.parent is not None and self.peak is not None:
+            self.parent.peak = max(self.parent.peak or 0, self.peak)
+        record = {'stage': self.path,
+                  'start_s': round(self.started - run.started, 6),
+                  'wall_s': round(wall, 6),
+                  'cpu_s': round(cpu, 6),
+                  'peak_rss_mb': None if self.peak is None else round(self.peak, 1),
+                  'rows_in': self.rows_in,
+                  'rows_out': self.rows_out}
+        if exc_type is not None:
+            record['error'] = exc_type.__name__
+        run.records.append(record)
+        return False
+
+
+class _Run:
+
+    def __init__(self, name, path, baseline, tolerance):
+        self.name = name
+        self.path = path
+        self.baseline = baseline
+        self.tolerance = tolerance
+        self.records = []
+        self.stack = []
+        self.created = datetime.datetime.now()
+        self.started = time.perf_counter()
+        self.cpu_started = _cpuTime()
+        self.peak_scope = 'stage' if _resetPeak() else 'process'
+
+    def report(self):
+        report = {'run': self.name,
+                  'created': self.created.isoformat(timespec='seconds'),
+                  'wall_s': round(time.perf_counter() - self.started, 6),
+                  'cpu_s': round(_cpuTime() - self.cpu_started, 6),
+                  'peak_rss_scope': self.peak_scope,
+                  'python': platform.python_version(),
+                  'platform': platform.platform(),
+                  'cpu_count': os.cpu_count(),
+                  'stages': self.records}
+        if self.baseline is not None:
+            report['row_drift'] = rowDrift(report, self.baseline, self.tolerance)
+        return report
+
+    def write(self):
+        report = self.report()
+        path = self.path
+        if os.path.isdir(path) or not path.endswith('.json'):
+            os.makedirs(path, exist_ok=True)
+            path = os.path.join(path, '%s_%s.json' % (self.name, self.created.strftime('%Y%m%d_%H%M%S')))
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=1, default=str)
+        print('Stage metrics written to ' + path)
+        for drift in report.get('row_drift', []):
+            print('Row count drift in %(stage)s: %(baseline)s -> %(rows)s rows' % drift)
+        return report
+
+
+def stage(name, *inputs):
+    """
+    Context manager recording the stage 'name', with the DataFrames (or row
+    counts) 'inputs'. Call .output(frames) on it to record the output rows.
+    Does nothing when no run is recording.
+    """
+    if _RUN is None:
+        return _NULL_STAGE
+    return _Stage(_RUN, name, inputs)
+
+
+def recording():
+    """
+    True while a run is recording.
+    """
+    return _RUN is not None
+
+
+def _loadReport(report):
+    if isinstance(report, str):
+        with open(report) as f:
+            return json.load(f)
+    return report
+
+
+def startRun(name, path=None, baseline=None, tolerance=0.0):
+    """
+    Start recording the run 'name'. The report is written to 'path' (a
+    '.json' file or a folder; default: the STAGE_METRICS environment
+    variable) at finishRun or at exit. Without a path, or while another run
+    is recording, nothing happens. Returns True if the run was started.
+    """
+    global _RUN
+    path = path or os.environ.get('STAGE_METRICS')
+    if not path or _RUN is not None:
+        return False
+    _RUN = _Run(name, path, None if baseline is None else _loadReport(baseline), tolerance)
+    atexit.register(finishRun)
+    return True
+
+
+def finishRun():
+    """
+    Stop recording and write the report. Returns the report (None if no run
+    was recording).
+    """
+    global _RUN
+    run, _RUN = _RUN, None
+    if run is None:
+        return None
+    atexit.unregister(finishRun)
+    return run.write()
+
+
+@contextmanager
+def recordRun(name, path=None, baseline=None, tolerance=0.0):
+    """
+    startRun and finishRun around a block.
+    """
+    started = startRun(name, path, baseline, tolerance)
+    try:
+        yield
+    finally:
+        if started:
+            finishRun()
+
+
+def rowDrift(report, baseline, tolerance=0.0):
+    """
+    Stages of 'report' whose output rows differ from those of 'baseline' by
+    more than 'tolerance' (a fraction of the baseline rows). Stages that run
+    several times are compared on their total rows.
+    """
+    def totals(report):
+        rows = {}
+        for record in _loadReport(report)['stages']:
+            if record['rows_out'] is not None:
+                total = rows.setdefault(record['stage'], [0] * len(record['rows_out']))
+                if len(total) == len(record['rows_out']):
+                    rows[record['stage']] = [a + b for a, b in zip(total, record['rows_out'])]
+        return rows
+
+    current, before = totals(report), totals(baseline)
+    drift = []
+    for name, rows in current.items():
+        if name not in before:
+            continue
+        for old, new in zip(before[name], rows):
+            if abs(new - old) > tolerance * old:
+                drift.append({'stage': name, 'baseline': before[name], 'rows': rows})
+                break
+    return drift
@@ -0,0 +1,424 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Pak Shing Ho
+
+Synthetic WRDS tables, to run and time the pipeline without WRDS access.
+
+syntheticTables(scale) returns DataFrames with the columns and types that
+conn.raw_sql(...) returns (identifiers and names as strings, dates as
+datetime.date, numbers as float64) for
+    kld.history, crsp.stocknames, crsp.msenames, crsp.msf,
+    crsp.ccmxpf_linktable, comp.funda
+sized at 'scale' times PRODUCTION, with the defects the linking has to deal
+with:
+    - KLD CUSIPs shifted left by one to three leading zeros, and 'NA', '0',
+      '#N/A' or missing CUSIPs and tickers, lowercase tickers
+    - KLD company names in other spellings than CRSP ('Alpha Beta Inc.' vs
+      'ALPHA BETA INC'), name and CUSIP changes over a company's life
+    - tickers reused by other companies, and KLD companies not in CRSP
+    - firms without CCM links, non-primary and non-used links, funda rows
+      outside the standard filter (indfmt 'FS', other currencies)
+
+SyntheticConnection answers the SQL of the scripts from these tables with an
+in-memory SQLite database (tables are loaded on first use), so the scripts and
+'pipeline.py' run unchanged on it.
+
+Usage:
+    tables = syntheticTables(scale=1, seed=0)
+    conn = SyntheticConnection(tables)
+    _kld1 = conn.raw_sql("select ticker, cusip, companyname, year from kld.history")
+"""
+
+import re
+import sqlite3
+import string
+
+import numpy as np
+import pandas as pd
+
+from fundaManifest import fundaColumns, FUNDA_OUTPUTS
+
+
+# Size of the production tables at scale 1
+PRODUCTION = {'crsp_firms': 12000, # PERMNOs alive after 1990
+              'kld_companies': 5000, # about 50,000 kld.history rows
+              'first_year': 1990,
+              'last_year': 2017,
+              'kld_years': (1991, 2015)}
+
+WORDS = ['ALPHA', 'AMERICAN', 'ATLANTIC', 'BANCORP', 'BAY', 'BETA', 'BIO', 'BRIDGE', 'CAPITAL',
+         'CENTRAL', 'CHEMICAL', 'CITY', 'COASTAL', 'COMMERCE', 'CONTINENTAL', 'DATA', 'DELTA',
+         'DIGITAL', 'DYNAMICS', 'EAGLE', 'ELECTRIC', 'ENERGY', 'FIRST', 'FOODS', 'GENERAL',
+         'GLOBAL', 'GOLD', 'GREAT', 'HEALTH', 'HOME', 'INDUSTRIES', 'INTERNATIONAL', 'LAKE',
+         'MEDICAL', 'METALS', 'MOTORS', 'MUTUAL', 'NATIONAL', 'NETWORK', 'NORTH', 'OCEAN',
+         'OMEGA', 'PACIFIC', 'PETROLEUM', 'PHARMA', 'PIONEER', 'POWER', 'RESOURCES', 'RIVER',
+         'SCIENTIFIC', 'SECURITY', 'SOUTH', 'STAR', 'STEEL', 'SUMMIT', 'SYSTEMS', 'TECH',
+         'TRUST', 'UNION', 'UNITED', 'VALLEY', 'WEST', 'WIRELESS']
+SUFFIXES = ['INC', 'CORP', 'CO', 'LTD', 'HOLDINGS INC', 'GROUP INC', 'CORPORATION', '& CO']
+
+# KLD items per category (strengths 'str', concerns 'con'), '<cat>_<kind>_num' is their sum
+KLD_ITEMS = {'env': (7, 6), 'com': (7, 4), 'hum': (4, 7), 'emp': (7, 5), 'div': (8, 3),
+             'pro': (4, 5), 'cgov': (5, 6), 'alc': (0, 1), 'gam': (0, 1), 'fir': (0, 1),
+             'mil': (0, 3), 'nuc': (0, 3), 'tob': (0, 1)}
+
+_BASE36 = np.array(list(string.digits + string.ascii_uppercase))
+_LETTERS = np.array(list(string.ascii_uppercase))
+
+
+def _chars(rng, n, width, alphabet=_BASE36):
+    """
+    n random strings of 'width' characters of 'alphabet'.
+    """
+    codes = alphabet[rng.integers(0, len(alphabet), size=(n, width))]
+    return codes.view('<U%d' % width).ravel() if n else np.array([], dtype='<U%d' % width)
+
+
+def _issuerCusips(rng, n):
+    """
+    n distinct 6-character issuer CUSIPs, a third of them with leading zeros.
+    """
+    cusips = np.array([], dtype='<U6')
+    while len(cusips) < n:
+        m = 2 * (n - len(cusips)) + 10
+        zeros = rng.choice([0, 1, 2, 3], size=m, p=[.65, .2, .1, .05])
+        tail = _chars(rng, m, 6)
+        new = np.array(['0' * z + t[z:] if z else ('1' + t[1:] if t[0] == '0' else t)
+                        for z, t in zip(zeros, tail)])
+        cusips = pd.unique(np.concatenate([cusips, new]))
+    return cusips[:n]
+
+
+def _tickers(rng, n):
+    lengths = rng.choice([1, 2, 3, 4], size=n, p=[.05, .15, .45, .35])
+    letters = _chars(rng, n, 4, _LETTERS)
+    return np.array([t[:k] for t, k in zip(letters, lengths)], dtype=object)
+
+
+def _monthEnds(first_year, last_year):
+    """
+    Last business day of every month (the dates of crsp.msf).
+    """
+    return pd.date_range('%d-01-01' % first_year, '%d-12-31' % last_year, freq='BM')
+
+
+def _dates(values):
+    """
+    datetime64 -> datetime.date objects (None for NaT), as returned by WRDS.
+    """
+    values = pd.Series(pd.to_datetime(values))
+    return np.where(values.isna(), None, values.dt.date.astype(object))
+
+
+def _firms(rng, n, first_year, last_year):
+    """
+    CRSP firms: PERMNO, GVKEY, life span, and one to three name periods each
+    with a name, ticker and NCUSIP.
+    """
+    start = rng.integers(first_year - 5, last_year - 1, size=n)
+    life = 2 + rng.exponential(14, size=n).astype(int)
+    end = np.minimum(start + life, last_year)
+    firms = pd.DataFrame({'permno': 10001 + np.arange(n), 'permco': 50001 + np.arange(n),
+                          'gvkey': ['%06d' % (1001 + i) for i in range(n)],
+                          'start': start, 'end': end})
+
+    # name periods
+    k = 1 + rng.binomial(2, .3, size=n)
+    k = np.minimum(k, end - start + 1)
+    firm = np.repeat(np.arange(n), k)
+    period = np.concatenate([np.arange(j) for j in k])
+    cuts = start[firm] + np.floor((end[firm] - start[firm] + 1) * period / k[firm]).astype(int)
+    periods = pd.DataFrame({'firm': firm, 'period': period, 'pstart': cuts})
+    next_start = periods.groupby('firm').pstart.shift(-1)
+    periods['pend'] = next_start.fillna(pd.Series(end[firm] + 1)).astype(int) - 1
+
+    base = np.array([' '.join(rng.choice(WORDS, size=2 + (rng.random() < .3), replace=False))
+                     for _ in range(n)], dtype=object)
+    suffix = rng.choice(SUFFIXES, size=n)
+    issuer = _issuerCusips(rng, n + n // 2)
+    ticker = _tickers(rng, int(.8 * n) + 1) # fewer tickers than firms: tickers get reused
+    first_ticker = rng.choice(ticker, size=n)
+
+    later = periods.period.to_numpy() > 0
+    renamed = later & (rng.random(len(periods)) < .6)
+    new_suffix = rng.choice(SUFFIXES, size=len(periods))
+    periods['comnam'] = np.where(renamed, base[firm] + ' ' + new_suffix,
+                                 base[firm] + ' ' + suffix[firm])
+    periods.loc[later & ~renamed & (rng.random(len(periods)) < .5), 'comnam'] += ' NEW'
+    # CUSIP and ticker changes carry over to the later periods
+    new_issuer = later & (rng.random(len(periods)) < .3)
+    periods['cusip6'] = np.where(~later, issuer[firm],
+                                 np.where(new_issuer, rng.choice(issuer[n:], size=len(periods)), None))
+    periods['cusip6'] = periods.groupby('firm').cusip6.ffill()
+    periods['ncusip'] = periods.cusip6 + np.where(rng.random(len(periods)) < .9, '10', '20')
+    new_ticker = later & (rng.random(len(periods)) < .3)
+    periods['ticker'] = np.where(~later, first_ticker[firm],
+                                 np.where(new_ticker, rng.choice(ticker, size=len(periods)), None))
+    periods['ticker'] = periods.groupby('firm').ticker.ffill()
+    periods.loc[rng.random(len(periods)) < .02, 'ticker'] = None
+    periods['cusip'] = periods.groupby('firm').ncusip.transform('last') # header CUSIP
+    return firms, periods
+
+
+def syntheticTables(scale=1, seed=0, production=PRODUCTION):
+    """
+    Synthetic kld.history, crsp.stocknames, crsp.msenames, crsp.msf,
+    crsp.ccmxpf_linktable and comp.funda at 'scale' times 'production'.
+    """
+    rng = np.random.default_rng(seed)
+    first_year, last_year = production['first_year'], production['last_year']
+    n = max(int(round(production['crsp_firms'] * scale)), 10)
+    firms, periods = _firms(rng, n, first_year, last_year)
+    firm = periods.firm.to_numpy()
+
+    #########################
+    # crsp.stocknames / msenames #
+    #########################
+    namedt = pd.to_datetime(periods.pstart.astype(str) + '-01-01')
+    nameenddt = pd.to_datetime(periods.pend.astype(str) + '-12-31')
+    shrcd = rng.choice([10., 11., 12., 31., 73.], size=n, p=[.45, .43, .04, .04, .04])[firm]
+    stocknames = pd.DataFrame({
+        'permno': firms.permno.to_numpy()[firm].astype(float),
+        'namedt': _dates(namedt),
+        'nameenddt': _dates(nameenddt),
+        'shrcd': shrcd,
+        'exchcd': rng.choice([1., 2., 3.], size=len(periods)),
+        'siccd': rng.choice([1311., 2834., 3571., 3674., 4911., 6022., 7372.], size=n)[firm],
+        'ncusip': np.where(rng.random(len(periods)) < .01, '', periods.ncusip),
+        'ticker': periods.ticker.to_numpy(),
+        'comnam': periods.comnam.to_numpy(),
+        'shrcls': None,
+        'permco': firms.permco.to_numpy()[firm].astype(float),
+        'hexcd': rng.choice([1., 2., 3.], size=len(periods)),
+        'cusip': periods.cusip.to_numpy()})
+    # msenames names the end date 'nameendt'
+    msenames = stocknames[['permno', 'namedt', 'nameenddt', 'shrcd', 'exchcd', 'siccd',
+                           'ncusip', 'ticker', 'comnam', 'shrcls', 'permco', 'hexcd']]
+    msenames = msenames.rename(columns={'nameenddt': 'nameendt'})
+
+    #############
+    # crsp.msf #
+    #############
+    months = _monthEnds(first_year - 5, last_year)
+    first = (np.maximum(firms.start.to_numpy(), first_year) - (first_year - 5)) * 12
+    count = (firms.end.to_numpy() - np.maximum(firms.start.to_numpy(), first_year) + 1) * 12
+    count = np.maximum(count, 0)
+    row_firm = np.repeat(np.arange(n), count)
+    offset = np.arange(len(row_firm)) - np.repeat(np.cumsum(count) - count, count)
+    header = periods.groupby('firm').cusip.last().to_numpy()
+    msf = pd.DataFrame({
+        'permno': firms.permno.to_numpy()[row_firm].astype(float),
+        'date': _dates(months[first[row_firm] + offset]),
+        'cusip': pd.Categorical(header[row_firm]),
+        'prc': np.round(rng.lognormal(3, 1, size=len(row_firm)), 2),
+        'ret': np.round(rng.normal(.01, .1, size=len(row_firm)), 6),
+        'shrout': np.round(rng.lognormal(10, 1.5, size=len(row_firm)))})
+
+    ##########################
+    # crsp.ccmxpf_linktable #
+    ##########################
+    linked = rng.random(n) < .9
+    ccm = pd.DataFrame({
+        'gvkey': firms.gvkey[linked].to_numpy(),
+        'linkprim': rng.choice(['P', 'C', 'J'], size=linked.sum(), p=[.9, .08, .02]),
+        'liid': '01',
+        'linktype': rng.choice(['LU', 'LC', 'LN'], size=linked.sum(), p=[.7, .25, .05]),
+        'lpermno': firms.permno[linked].to_numpy().astype(float),
+        'lpermco': firms.permco[linked].to_numpy().astype(float),
+        'usedflag': rng.choice([1., -1.], size=linked.sum(), p=[.98, .02]),
+        'linkdt': _dates(pd.to_datetime(firms.start[linked].astype(str) + '-01-01')),
+        'linkenddt': _dates(pd.to_datetime(firms.end[linked].astype(str) + '-12-31')
+                            .where(firms.end[linked].to_numpy() < last_year))})
+
+    ###############
+    # comp.funda #
+    ###############
+    fstart = np.maximum(firms.start.to_numpy(), first_year - 2)
+    fcount = np.where(linked, np.maximum(firms.end.to_numpy() - fstart + 1, 0), 0)
+    f_firm = np.repeat(np.arange(n), fcount)
+    fyear = fstart[f_firm] + np.arange(len(f_firm)) - np.repeat(np.cumsum(fcount) - fcount, fcount)
+    fyr = rng.choice([12, 3, 6, 9], size=n, p=[.7, .1, .1, .1])[f_firm]
+    datadate = pd.to_datetime(pd.DataFrame({'year': np.where(fyr >= 6, fyear, fyear + 1),
+                                            'month': fyr, 'day': 1})) + pd.offsets.MonthEnd(0)
+    last_name = periods.groupby('firm').comnam.last().to_numpy()
+    last_ticker = periods.groupby('firm').ticker.last().to_numpy()
+    funda = pd.DataFrame({
+        'gvkey': firms.gvkey.to_numpy()[f_firm],
+        'datadate': _dates(datadate),
+        'fyear': fyear.astype(float),
+        'fyr': fyr.astype(float),
+        'conm': last_name[f_firm],
+        'tic': last_ticker[f_firm],
+        'cusip': header[f_firm] + '1',
+        'sich': rng.choice([1311., 2834., 3571., 3674., 4911., 6022., 7372., np.nan], size=n)[f_firm],
+        'consol': 'C',
+        'indfmt': 'INDL',
+        'datafmt': 'STD',
+        'popsrc': 'D',
+        'curcd': np.where(rng.random(n) < .03, 'CAD', 'USD')[f_firm],
+        'final': 'Y',
+        'fic': np.where(rng.random(n) < .05, 'CAN', 'USA')[f_firm]})
+    size = rng.lognormal(6, 2, size=n)[f_firm] * rng.lognormal(0, .1, size=len(f_firm))
+    signed = {'ib', 'ni', 'epsfx', 'epsfi', 'seq', 'oibdp', 'ebitda', 'gp'}
+    for c in fundaColumns(FUNDA_OUTPUTS):
+        if c in funda.columns:
+            continue
+        values = size * rng.lognormal(-1, 1, size=len(f_firm))
+        if c in signed:
+            values *= np.where(rng.random(len(f_firm)) < .2, -1, 1)
+        funda[c] = np.where(rng.random(len(f_firm)) < .1, np.nan, np.round(values, 3))
+    funda['sale'] = np.where(rng.random(len(f_firm)) < .05, np.nan, np.round(size, 3))
+    funda['at'] = np.round(size * rng.lognormal(.3, .5, size=len(f_firm)), 3)
+    # financial services format duplicates, dropped by "indfmt = 'INDL'"
+    fs = funda.sample(frac=.03, random_state=seed).assign(indfmt='FS')
+    funda = pd.concat([funda, fs]).sort_values(['gvkey', 'datadate'], kind='mergesort')
+    funda = funda.reset_index(drop=True)
+
+    #################
+    # kld.history #
+    #################
+    kld_first, kld_last = production['kld_years']
+    m = max(int(round(production['kld_companies'] * scale)), 5)
+    alive = np.flatnonzero((firms.end.to_numpy() >= kld_first) & (firms.start.to_numpy() <= kld_last))
+    in_crsp = rng.choice(alive, size=min(int(.92 * m), len(alive)), replace=False)
+    k_firm = np.sort(in_crsp)
+    # coverage grows over time: most companies enter in the 2000s
+    entry = np.maximum(np.maximum(firms.start.to_numpy()[k_firm], kld_first),
+                       rng.choice([1991, 2001, 2003], size=len(k_firm), p=[.45, .25, .3]))
+    exit_ = np.minimum(firms.end.to_numpy()[k_firm], kld_last)
+    kcount = np.maximum(exit_ - entry + 1, 0)
+    r_firm = np.repeat(k_firm, kcount)
+    year = np.repeat(entry, kcount) + np.arange(kcount.sum()) - np.repeat(np.cumsum(kcount) - kcount, kcount)
+
+    # name period of each year
+    key = periods.firm.to_numpy() * 10000 + periods.pend.to_numpy()
+    p = np.searchsorted(key, r_firm * 10000 + year)
+    comnam = periods.comnam.to_numpy()[p]
+    styled = rng.random(len(p))
+    companyname = np.where(styled < .25, [c.title() for c in comnam],
+                           np.where(styled < .4, [re.sub(r' (INC|CORP|CO|LTD)$', r' \1.', c)
+                                                  for c in comnam], comnam))
+    cusip = periods.ncusip.to_numpy()[p].astype(object)
+    ticker = periods.ticker.to_numpy()[p].astype(object)
+
+    # KLD companies that are not in CRSP
+    extra = m - len(k_firm)
+    if extra > 0:
+        x_entry = rng.integers(kld_first, kld_last + 1, size=extra)
+        x_count = rng.integers(1, 6, size=extra)
+        x_count = np.minimum(x_count, kld_last - x_entry + 1)
+        x_year = np.repeat(x_entry, x_count) + np.arange(x_count.sum()) - np.repeat(np.cumsum(x_count) - x_count, x_count)
+        x_names = np.array([' '.join(rng.choice(WORDS, size=3, replace=False)) + ' ' + s
+                            for s in rng.choice(SUFFIXES, size=extra)], dtype=object)
+        year = np.concatenate([year, x_year])
+        r_firm = np.concatenate([r_firm, n + np.repeat(np.arange(extra), x_count)])
+        companyname = np.concatenate([companyname, np.repeat(x_names, x_count)])
+        cusip = np.concatenate([cusip, np.repeat(_chars(rng, extra, 8).astype(object), x_count)])
+        ticker = np.concatenate([ticker, np.repeat(_tickers(rng, extra), x_count)])
+
+    # CUSIP defects: shifted left over the leading zeros, or missing
+    rows = len(year)
+    u = rng.random(rows)
+    zeros = np.array([len(c) - len(c.lstrip('0')) if isinstance(c, str) else 0 for c in cusip])
+    shift = np.minimum(zeros, rng.integers(1, 4, size=rows))
+    shifted = (u < .06) & (shift > 0)
+    pad = _chars(rng, rows, 3)
+    cusip = np.where(shifted, [c[s:] + q[:s] if s else c for c, s, q in zip(cusip, shift, pad)], cusip)
+    cusip = np.where((u >= .06) & (u < .08), 'NA', cusip)
+    cusip = np.where((u >= .08) & (u < .085), '0', cusip)
+    cusip = np.where((u >= .085) & (u < .09), '#N/A', cusip)
+    cusip = np.where((u >= .09) & (u < .11), None, cusip)
+    # ticker defects
+    v = rng.random(rows)
+    ticker = np.where(v < .03, None, ticker)
+    ticker = np.where((v >= .03) & (v < .04), 'NA', ticker)
+    ticker = np.where((v >= .04) & (v < .045), '#N/A', ticker)
+    ticker = np.where((v >= .045) & (v < .07), [t.lower() if isinstance(t, str) else t for t in ticker], ticker)
+
+    # the CUSIP shifted by one and two zeros that 'cusipCorrection' excludes by hand
+    year = np.concatenate([year, [2001., 2002., 2003.]])
+    r_firm = np.concatenate([r_firm, [-1, -1, -1]])
+    companyname = np.concatenate([companyname, ['TRIPLE SHIFT CORP'] * 3])
+    cusip = np.concatenate([cusip, ['00030710', '03071010', '30710100']])
+    ticker = np.concatenate([ticker, ['TSC'] * 3])
+    rows = len(year)
+
+    kld = pd.DataFrame({'companyname': companyname,
+                        'companyid': r_firm.astype(float),
+                        'ticker': ticker,
+                        'cusip': cusip,
+                        'year': year.astype(float),
+                        'domicile': np.where(rng.random(rows) < .98, 'USA', 'CAN')})
+    flags = {}
+    for category, (strengths, concerns) in KLD_ITEMS.items():
+        for kind, count, p_flag in [('str', strengths, .08), ('con', concerns, .06)]:
+            if not count:
+                continue
+            items = []
+            for j in range(count):
+                name = '%s_%s_%s' % (category, kind, string.ascii_lowercase[j])
+                since = rng.choice([kld_first, kld_first, 2000, 2005, 2010])
+                values = (rng.random(rows) < p_flag).astype(float)
+                flags[name] = np.where(year < since, np.nan, values)
+                items.append(flags[name])
+            items = np.vstack(items)
+            flags['%s_%s_num' % (category, kind)] = np.where(np.isnan(items).all(axis=0), np.nan,
+                                                             np.nansum(items, axis=0))
+    kld = pd.concat([kld, pd.DataFrame(flags)], axis=1)
+    kld = kld.sort_values(['year', 'companyname'], kind='mergesort').reset_index(drop=True)
+
+    return {'kld.history': kld,
+            'crsp.stocknames': stocknames,
+            'crsp.msenames': msenames,
+            'crsp.msf': msf,
+            'crsp.ccmxpf_linktable': ccm,
+            'comp.funda': funda}
+
+
+class SyntheticConnection:
+    """
+    Stand-in for wrds.Connection() over the tables of syntheticTables(),
+    running the SQL in an in-memory SQLite database.
+    """
+
+    def __init__(self, tables=None, scale=1, seed=0):
+        self.tables = tables if tables is not None else syntheticTables(scale, seed)
+        self.db = sqlite3.connect(':memory:', check_same_thread=False)
+        for schema in sorted(set(name.split('.')[0] for name in self.tables)):
+            self.db.execute("attach database ':memory:' as %s" % schema)
+        self.loaded = set()
+
+    def _load(self, name):
+        data = self.tables[name]
+        schema, table = name.split('.')
+        columns = []
+        for c in data.columns:
+            kind = 'REAL' if pd.api.types.is_numeric_dtype(data[c]) else 'TEXT'
+            columns.append('%s %s' % (c, kind))
+        self.db.execute('create table %s.%s (%s)' % (schema, table, ', '.join(columns)))
+        values = data.astype(object).where(data.notna(), None)
+        for c in values.columns:
+            if pd.api.types.is_categorical_dtype(data[c]) or not pd.api.types.is_numeric_dtype(data[c]):
+                values[c] = values[c].map(lambda v: v if v is None else str(v))
+        self.db.executemany('insert into %s.%s values (%s)' % (schema, table, ', '.join('?' * len(columns))),
+                            values.itertuples(index=False, name=None))
+        for key in ('permno', 'lpermno', 'gvkey'):
+            if key in data.columns:
+                self.db.execute('create index %s.%s_%s on %s (%s)' % (schema, table, key, table, key))
+        self.db.commit()
+        self.loaded.add(name)
+
+    def raw_sql(self, sql, **kwargs):
+        for schema, table in re.findall(r'\b(kld|crsp|comp)\.(\w+)', sql, flags=re.IGNORECASE):
+            name = '%s.%s' % (schema.lower(), table.lower())
+            if name in self.tables and name not in self.loaded:
+                self._load(name)
+        data = pd.read_sql_query(sql, self.db)
+        # WRDS returns dates as datetime.date
+        for c in data.columns:
+            if c.lower() in ('date', 'namedt', 'nameenddt', 'nameendt', 'datadate', 'linkdt', 'linkenddt'):
+                data[c] = _dates(data[c])
+        return data
+
+    def close(self):
+        pass
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Pak Shing Ho
+
+Typed, year-partitioned Parquet copies of the pipeline outputs.
+
+writeTable writes a table as CSV (as before) and/or as Parquet. The Parquet
+copy of 'KLD_Compustat.csv' is the folder 'KLD_Compustat.parquet' with one
+file per year,
+    KLD_Compustat.parquet/fyear=2015/part.parquet
+keeping the dtypes of the DataFrame (no 'dtype={'gvkey': str}' needed).
+
+readTable reads the Parquet copy when it exists, and only the files of the
+requested years and the requested columns. Otherwise it falls back to the CSV.
+
+Usage:
+    writeTable(df, 'KLD_Compustat.csv', year='fyear', formats=('csv', 'parquet'))
+    df = readTable('KLD_Compustat.csv', columns=['gvkey', 'fyear', 'sale'],
+                   years=(2010, 2015), year='fyear', dtype={'gvkey': str})
+"""
+
+import os
+import re
+import shutil
+
+import pandas as pd
+
+
+PART = 'part.parquet'
+
+
+def parquetPath(path):
+    """
+    'KLD_Compustat.csv' -> 'KLD_Compustat.parquet'
+    """
+    return os.path.splitext(path)[0] + '.parquet'
+
+
+def writeParquet(DataFrame, path, year=None):
+    """
+    Write one Parquet file per value of the 'year' column (a single file if
+    'year' is None) into the folder 'path', replacing an earlier copy.
+    """
+    tmp = path + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    data = DataFrame.reset_index(drop=True)
+    if year is None or data.empty:
+        data.to_parquet(os.path.join(tmp, PART))
+    else:
+        years = pd.to_numeric(data[year], errors='coerce')
+        for y, part in data.groupby(years.fillna(-1).astype('int64').to_numpy(), sort=True):
+            folder = os.path.join(tmp, '%s=%s' % (year, y if y >= 0 else 'NA'))
+            os.makedirs(folder)
+            part.to_parquet(os.path.join(folder, PART))
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp, path)
+
+
+def writeTable(DataFrame, path, year=None, formats=('csv',)):
+    """
+    Write 'DataFrame' to the CSV file 'path' and/or to its Parquet copy,
+    partitioned by the 'year' column.
+    """
+    if 'csv' in formats:
+        DataFrame.to_csv(path, index=False)
+    if 'parquet' in formats:
+        writeParquet(DataFrame, parquetPath(path), year)
+
+
+def _inYears(y, years):
+    if years is None:
+        return True
+    if y is None:
+        return False
+    first, last = years
+    return (first is None or y >= first) and (last is None or y <= last)
+
+
+def readParquet(path, columns=None, years=None):
+    """
+    Read the Parquet folder 'path', only the 'columns' and the files of the
+    years in 'years' = (first, last), both included. Rows keep the order of
+    the written table.
+    """
+    files = []
+    for entry in os.listdir(path):
+        match = re.match(r'^(\w+)=(-?\d+|NA)$', entry)
+        if entry == PART:
+            files.append(os.path.join(path, entry))
+        elif match:
+            if _inYears(None if match.group(2) == 'NA' else int(match.group(2)), years):
+                files.append(os.path.join(path, entry, PART))
+    if not files:
+        return pd.read_parquet(_anyFile(path), columns=columns).iloc[0:0].reset_index(drop=True)
+
+    parts = [pd.read_parquet(f, columns=columns) for f in files]
+    # the index holds the row numbers of the written table
+    data = pd.concat(parts).sort_index(kind='mergesort').reset_index(drop=True)
+    for c in data.columns:
+        # parts with different categories are concatenated as object
+        if isinstance(parts[0][c].dtype, pd.CategoricalDtype) and data[c].dtype == object:
+            data[c] = data[c].astype('category')
+    return data
+
+
+def _anyFile(path):
+    for root, _, names in os.walk(path):
+        if PART in names:
+            return os.path.join(root, PART)
+    raise FileNotFoundError(path)
+
+
+def readTable(path, columns=None, years=None, year=None, **csv_kwargs):
+    """
+    Read a table written by writeTable, from its Parquet copy if there is one,
+    else from the CSV file 'path'. 'years' is an (first, last) range, either
+    end may be None, or a single year. With the CSV, 'year' names the column
+    the years are taken from, and 'csv_kwargs' (e.g. dtype) go to read_csv.
+    """
+    if years is not None and not isinstance(years, (tuple, list)):
+        years = (years, years)
+
+    if os.path.isdir(parquetPath(path)):
+        return readParquet(parquetPath(path), columns=columns, years=years)
+
+    if years is not None and year is None:
+        raise ValueError('Name the year column to select years from ' + path)
+    usecols = None
+    if columns is not None:
+        usecols = list(columns) + ([year] if years is not None and year not in columns else [])
+    data = pd.read_csv(path, usecols=usecols, **csv_kwargs)
+    if years is not None:
+        y = pd.to_numeric(data[year], errors='coerce')
+        first, last = years
+        keep = y.notna()
+        if first is not None:
+            keep &= y >= first
+        if last is not None:
+            keep &= y <= last
+        data = data.loc[keep].reset_index(drop=True)
+    if columns is not None:
+        data = data[list(columns)]
+    return data
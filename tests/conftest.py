@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pytest
+
+# the modules of the repository are imported from its root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def linkTables():
+    """
+    The extracted synthetic tables (0.1x) of 'benchmark.py', with the KLD and
+    CRSP names of Steps 1-2 ('kld', 'crsp2', 'crsp_n2'), their CUSIP and
+    TICKER link candidates ('cusip_candidates', 'ticker_candidates'), the KLD
+    panel ('KLD') and the KLD-CRSP link table ('kld_crsp_link') of Steps 1-3,
+    and the connection they come from ('conn').
+    """
+    import benchmark
+    from cusipCorrection import cusipCorrectionFast
+    from kldCompLink import alignKldDates
+    from kldCrspLink import (cleanKld, addKldDates, kldCusipDates, crspCusipNames, crspTickerNames,
+                             cusipCandidates, tickerCandidates, finalizeLinks)
+    from syntheticData import SyntheticConnection, syntheticTables
+
+    conn = SyntheticConnection(syntheticTables(0.1, 0))
+    t = benchmark._extract(conn)
+    kld = addKldDates(cleanKld(cusipCorrectionFast(t['kld_raw'])))
+    kld_last = kldCusipDates(kld)
+    crsp2, crsp_n2 = crspCusipNames(t['crsp_cusip_raw']), crspTickerNames(t['crsp_ticker_raw'])
+    cusip = cusipCandidates(kld_last, crsp2)
+    ticker = tickerCandidates(kld, kld_last, cusip, crsp_n2)
+    t.update(conn=conn, kld=kld, crsp2=crsp2, crsp_n2=crsp_n2, cusip_candidates=cusip,
+             ticker_candidates=ticker, KLD=alignKldDates(kld), kld_crsp_link=finalizeLinks(cusip, ticker))
+    return t
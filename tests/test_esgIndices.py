@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from esgIndices import esgIndices
+from frameSchema import compactFrame
+from syntheticData import syntheticTables
+
+
+@pytest.fixture(scope='module')
+def kld():
+    return syntheticTables(0.05, 0)['kld.history']
+
+
+def _items(data, prefixes):
+    # the masks of 'KLD_Compustat.ipynb'
+    mask = np.zeros(len(data.columns), dtype=bool)
+    for prefix in prefixes:
+        mask |= data.columns.str.contains(prefix) & ~data.columns.str.contains(prefix + '_num')
+    return data.columns[mask]
+
+
+@pytest.mark.parametrize('dtypes', ['float', 'compact', 'zero_filled'])
+def test_same_as_notebook_masks(kld, dtypes):
+    if dtypes == 'zero_filled':
+        # integer items without missing values still give float64 sums
+        kld = kld.fillna({c: 0 for c in _items(kld, ['_str', '_con'])})
+    data = kld if dtypes == 'float' else compactFrame(kld)
+    float_items = kld.astype({c: 'float64' for c in _items(kld, ['_str', '_con'])})
+    indices = esgIndices(data)
+
+    for name, prefixes in [('E_pos', ['env_str']), ('S_neg', ['com_con', 'hum_con', 'emp_con', 'div_con', 'pro_con']),
+                           ('CGOV_pos', ['cgov_str'])]:
+        items = _items(float_items, prefixes)
+        pd.testing.assert_series_equal(indices[name], float_items[items].sum(axis=1), check_names=False)
+        pd.testing.assert_series_equal(indices[name + '_avg'], float_items[items].mean(axis=1), check_names=False)
+    assert (indices.dtypes == 'float64').all()
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+
+from frameFingerprint import frameDifferences, frameFingerprint, sameRows
+
+
+def _frame():
+    return pd.DataFrame({'companyname': ['A CORP', 'B INC', None, 'D CO', 'B INC'],
+                         'permno': [10001, 10002, 10003, 10004, 10002],
+                         'date': pd.to_datetime(['2001-01-31', '2001-02-28', '2001-03-31', None, '2001-02-28']),
+                         'name_ratio': [95.0, np.nan, 80.0, 100.0, np.nan]})
+
+
+def test_reordered_rows_and_columns():
+    data = _frame()
+    shuffled = data.sample(frac=1, random_state=0)[['name_ratio', 'date', 'permno', 'companyname']]
+    assert frameFingerprint(shuffled) == frameFingerprint(data)
+    assert sameRows(shuffled, data)
+    assert sameRows(shuffled.reset_index(drop=True), data)
+
+
+def test_missing_values_equal():
+    # as with DataFrame.equals, NaN, None and NaT are equal to themselves
+    assert sameRows(_frame(), _frame().iloc[::-1])
+
+
+def test_duplicates_counted():
+    data = _frame()
+    once = data.drop_duplicates()
+    assert len(once) == len(data) - 1
+    assert not sameRows(once, data)
+    only_left, only_right = frameDifferences(once, data)
+    assert len(only_left) == 0
+    assert len(only_right) == 1 and only_right.iloc[0].companyname == 'B INC'
+
+    # the same number of rows, but another row duplicated
+    other = pd.concat([once, once.iloc[[0]]])
+    assert frameFingerprint(other).rows == frameFingerprint(data).rows
+    assert not sameRows(other, data)
+    only_left, only_right = frameDifferences(other, data)
+    assert list(only_left.companyname) == ['A CORP'] and list(only_right.companyname) == ['B INC']
+
+
+def test_changed_value(capsys):
+    data = _frame()
+    changed = data.copy()
+    changed.loc[2, 'name_ratio'] = np.nan
+    assert not sameRows(changed, data, keys=['permno'], names=('changed', 'data'))
+    assert 'changed and data differ: 1 rows only in changed, 1 rows only in data' in capsys.readouterr().out
+
+
+def test_columns_and_dtypes():
+    data = _frame()
+    assert not sameRows(data.drop(columns=['date']), data)
+    assert not sameRows(data.astype({'permno': 'float64'}), data)
@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from linkScore import addCusipSubstrings, scoreCusipLink, scoreTickerLink
+
+
+P10 = 85
+
+
+# the row-wise scores of the original 'KLD_CRSP_Link.py'
+def score1(row):
+    if (row['fdate']<=row['nameenddt']) & (row['ldate']>=row['namedt']) & (row['name_ratio'] >= P10):
+        score = 0
+    elif (row['fdate']<=row['nameenddt']) & (row['ldate']>=row['namedt']):
+        score = 1
+    elif row['name_ratio'] >= P10:
+        score = 2
+    else:
+        score = 3
+    return score
+
+
+def score2(row):
+    if ((row['cusip6']==row['ncusip6']) | (row['cusip6']==row['ncusip1_7'])) & (row['name_ratio'] >= P10):
+        score = 0
+    elif ((row['cusip6']==row['ncusip6']) | (row['cusip6']==row['ncusip1_7'])):
+        score = 4
+    elif row['name_ratio'] >= P10:
+        score = 5
+    else:
+        score = 6
+    return score
+
+
+@pytest.fixture
+def links():
+    rng = np.random.default_rng(0)
+    n = 2000
+    dates = {c: pd.Timestamp('1995-01-01') + pd.to_timedelta(rng.integers(0, 8000, n), unit='D')
+             for c in ['fdate', 'ldate', 'namedt', 'nameenddt']}
+    ncusips = ['%08d' % i for i in rng.integers(0, 30, n)]
+    # KLD CUSIPs equal to the CRSP ones, shifted by one digit, other or missing
+    cusips = [[c, '0' + c[:7], '%08d' % j, None][k] for c, j, k in
+              zip(ncusips, rng.integers(0, 30, n), rng.integers(0, 4, n))]
+    return pd.DataFrame({**dates, 'name_ratio': rng.integers(60, 101, n),
+                         'cusip': cusips, 'ncusip': ncusips}, index=np.arange(n) * 3)
+
+
+def test_cusip_score_same_as_row_wise(links):
+    scores = scoreCusipLink(links, P10)
+    pd.testing.assert_series_equal(scores, links.apply(score1, axis=1), check_dtype=False)
+    assert set(scores) == {0, 1, 2, 3}
+
+
+def test_ticker_score_same_as_row_wise(links):
+    old = links.copy()
+    old['cusip6'] = old[old['cusip'].notna()].apply(lambda x: x.cusip[:6], axis=1)
+    old['ncusip6'] = old.apply(lambda x: x.ncusip[:6], axis=1)
+    old['ncusip1_7'] = old.apply(lambda x: x.ncusip[1:7], axis=1)
+
+    for data in (links, links.astype({'cusip': 'category', 'ncusip': 'category'})):
+        new = addCusipSubstrings(data.copy())
+        assert (new.cusip6.isna() == old.cusip6.isna()).all()
+        scores = scoreTickerLink(new, P10)
+        pd.testing.assert_series_equal(scores, old.apply(score2, axis=1), check_dtype=False)
+        assert set(scores) == {0, 4, 5, 6}
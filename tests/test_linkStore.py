@@ -0,0 +1,45 @@
+import pandas as pd
+import pytest
+
+from cusipCorrection import cusipCorrectionFast
+from kldCrspLink import cleanKld, addKldDates, kldCusipDates
+from linkStore import LinkStore
+
+
+def _kld(kld_raw):
+    # _kld2 and _kld3 of the link scripts
+    kld = addKldDates(cleanKld(cusipCorrectionFast(kld_raw)))
+    return kld, kldCusipDates(kld)
+
+
+@pytest.mark.parametrize('name_link', [False, True])
+def test_update_after_new_year_same_as_rebuild(linkTables, tmp_path, name_link):
+    t = linkTables
+    kld_raw = t['kld_raw']
+    last_year = kld_raw.year.max()
+
+    store = LinkStore(str(tmp_path / 'incremental'))
+    store.update(*_kld(kld_raw.loc[kld_raw.year < last_year]), t['crsp2'], t['crsp_n2'],
+                 name_link=name_link)
+    incremental = store.update(*_kld(kld_raw), t['crsp2'], t['crsp_n2'], name_link=name_link)
+    rebuild = LinkStore(str(tmp_path / 'rebuild')).update(*_kld(kld_raw), t['crsp2'], t['crsp_n2'],
+                                                          name_link=name_link)
+
+    # only part of the companies were linked again
+    latest = store.versions[-1]
+    assert latest['version'] == 2
+    assert 0 < latest['changed'] < latest['companies']
+    assert len(rebuild)
+    pd.testing.assert_frame_equal(incremental, rebuild)
+    if not name_link:
+        pd.testing.assert_frame_equal(rebuild, t['kld_crsp_link'], check_categorical=False)
+
+
+def test_unchanged_inputs_no_new_version(linkTables, tmp_path):
+    t = linkTables
+    store = LinkStore(str(tmp_path))
+    first = store.update(*_kld(t['kld_raw']), t['crsp2'], t['crsp_n2'])
+    again = store.update(*_kld(t['kld_raw']), t['crsp2'], t['crsp_n2'])
+    assert len(store.versions) == 1
+    # read back from Parquet, without the index of 'finalizeLinks'
+    pd.testing.assert_frame_equal(again, first.reset_index(drop=True))
@@ -0,0 +1,30 @@
+import pandas as pd
+import pytest
+
+from frameFingerprint import sameRows
+from kldCompLink import linkMsf
+from msfStream import mergeMsf
+
+
+def _objects(data):
+    # the msf chunks have their own categories, which pd.concat turns into objects
+    return data.astype({c: object for c in data if isinstance(data[c].dtype, pd.CategoricalDtype)})
+
+
+@pytest.mark.parametrize('chunk_permnos', [7, 500])
+def test_link_msf_streamed_same_as_serial(linkTables, chunk_permnos):
+    t = linkTables
+    serial = linkMsf(None, t['KLD'], t['kld_crsp_link'], crsp_msf=t['crsp_msf'], shard_by_year=False)
+    streamed = linkMsf(t['conn'], t['KLD'], t['kld_crsp_link'], chunk_permnos=chunk_permnos)
+    assert len(serial)
+    pd.testing.assert_frame_equal(_objects(streamed), _objects(serial))
+
+
+def test_msf_left_side_same_rows_as_serial(linkTables):
+    # crsp_linked of the link scripts; the rows come in PERMNO chunks
+    t = linkTables
+    serial = t['crsp_msf'].merge(t['kld_crsp_link'], on='permno', suffixes=('_crsp', '_LINK'))
+    streamed = mergeMsf(t['conn'], t['kld_crsp_link'], on='permno', msf_side='left',
+                        chunk_permnos=7, suffixes=('_crsp', '_LINK'))
+    assert len(serial)
+    assert sameRows(_objects(streamed), _objects(serial))
@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+import pytest
+from fuzzywuzzy import fuzz, utils
+
+import nameRatio as nameRatioModule
+from nameDictionary import NameDictionary, LEGAL_SUFFIXES
+from nameRatio import nameRatio
+
+
+PAIRS = [('APPLE INC', 'Apple, Inc.', True),
+         ('APPLE INC', 'APPLE', True),                 # suffixes of one name in the other
+         ('APPLE', 'APPLE CORP', True),
+         ('AT&T CORP', 'AT T', True),                  # punctuation as spaces
+         ('INTL BUSINESS MACHINES CORP', 'BUSINESS MACHINES INTL', True), # word order
+         ('NESTLE SA', 'Nestlé S.A.', False),          # 'é' is dropped, 'S.A.' is 's a'
+         ('APPLE INC', 'APPLE CORP', False),           # different suffixes: ratio below 100
+         ('APPLE INC', 'APPLE COMPUTER INC', False),   # different words
+         ('INC', 'CORP', False),
+         ('', 'INC', False),                           # no words
+         ('!!', '??', False),
+         (None, 'APPLE INC', False)]
+
+
+def test_exact_match_pairs():
+    names = NameDictionary()
+    left = names.intern([a for a, _, _ in PAIRS])
+    right = names.intern([b for _, b, _ in PAIRS])
+    assert left[-1] == -1
+    exact = names.exactMatch(left, right)
+    assert exact.tolist() == [e for _, _, e in PAIRS]
+    # token_set_ratio is 100 on every exact match
+    for (a, b, _), e in zip(PAIRS, exact):
+        if e:
+            assert fuzz.token_set_ratio(a, b) == 100
+
+
+def test_exact_match_implies_100():
+    rng = np.random.default_rng(0)
+    words = ['ALPHA', 'BETA', 'GAMMA', 'INC', 'CORP', 'CO', 'LTD', 'HOLDINGS', '&', '-', 'A.B.']
+    make = lambda: ' '.join(rng.choice(words, rng.integers(0, 5)))
+    left, right = [make() for _ in range(3000)], [make() for _ in range(3000)]
+    names = NameDictionary()
+    exact = names.exactMatch(names.intern(left), names.intern(right))
+    assert exact.sum() > 100
+    ratios = np.array([fuzz.token_set_ratio(a, b) for a, b in zip(left, right)])
+    assert (ratios[exact] == 100).all()
+    # the exact matches are the pairs with the same words but for the legal suffixes,
+    # and the suffixes of one name all in the other
+    def split(name):
+        words = set(utils.full_process(name, force_ascii=True).split())
+        return words, words - set(LEGAL_SUFFIXES), words & set(LEGAL_SUFFIXES)
+    expected = []
+    for a, b in zip(left, right):
+        (words_a, rest_a, suffix_a), (words_b, rest_b, suffix_b) = split(a), split(b)
+        expected.append(bool(words_a and words_b and rest_a == rest_b
+                             and (suffix_a <= suffix_b or suffix_b <= suffix_a)))
+    assert exact.tolist() == expected
+
+
+def test_name_ratio_skips_exact_matches(monkeypatch):
+    data = pd.DataFrame({'comnam': [a for a, _, _ in PAIRS] * 2,
+                         'companyname': [b for _, b, _ in PAIRS] * 2})
+    scored = []
+    scorePairs = nameRatioModule.scorePairs
+    def recordPairs(left, right, **kwargs):
+        scored.extend(zip(left, right))
+        return scorePairs(left, right, **kwargs)
+    monkeypatch.setattr(nameRatioModule, 'scorePairs', recordPairs)
+
+    ratios = nameRatio(data, n_jobs=1)
+    expected = data.apply(lambda x: fuzz.token_set_ratio(x.comnam, x.companyname), axis=1)
+    pd.testing.assert_series_equal(ratios, expected, check_dtype=False)
+    # each distinct pair once, and no exact match
+    assert sorted(scored, key=str) == sorted([(a, b) for a, b, e in PAIRS if not e], key=str)
+
+
+def test_dictionary_per_call_or_shared():
+    data = pd.DataFrame({'comnam': ['APPLE INC', 'IBM CORP'], 'companyname': ['APPLE', 'IBM']})
+    nameRatio(data, n_jobs=1)
+    names = NameDictionary()
+    first = nameRatio(data, n_jobs=1, names=names)
+    assert len(names) == 4
+    second = nameRatio(data.iloc[::-1], n_jobs=1, names=names)
+    assert len(names) == 4
+    pd.testing.assert_series_equal(second, first.iloc[::-1])
+    assert not hasattr(nameRatioModule, 'NAMES')
@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+import pytest
+from fuzzywuzzy import fuzz
+
+from kldCrspLink import nameCandidates, finalizeLinks, NAME_LINK_SCORE
+from nameIndex import NameTokenIndex
+
+
+def _bestRatios(queries, names):
+    # brute force: the name ratio of each query with every name
+    return np.array([[fuzz.token_set_ratio(q, n) for n in names] for q in queries])
+
+
+@pytest.mark.parametrize('top_k, recall', [(1, 0.95), (10, 1.0)])
+def test_top_k_recall(linkTables, top_k, recall):
+    # a name with the best brute-force ratio (of at least 90) is among the top_k
+    t = linkTables
+    index = NameTokenIndex(t['crsp2'].comnam)
+    queries = pd.Series(t['kld'].companyname.astype(object).dropna().unique())
+    queries = queries.sample(150, random_state=0).reset_index(drop=True)
+
+    ratios = _bestRatios(queries, index.names)
+    best = ratios.max(axis=1)
+    query, name, similarity = index.similar(queries, top_k)
+    assert (np.bincount(query, minlength=len(queries)) <= top_k).all()
+    assert (np.diff(similarity)[np.diff(query) == 0] <= 0).all() # by decreasing similarity
+    found = np.zeros(len(queries), dtype=bool)
+    found[query[ratios[query, name] == best[query]]] = True
+    hits = found[best >= 90]
+    assert len(hits) > 100
+    assert hits.mean() >= recall
+
+
+def test_similarity_is_cosine():
+    names = pd.Series(['ALPHA BETA INC', 'ALPHA INC', 'GAMMA CORP', 'BETA GAMMA CO', None, 'ALPHA INC'])
+    index = NameTokenIndex(names)
+    queries = ['Alpha Beta', 'gamma-delta corp', 'ZETA']
+    query, name, similarity = index.similar(queries, top_k=10)
+
+    # dense word vectors of the index names, and of the queries over the same words
+    words = list(index.words)
+    dense = np.zeros((len(index.names), len(words)))
+    for i, n in enumerate(index.names):
+        for w in set(n.lower().replace('-', ' ').split()):
+            dense[i, words.index(w)] = index.idf[words.index(w)]
+    dense /= np.linalg.norm(dense, axis=1, keepdims=True)
+    unknown = np.log(len(index.names) + 1) + 1
+    for q, n, s in zip(query, name, similarity):
+        qwords = set(queries[q].lower().replace('-', ' ').split())
+        vector = np.array([index.idf[j] if w in qwords else 0 for j, w in enumerate(words)])
+        norm = np.sqrt((vector ** 2).sum() + unknown ** 2 * len(qwords - set(words)))
+        assert s == pytest.approx(vector @ dense[n] / norm)
+    assert set(query) == {0, 1} # 'ZETA' shares no word
+    # the rows of a distinct name
+    q, rows, _ = index.query(['alpha inc'], top_k=1)
+    assert rows.tolist() == [1, 5]
+
+
+def _bruteForceNameLinks(t, min_name_ratio=90):
+    # every unmatched company against every CRSP name with overlapping dates
+    linked = set(t['cusip_candidates'].companyname.astype(object)) | \
+        set(t['ticker_candidates'].companyname.astype(object))
+    kld = t['kld'].loc[t['kld'].companyname.notna()]
+    kld = kld.loc[~kld.companyname.astype(object).isin(linked)]
+    dates = kld.groupby(kld.companyname.astype(object)).date.agg(['min', 'max'])
+    pairs = dates.reset_index().rename(columns={'min': 'fdate', 'max': 'ldate'})\
+        .merge(t['crsp2'].astype({'comnam': object}), how='cross')
+    pairs = pairs.loc[(pairs.ldate >= pairs.namedt) & (pairs.fdate <= pairs.nameenddt)]
+    pairs['name_ratio'] = [fuzz.token_set_ratio(c, k) for c, k in zip(pairs.comnam, pairs.companyname)]
+    pairs = pairs.loc[pairs.name_ratio >= min_name_ratio]
+    pairs = pairs.loc[pairs.name_ratio == pairs.groupby('companyname').name_ratio.transform('max')]
+    return set(zip(pairs.companyname, pairs.permno, pairs.comnam, pairs.name_ratio))
+
+
+@pytest.mark.parametrize('exhaustive', [True, False])
+def test_name_links_same_as_brute_force(linkTables, exhaustive):
+    t = linkTables
+    options = {}
+    if exhaustive: # every CRSP name sharing a word with the company name is scored
+        names = t['crsp2'].comnam.nunique()
+        options = {'top_k': names, 'max_postings': names}
+    _link3_1 = nameCandidates(t['kld'], t['cusip_candidates'], t['ticker_candidates'], t['crsp2'],
+                              **options)
+    link = finalizeLinks(t['cusip_candidates'], t['ticker_candidates'], _link3_1)
+    names = link.loc[link.score == NAME_LINK_SCORE]
+    expected = _bruteForceNameLinks(t)
+    assert len(expected)
+    assert set(zip(names.companyname.astype(object), names.permno, names.comnam.astype(object),
+                   names.name_ratio)) == expected
+    # the CUSIP and TICKER links are unchanged
+    pd.testing.assert_frame_equal(link.loc[link.score != NAME_LINK_SCORE], t['kld_crsp_link'])
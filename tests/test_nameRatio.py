@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+import pytest
+from fuzzywuzzy import fuzz
+
+from nameRatio import nameRatio
+from nameRatioCache import NameRatioCache
+
+
+WORDS = ['APPLE', 'AMAZON.COM', 'GENERAL', 'MOTORS', 'BANK', 'OF', 'AMERICA', 'INTL', 'HOLDINGS', '&']
+SUFFIXES = ['INC', 'CORP', 'CO', 'LTD', 'INC.', '']
+
+
+@pytest.fixture(scope='module')
+def pairs():
+    rng = np.random.default_rng(0)
+
+    def name():
+        if rng.random() < 0.05:
+            return None
+        words = list(rng.choice(WORDS, rng.integers(1, 4))) + [rng.choice(SUFFIXES)]
+        return ' '.join(w for w in words if w)
+
+    names = [name() for _ in range(150)]
+    # repeated pairs, as across years
+    rows = rng.integers(0, len(names), (3000, 2))
+    return pd.DataFrame({'comnam': [names[i] for i in rows[:, 0]],
+                         'companyname': [names[j] for j in rows[:, 1]]}, index=np.arange(3000) * 2)
+
+
+def _rowWise(data, scorer):
+    return data.apply(lambda x: scorer(x.comnam, x.companyname), axis=1)
+
+
+@pytest.mark.parametrize('scorer', [fuzz.token_set_ratio, fuzz.ratio])
+def test_same_as_row_wise(pairs, scorer):
+    expected = _rowWise(pairs, scorer)
+    batched = nameRatio(pairs, scorer=scorer, n_jobs=2, batch_size=100)
+    pd.testing.assert_series_equal(batched, expected, check_dtype=False)
+
+
+def test_same_with_cache(pairs, tmp_path):
+    expected = _rowWise(pairs, fuzz.token_set_ratio)
+    cache = NameRatioCache(str(tmp_path / 'name_ratio_cache.sqlite'))
+    first = nameRatio(pairs, cache=cache)
+    second = nameRatio(pairs, cache=cache)
+    cache.close()
+    pd.testing.assert_series_equal(first, expected, check_dtype=False)
+    pd.testing.assert_series_equal(second, expected, check_dtype=False)
@@ -0,0 +1,36 @@
+import time
+
+from fuzzywuzzy import fuzz
+
+from nameRatioCache import NameRatioCache
+
+
+def _count(cache):
+    return cache.conn.execute('select count(*) from ratios').fetchone()[0]
+
+
+def test_bounded_on_put(tmp_path):
+    cache = NameRatioCache(str(tmp_path / 'cache.sqlite'), max_entries=10)
+    cache.put(fuzz.token_set_ratio, {('a%d' % i, 'b'): i for i in range(8)})
+    time.sleep(0.01)
+    # recently used, so kept
+    assert cache.get(fuzz.token_set_ratio, [('a0', 'b'), ('a1', 'b')]) == {('a0', 'b'): 0, ('a1', 'b'): 1}
+    time.sleep(0.01)
+    cache.put(fuzz.token_set_ratio, {('c%d' % i, 'b'): i for i in range(6)})
+    assert _count(cache) == 10
+
+    kept = cache.get(fuzz.token_set_ratio, [('a%d' % i, 'b') for i in range(8)])
+    assert len(kept) == 4 and {('a0', 'b'), ('a1', 'b')} <= set(kept)
+    assert len(cache.get(fuzz.token_set_ratio, [('c%d' % i, 'b') for i in range(6)])) == 6
+    cache.close()
+
+
+def test_scores_kept_across_runs(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    cache = NameRatioCache(path)
+    cache.put(fuzz.token_set_ratio, {('apple', 'apple inc'): 100})
+    cache.close()
+    cache = NameRatioCache(path)
+    assert cache.get(fuzz.token_set_ratio, [('apple', 'apple inc')]) == {('apple', 'apple inc'): 100}
+    assert cache.get(fuzz.ratio, [('apple', 'apple inc')]) == {}
+    cache.close()
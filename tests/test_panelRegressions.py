@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+linearmodels = pytest.importorskip('linearmodels')
+from linearmodels import PanelOLS
+
+from panelRegressions import fitSpecs, parseSpec
+
+
+SPECS = ['markup ~ 1 + ESGIndex',
+         'markup ~ 1 + size + ESGIndex',
+         'markup ~ 1 + size + ESGIndex + EntityEffects',
+         'markup ~ size + ESGIndex + EntityEffects + TimeEffects',
+         'markup ~ 1 + size + leverage + ESGIndex + TimeEffects',
+         'roa ~ 1 + size + ESGIndex + EntityEffects + TimeEffects',
+         'roa ~ 1 + np.log(sale) + ESGIndex + EntityEffects']
+
+
+def _panel(seed=0, entities=30, years=25):
+    rng = np.random.default_rng(seed)
+    index = pd.MultiIndex.from_product([np.arange(entities), np.arange(1991, 1991 + years)],
+                                       names=['sic2', 'fyear'])
+    n = len(index)
+    data = pd.DataFrame({'ESGIndex': rng.integers(-5, 6, n).astype('float64'),
+                         'size': rng.normal(6, 2, n),
+                         'leverage': rng.uniform(0, 1, n),
+                         'sale': rng.lognormal(5, 1, n)}, index=index)
+    effect = np.repeat(rng.normal(0, 1, entities), years)
+    data['markup'] = 1 + 0.02 * data.ESGIndex + 0.1 * data['size'] + effect + rng.normal(0, 1, n)
+    data['roa'] = 0.05 - 0.01 * data.ESGIndex + effect / 10 + rng.normal(0, 0.1, n)
+    # different samples: missing values in some variables only
+    for c, share in [('leverage', 0.1), ('roa', 0.05), ('size', 0.02)]:
+        data.loc[rng.random(n) < share, c] = np.nan
+    return data
+
+
+@pytest.mark.parametrize('fit_options', [{}, {'cov_type': 'clustered', 'cluster_entity': True},
+                                         {'cov_type': 'kernel'}])
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_same_as_from_formula(fit_options, n_jobs):
+    data = _panel()
+    results = fitSpecs(data, SPECS, n_jobs=n_jobs, **fit_options)
+    assert list(results) == [str(i + 1) for i in range(len(SPECS))]
+    for name, formula in zip(results, SPECS):
+        fitted = results[name]
+        reference = PanelOLS.from_formula(formula, data=data).fit(**fit_options)
+        assert fitted.nobs == reference.nobs
+        pd.testing.assert_series_equal(fitted.params, reference.params)
+        pd.testing.assert_series_equal(fitted.std_errors, reference.std_errors)
+        for r2 in ['rsquared', 'rsquared_within', 'rsquared_between', 'rsquared_overall']:
+            assert getattr(fitted, r2) == pytest.approx(getattr(reference, r2))
+        assert fitted.model.formula == formula
+
+
+def test_parse_spec():
+    spec = parseSpec('markup ~ 1 + size + ESGIndex + EntityEffects')
+    assert spec.dependent == 'markup'
+    assert spec.exog == ('size', 'ESGIndex')
+    assert spec.constant and spec.entity_effects and not spec.time_effects
+    assert parseSpec('roa ~ 1 + np.log(sale)') is None
+    assert parseSpec('roa ~ size:leverage') is None
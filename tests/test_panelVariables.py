@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from panelVariables import attachBetas
+
+
+def _betaFile(path, betas):
+    # the WRDS Beta Suite layout: upper-case names, '%Y/%m/%d' dates, more columns
+    pd.DataFrame({'PERMNO': betas.permno, 'DATE': betas.date.dt.strftime('%Y/%m/%d'),
+                  'n': 60, 'alpha': 0.0, 'b_mkt': betas.b_mkt, 'ivol': 0.1}).to_csv(path, index=False)
+    return path
+
+
+def _bruteForce(data, betas, tolerance='366D'):
+    b_mkt = []
+    for permno, datadate in zip(data.permno, pd.to_datetime(data.datadate)):
+        known = betas[(betas.permno == permno) & (betas.date <= datadate)
+                      & (betas.date >= datadate - pd.Timedelta(tolerance))]
+        b_mkt.append(known.sort_values('date').b_mkt.iloc[-1] if len(known) else np.nan)
+    return pd.Series(b_mkt, index=data.index, name='b_mkt')
+
+
+@pytest.mark.parametrize('chunksize', [2, 1000])
+def test_tolerance_edge(tmp_path, chunksize):
+    datadate = pd.Timestamp('2005-12-31')
+    betas = pd.DataFrame({'permno': [1, 2, 3, 3, 4, 5],
+                          'date': [datadate - pd.Timedelta('366D'), # exactly at the tolerance: kept
+                                   datadate - pd.Timedelta('367D'), # one day older: missing
+                                   datadate - pd.Timedelta('400D'), datadate, # same day: kept
+                                   datadate + pd.Timedelta('1D'), # after the fiscal year end
+                                   datadate - pd.Timedelta('30D')],
+                          'b_mkt': [1.1, 1.2, 1.3, 1.4, 1.5, 1.6]})
+    path = _betaFile(tmp_path / 'beta.csv.gz', betas)
+    data = pd.DataFrame({'gvkey': ['a', 'b', 'c', 'd', 'e', 'f'],
+                         'permno': [1, 2, 3, 4, 5, np.nan],
+                         'datadate': ['2005-12-31'] * 6})
+    linked = attachBetas(data, path=path, chunksize=chunksize)
+    pd.testing.assert_series_equal(linked.b_mkt, pd.Series([1.1, np.nan, 1.4, np.nan, 1.6, np.nan],
+                                                         name='b_mkt'))
+    assert linked.gvkey.tolist() == data.gvkey.tolist()
+    assert 'b_mkt' not in data
+
+
+def test_same_as_brute_force(tmp_path):
+    rng = np.random.default_rng(0)
+    dates = pd.date_range('2000-01-31', '2010-12-31', freq='M')
+    betas = pd.DataFrame([(p, d) for p in range(1, 21) for d in dates if rng.random() < 0.3],
+                         columns=['permno', 'date'])
+    betas['b_mkt'] = rng.normal(1, 0.5, len(betas))
+    path = _betaFile(tmp_path / 'beta.csv.gz', betas.sample(frac=1, random_state=0))
+
+    data = pd.DataFrame({'permno': rng.integers(1, 25, 300).astype('float64'),
+                         'datadate': pd.Timestamp('2000-06-30')
+                                     + pd.to_timedelta(rng.integers(0, 4000, 300), unit='D')})
+    data.loc[::17, 'permno'] = np.nan
+    linked = attachBetas(data, path=path, chunksize=50)
+    expected = _bruteForce(data, betas)
+    assert expected.notna().sum() > 100
+    pd.testing.assert_series_equal(linked.b_mkt, expected)
@@ -0,0 +1,23 @@
+import pandas as pd
+
+from parallel import concatInOrder, mapTasks, numberRows
+
+
+def _square(x):
+    return x * x
+
+
+def test_map_tasks_in_order():
+    assert mapTasks(_square, range(7), n_jobs=2) == mapTasks(_square, range(7), n_jobs=1) == [x * x for x in range(7)]
+    assert mapTasks(_square, [], n_jobs=2) == []
+
+
+def test_concat_in_order_same_as_serial_merge():
+    left = pd.DataFrame({'k': [3, 1, 3, 2, 1, 2], 'year': [1, 2, 2, 1, 1, 2], 'a': range(6)})
+    right = pd.DataFrame({'k': [1, 2, 3, 1, 3, 2, 2], 'year': [1, 1, 1, 2, 2, 2, 2], 'b': range(7)})
+    serial = left.merge(right, on=['k', 'year'])
+
+    numbered = numberRows(left, ['k', 'year'])
+    # merged year by year, the later year first
+    parts = [numbered[numbered.year == y].merge(right[right.year == y], on=['k', 'year']) for y in (2, 1)]
+    assert concatInOrder(parts).equals(serial)
@@ -0,0 +1,36 @@
+import pytest
+
+pytest.importorskip('duckdb')
+
+import pipeline
+from cusipCorrection import cusipCorrectionFast
+from frameFingerprint import sameRows
+from frameSchema import compactFrame
+from kldCrspLink import addKldDates, cleanKld
+from sqlBackend import SqlBackend, compareBackends
+from syntheticData import SyntheticConnection, syntheticTables
+
+
+@pytest.fixture(scope='module')
+def tables():
+    return syntheticTables(0.1, 0)
+
+
+def test_link_steps_same_as_pandas(tables):
+    conn = SyntheticConnection(tables)
+    kld = compactFrame(conn.raw_sql(pipeline.KLD_SQL), 'kld.history')
+    _kld2 = addKldDates(cleanKld(cusipCorrectionFast(kld)))
+    _crsp1 = compactFrame(conn.raw_sql(pipeline.CRSP_CUSIP_SQL), 'crsp.stocknames')
+    _crsp_n1 = compactFrame(conn.raw_sql(pipeline.CRSP_TICKER_SQL), 'crsp.stocknames')
+
+    same = compareBackends(SqlBackend(), _kld2, _crsp1, _crsp_n1)
+    assert same == dict.fromkeys(['crsp2', 'crsp_n2', 'kld3', 'cusip_candidates', 'ticker_candidates',
+                                  'link'], True)
+
+
+def test_raw_sql_same_as_synthetic_connection(tables):
+    conn = SyntheticConnection(tables)
+    backend = SqlBackend(tables)
+    for sql in [pipeline.CRSP_CUSIP_SQL, pipeline.CCM_SQL]:
+        assert sameRows(compactFrame(backend.raw_sql(sql)),
+                        compactFrame(conn.raw_sql(sql)))
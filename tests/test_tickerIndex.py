@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from tickerIndex import TickerIntervals
+
+
+def _step2(left, crsp):
+    # the merge and filter of step 2 of the KLD-CRSP link
+    merged = pd.merge(left, crsp, how='inner', left_on=['ticker'], right_on=['crsp_ticker'])
+    return merged.loc[(merged.ldate >= merged.namedt) & (merged.fdate <= merged.nameenddt)]
+
+
+def _dates(rng, n, start='1985-01-01', days=12000):
+    return pd.Timestamp(start) + pd.to_timedelta(rng.integers(0, days, n), unit='D')
+
+
+def _tables(seed, categorical=False):
+    rng = np.random.default_rng(seed)
+    tickers = np.array(['T%02d' % i for i in range(40)])
+
+    n = 400
+    namedt = _dates(rng, n)
+    crsp = pd.DataFrame({'permno': rng.integers(10000, 10100, n),
+                         'crsp_ticker': rng.choice(tickers[:30], n), # reused tickers
+                         'namedt': namedt,
+                         'nameenddt': namedt + pd.to_timedelta(rng.integers(0, 3000, n), unit='D'),
+                         'comnam': rng.choice(['ALPHA', 'BETA', 'GAMMA'], n)})
+    crsp.loc[rng.random(n) < 0.03, 'nameenddt'] = pd.NaT
+    crsp.loc[rng.random(n) < 0.03, 'crsp_ticker'] = None
+
+    m = 300
+    fdate = _dates(rng, m)
+    left = pd.DataFrame({'companyname': rng.choice(['A', 'B', 'C', 'D'], m),
+                         'ticker': rng.choice(tickers, m), # some not in CRSP
+                         'fdate': fdate,
+                         'ldate': fdate + pd.to_timedelta(rng.integers(0, 2000, m), unit='D')},
+                        index=rng.permutation(m) + 1000)
+    # ranges beyond the indexed dates, clipped in the composite keys
+    left.loc[left.index[:5], 'fdate'] = pd.Timestamp('1700-01-01')
+    left.loc[left.index[5:10], 'ldate'] = pd.Timestamp('2260-12-31')
+    left.loc[left.index[10:12], ['fdate', 'ldate']] = [pd.Timestamp('1690-01-01'),
+                                                      pd.Timestamp('1700-01-01')]
+    left.loc[left.index[12:15], 'ticker'] = None
+    left.loc[left.index[15:18], 'ldate'] = pd.NaT
+    if categorical:
+        crsp['crsp_ticker'] = crsp.crsp_ticker.astype('category')
+        left['ticker'] = left.ticker.astype('category')
+    return left, crsp
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+@pytest.mark.parametrize('categorical', [False, True])
+def test_same_as_step2_merge(seed, categorical):
+    left, crsp = _tables(seed, categorical)
+    expected = _step2(left, crsp)
+    assert len(expected)
+    pd.testing.assert_frame_equal(TickerIntervals(crsp).merge(left), expected)
+
+
+def test_clipped_ranges():
+    crsp = pd.DataFrame({'permno': [1, 2, 3, 4],
+                         'crsp_ticker': ['AA', 'AA', 'AA', 'BB'],
+                         'namedt': pd.to_datetime(['1990-01-01', '1995-01-01', '2000-01-01', '1990-01-01']),
+                         'nameenddt': pd.to_datetime(['2010-12-31', '1996-12-31', '2001-12-31', '1991-12-31'])})
+    left = pd.DataFrame({'ticker': ['AA', 'AA', 'BB', 'AA'],
+                         'fdate': pd.to_datetime(['1700-01-01', '1700-01-01', '1700-01-01', '2011-01-01']),
+                         'ldate': pd.to_datetime(['2260-12-31', '1800-01-01', '1990-01-01', '2260-12-31'])})
+    merged = TickerIntervals(crsp).merge(left)
+    pd.testing.assert_frame_equal(merged, _step2(left, crsp))
+    # the whole range of the first query, nothing before the index, the start day of BB
+    assert merged.permno.tolist() == [1, 2, 3, 4]
+
+
+def test_linked_tables(linkTables):
+    # the KLD ticker ranges of the synthetic tables against their CRSP ticker names
+    t = linkTables
+    kld = t['KLD'].loc[t['KLD'].ticker.notna()]
+    left = kld.groupby(['companyname', 'ticker'], observed=True).date.agg(['min', 'max'])\
+        .reset_index().rename(columns={'min': 'fdate', 'max': 'ldate'})
+    expected = _step2(left, t['crsp_n2'])
+    assert len(expected)
+    pd.testing.assert_frame_equal(TickerIntervals(t['crsp_n2']).merge(left), expected)
@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import mstats
+
+from winsorize import winsorize
+
+
+def _panel(seed=0, rows=3000, missing=0.0):
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame({'fyear': rng.integers(1991, 2016, rows),
+                         'sale': rng.lognormal(5, 2, rows),
+                         'at': rng.standard_t(2, rows),
+                         'emp': rng.integers(0, 50, rows).astype('float64')}) # ties
+    for c in ['sale', 'at', 'emp']:
+        data.loc[rng.random(rows) < missing, c] = np.nan
+    return data
+
+
+def _reference(data, var, by='fyear', limits=(0.01, 0.01), inclusive=(True, True)):
+    # 'stats_analysis.ipynb', one variable and one year at a time, over the
+    # non-missing values (mstats.winsorize would replace the missing values)
+    def wins(s):
+        s = s.copy()
+        values = s.dropna()
+        s[values.index] = np.asarray(mstats.winsorize(values.to_numpy(), limits=limits,
+                                                      inclusive=inclusive))
+        return s
+    return data[[var, by]].groupby(by)[var].transform(wins)
+
+
+@pytest.mark.parametrize('limits', [(0.01, 0.01), (0.05, 0.1), (0.2, None), (None, 0.3)])
+@pytest.mark.parametrize('inclusive', [(True, True), (False, False)])
+def test_same_as_mstats_by_year(limits, inclusive):
+    data = _panel()
+    wins = winsorize(data, ['sale', 'at', 'emp'], by='fyear', limits=limits, inclusive=inclusive)
+    for var in ['sale', 'at', 'emp']:
+        pd.testing.assert_series_equal(wins[var], _reference(data, var, limits=limits,
+                                                             inclusive=inclusive))
+    pd.testing.assert_frame_equal(data, _panel()) # not changed
+
+
+def test_same_as_notebook_without_missing():
+    data = _panel(seed=1)
+    wins = winsorize(data, ['sale'], by='fyear')
+    notebook = data[['sale', 'fyear']].groupby('fyear')['sale'].transform(
+        lambda s: mstats.winsorize(s, limits=[0.01, 0.01]))
+    pd.testing.assert_series_equal(wins['sale'], notebook)
+
+
+def test_missing_values_stay_missing():
+    data = _panel(seed=2, missing=0.2)
+    wins = winsorize(data, ['sale', 'at', 'emp'], by='fyear', limits=(0.05, 0.05))
+    for var in ['sale', 'at', 'emp']:
+        assert wins[var].isna().equals(data[var].isna())
+        pd.testing.assert_series_equal(wins[var], _reference(data, var, limits=(0.05, 0.05)))
+
+
+def test_missing_group_key():
+    data = _panel(seed=3, rows=500)
+    data['fyear'] = data.fyear.astype('float64')
+    data.loc[::7, 'fyear'] = np.nan
+    wins = winsorize(data, ['sale'], by='fyear', limits=(0.1, 0.1))
+    pd.testing.assert_series_equal(wins['sale'], _reference(data, 'sale', limits=(0.1, 0.1)))
+    assert wins.loc[::7, 'sale'].isna().all()
+
+
+def test_integer_column_and_inplace():
+    data = pd.DataFrame({'fyear': [2000] * 10 + [2001] * 10, 'emp': np.arange(20)})
+    reference = _reference(data, 'emp', limits=(0.1, 0.1))
+    winsorize(data, ['emp'], by='fyear', limits=(0.1, 0.1), inplace=True)
+    assert data.emp.dtype == 'int64'
+    pd.testing.assert_series_equal(data.emp, reference)
+
+
+def test_limits_out_of_range():
+    with pytest.raises(ValueError):
+        winsorize(_panel(rows=10), ['sale'], limits=(1.5, 0.01))
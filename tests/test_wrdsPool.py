@@ -0,0 +1,66 @@
+import sys
+import types
+
+import pandas as pd
+import pytest
+
+import pipeline
+from frameSchema import compactFrame
+from syntheticData import SyntheticConnection, syntheticTables
+from wrdsCache import CachedConnection
+from wrdsPool import extractTables, warmCache
+
+
+QUERIES = {'kld_raw': (pipeline.KLD_SQL, 'kld.history'),
+           'crsp_cusip_raw': (pipeline.CRSP_CUSIP_SQL, 'crsp.stocknames'),
+           'crsp_ticker_raw': (pipeline.CRSP_TICKER_SQL, 'crsp.stocknames'),
+           'ccm_link': (pipeline.CCM_SQL, 'ccm_link'),
+           'funda_link': (pipeline.FUNDA_LINK_SQL, 'comp.funda')}
+
+
+@pytest.fixture(scope='module')
+def tables():
+    return syntheticTables(0.05, 0)
+
+
+@pytest.fixture
+def wrds(tables, monkeypatch):
+    # wrds.Connection() of the CachedConnections, over the synthetic tables
+    opened = []
+    def connect(**kwargs):
+        opened.append(kwargs)
+        return SyntheticConnection(tables)
+    monkeypatch.setitem(sys.modules, 'wrds', types.SimpleNamespace(Connection=connect))
+    return opened
+
+
+def test_extract_tables_same_as_serial(tables):
+    serial = SyntheticConnection(tables)
+    queries = dict(QUERIES, kld_again=QUERIES['kld_raw']) # identical queries run once
+    pulled = extractTables(queries, connect=lambda: SyntheticConnection(tables), connections=4)
+    assert list(pulled) == list(queries)
+    for name, (sql, table) in queries.items():
+        pd.testing.assert_frame_equal(pulled[name], compactFrame(serial.raw_sql(sql), table))
+    assert pulled['kld_again'] is not pulled['kld_raw']
+
+
+def test_warm_cache_same_as_serial(tmp_path, wrds):
+    sqls = [sql for sql, _ in QUERIES.values()]
+    serial = CachedConnection(str(tmp_path / 'serial'), replay=False)
+    expected = [serial.raw_sql(sql) for sql in sqls]
+
+    conn = CachedConnection(str(tmp_path / 'warm'), replay=False)
+    opened = len(wrds)
+    assert warmCache(conn, sqls, connections=3) == len(sqls)
+    assert 1 <= len(wrds) - opened <= 3
+    assert all(conn.cached(sql) for sql in sqls)
+    assert conn._conn is None # the script's own connection is not opened
+
+    # the script reads the prefetched queries from the cache
+    replay = CachedConnection(str(tmp_path / 'warm'), replay=True)
+    for sql, data in zip(sqls, expected):
+        pd.testing.assert_frame_equal(replay.raw_sql(sql), data)
+
+    # nothing left to pull, and nothing pulled in replay mode
+    assert warmCache(conn, sqls) == 0
+    assert warmCache(CachedConnection(str(tmp_path / 'empty'), replay=True), sqls) == 0
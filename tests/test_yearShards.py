@@ -0,0 +1,60 @@
+import pandas as pd
+import pytest
+
+from kldCompLink import linkMsf, matchCcm, mergeCompFunda
+from yearShards import mergeByYear
+
+
+@pytest.fixture(scope='module')
+def linked3(linkTables):
+    t = linkTables
+    return linkMsf(None, t['KLD'], t['kld_crsp_link'], crsp_msf=t['crsp_msf'], shard_by_year=False)
+
+
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_link_msf_sharded_same_as_serial(linkTables, linked3, n_jobs):
+    t = linkTables
+    sharded = linkMsf(None, t['KLD'], t['kld_crsp_link'], crsp_msf=t['crsp_msf'],
+                      shard_by_year=True, n_jobs=n_jobs)
+    assert len(linked3)
+    pd.testing.assert_frame_equal(sharded, linked3)
+
+
+def test_merge_by_month_same_as_serial(linkTables):
+    # linked4 of the link scripts: the year of each row from a monthly period
+    t = linkTables
+    crsp_linked = t['crsp_msf'].merge(t['kld_crsp_link'], on='permno', suffixes=('_crsp', '_LINK'))
+    serial = t['KLD'].merge(crsp_linked, on=['companyname', 'monthly'], suffixes=('_KLD', '_crsp_LINK'))
+    sharded = mergeByYear(t['KLD'], crsp_linked, 'monthly', n_jobs=2,
+                          on=['companyname', 'monthly'], suffixes=('_KLD', '_crsp_LINK'))
+    assert len(serial)
+    pd.testing.assert_frame_equal(sharded, serial)
+
+
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_ccm_funda_sharded_same_as_serial(linkTables, linked3, n_jobs):
+    t = linkTables
+    serial = matchCcm(linked3, t['ccm_link'], shard_by_year=False)
+    sharded = matchCcm(linked3, t['ccm_link'], shard_by_year=True, n_jobs=n_jobs)
+    assert len(serial)
+    pd.testing.assert_frame_equal(sharded, serial)
+
+    # year of the left rows from 'year', of the right rows from 'fyear'
+    serial = mergeCompFunda(serial, t['funda_link'], shard_by_year=False)
+    sharded = mergeCompFunda(sharded, t['funda_link'], shard_by_year=True, n_jobs=n_jobs)
+    assert len(serial)
+    pd.testing.assert_frame_equal(sharded.reset_index(drop=True), serial.reset_index(drop=True))
+
+
+def test_merge_by_year_no_common_year():
+    left = pd.DataFrame({'year': [2001, 2002], 'x': [1, 2]})
+    right = pd.DataFrame({'year': [2003], 'y': [3]})
+    merged = mergeByYear(left, right, 'year', on='year', n_jobs=2)
+    assert merged.empty
+    pd.testing.assert_frame_equal(merged, left.merge(right, on='year'), check_index_type=False)
+
+
+def test_merge_by_year_inner_only():
+    frame = pd.DataFrame({'year': [2001]})
+    with pytest.raises(ValueError):
+        mergeByYear(frame, frame, 'year', on='year', how='left')
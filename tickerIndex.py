@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Pak Shing Ho
+
+Ticker to date-interval index over the CRSP ticker names (_crsp_n2), for
+step 2 of the KLD-CRSP link.
+
+Step 2 merged the unmatched KLD companies with _crsp_n2 on ticker alone,
+    _link2_1 = pd.merge(_nomatch3, _crsp_n2, how='inner', left_on=['ticker'], right_on=['crsp_ticker'])
+    _link2_1 = _link2_1.loc[(_link2_1.ldate>=_link2_1.namedt) & (_link2_1.fdate<=_link2_1.nameenddt)]
+which pairs every KLD record with every PERMNO that ever used its ticker
+before keeping the pairs whose date ranges overlap. Tickers are reused, so
+the cross product is much larger than the result.
+
+TickerIntervals sorts the CRSP rows by ticker and start date once. For a KLD
+record, the rows that can overlap its range [fdate, ldate] are then one
+contiguous run of its ticker's rows: those starting on or before ldate
+(binary search on the start dates) and after the last row whose end, and
+the ends of all rows before it, are before fdate (binary search on the
+running maximum of the end dates). Only these runs are expanded, and the
+few rows in them that end before fdate (ranges nested in a longer range)
+are dropped.
+
+merge returns the same rows, columns, order and index labels as the merge
+and filter above. As in the merge, missing tickers match each other.
+
+Usage:
+    _link2_1 = TickerIntervals(_crsp_n2).merge(_nomatch3)
+"""
+
+import numpy as np
+import pandas as pd
+
+
+# Days between two tickers in the composite (ticker, date) keys
+_SPAN = np.int64(1 << 20)
+
+
+def _days(dates):
+    """
+    Days since 1970 of 'dates' (floored), and the non-missing mask.
+    """
+    dates = pd.Series(dates)
+    if not pd.api.types.is_datetime64_any_dtype(dates.dtype):
+        dates = pd.to_datetime(dates)
+    dates = dates.to_numpy(dtype='datetime64[ns]')
+    valid = ~np.isnat(dates)
+    days = np.zeros(len(dates), dtype='int64')
+    days[valid] = dates[valid].astype('datetime64[D]').astype('int64')
+    return days, valid, dates
+
+
+def _keys(tickers):
+    """
+    'tickers' as objects, with NaN for every missing ticker (None, NaN).
+    """
+    tickers = pd.Series(tickers).astype(object)
+    return tickers.where(tickers.notna(), np.nan)
+
+
+class TickerIntervals:
+    """
+    Index of the rows of 'crsp' by ticker and [start, end] date range.
+    """
+
+    def __init__(self, crsp, ticker='crsp_ticker', start='namedt', end='nameenddt'):
+        self.crsp = crsp
+        self.ticker, self.start, self.end = ticker, start, end
+
+        start_days, start_valid, self.starts = _days(crsp[start])
+        end_days, end_valid, self.ends = _days(crsp[end])
+        codes, self.tickers = pd.factorize(_keys(crsp[ticker]), use_na_sentinel=False)
+        rows = np.flatnonzero((codes >= 0) & start_valid & end_valid)
+
+        self.origin = min(start_days[rows].min(), end_days[rows].min()) if len(rows) else 0
+        order = np.lexsort((rows, start_days[rows], codes[rows]))
+        self.rows = rows[order] # positions in 'crsp', by ticker and start date
+        base = codes[self.rows] * _SPAN - self.origin
+        self.start_keys = base + start_days[self.rows]
+        self.end_keys = np.maximum.accumulate(base + end_days[self.rows])
+
+    def pairs(self, tickers, starts, ends):
+        """
+        (query, row) positions of the overlapping pairs of the queries
+        (tickers, starts, ends) and the indexed rows, by query and then in
+        the order of the index.
+        """
+        codes = self.tickers.get_indexer(pd.Index(_keys(tickers)))
+        start_days, start_valid, starts = _days(starts)
+        end_days, end_valid, ends = _days(ends)
+        queries = np.flatnonzero((codes >= 0) & start_valid & end_valid)
+        if not len(queries) or not len(self.rows):
+            return np.zeros(0, dtype='int64'), np.zeros(0, dtype='int64')
+
+        # dates outside the indexed range are clipped to it (the exact test below decides)
+        base = codes[queries] * _SPAN
+        first = np.searchsorted(self.end_keys, base + np.clip(start_days[queries] - self.origin, 0, _SPAN - 1))
+        last = np.searchsorted(self.start_keys, base + np.clip(end_days[queries] - self.origin, 0, _SPAN - 1),
+                               side='right')
+        counts = np.maximum(last - first, 0)
+
+        query = np.repeat(queries, counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        row = self.rows[np.repeat(first, counts) + offsets]
+        # exact dates (the keys are in whole days), and ranges nested in a longer one
+        keep = (self.starts[row] <= ends[query]) & (self.ends[row] >= starts[query])
+        return query[keep], row[keep]
+
+    def merge(self, left, ticker='ticker', start='fdate', end='ldate', suffixes=('_x', '_y')):
+        """
+        Same as the inner merge of 'left' and the indexed frame on ticker,
+        filtered on overlapping date ranges:
+            merged = pd.merge(left, crsp, how='inner', left_on=[ticker], right_on=[crsp ticker])
+            merged.loc[(merged[end] >= merged[crsp start]) & (merged[start] <= merged[crsp end])]
+        """
+        query, row = self.pairs(left[ticker], left[start], left[end])
+
+        # position of each pair in the merge: tickers in order of first
+        # appearance in 'left', then the left rows, then the indexed rows
+        left_codes, uniques = pd.factorize(_keys(left[ticker]), use_na_sentinel=False)
+        right_codes = uniques.get_indexer(pd.Index(_keys(self.crsp[self.ticker])))
+        n_left = np.bincount(left_codes[left_codes >= 0], minlength=len(uniques))
+        n_right = np.bincount(right_codes[right_codes >= 0], minlength=len(uniques))
+        offsets = np.cumsum(n_left * n_right) - n_left * n_right
+        code = left_codes[query]
+        labels = offsets[code] + _ranks(left_codes)[query] * n_right[code] + _ranks(right_codes)[row]
+        order = np.argsort(labels, kind='stable')
+        query, row, labels = query[order], row[order], labels[order]
+
+        merged = pd.merge(left.iloc[query].reset_index(drop=True),
+                          self.crsp.iloc[row].reset_index(drop=True),
+                          left_index=True, right_index=True, suffixes=suffixes)
+        merged.index = pd.Index(labels, dtype='int64')
+
+        # the key dtypes pandas gives the merge (e.g. object for categorical
+        # tickers with different categories, unless a side is empty)
+        dtypes = pd.merge(left.iloc[:1], self.crsp.iloc[:1], how='inner', left_on=[ticker],
+                          right_on=[self.ticker], suffixes=suffixes).dtypes
+        changed = {c: t for c, t in dtypes.items() if merged[c].dtype != t}
+        return merged.astype(changed) if changed else merged
+
+
+def _ranks(codes):
+    """
+    Rank of each position among the positions with the same code.
+    """
+    return pd.Series(codes).groupby(codes).cumcount().to_numpy()
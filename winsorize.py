@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Pak Shing Ho
+
+Winsorization of many columns at once, within groups such as fiscal years.
+
+'stats_analysis.ipynb' winsorizes one variable at a time,
+    df[[var, 'fyear']].groupby('fyear')[var].transform(wins)
+calling scipy.stats.mstats.winsorize once per year and per variable. Here the
+rows are split into groups once, the cutoffs of all columns of a group come
+out of one sort of its rows, and the column block is clipped in place.
+
+The cutoffs are those of mstats.winsorize: with n values in a group, the
+int(lower * n) smallest values are set to the next smallest one, and the
+int(upper * n) largest values to the next largest one (with 'inclusive'
+False, the counts are rounded instead of truncated). Missing values are left
+missing and are not counted in n, so the result equals mstats.winsorize of
+the non-missing values. (mstats.winsorize itself sorts NaN as the largest
+values, so in a group with missing values it replaces them and not the
+largest values.) Rows with a missing group key are set to missing, as with
+groupby().transform.
+
+Usage:
+    df_wins = winsorize(df, Comp_ratio_list + Control_list, by='fyear')
+    winsorize(df, ['sale', 'at'], limits=(0.01, 0.01), inplace=True)
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def _counts(limit, n, inclusive):
+    if not limit:
+        return np.zeros_like(n)
+    if inclusive:
+        return (limit * n).astype('int64')
+    return np.round(limit * n).astype('int64')
+
+
+def winsorizeBlock(block, codes, groups, limits=(0.01, 0.01), inclusive=(True, True)):
+    """
+    Winsorize the columns of the float64 array 'block' (rows x columns) in
+    place, within the groups 'codes' (0 to groups - 1 per row).
+    """
+    lower, upper = limits
+    for limit in limits:
+        if limit is not None and not 0 <= limit <= 1:
+            raise ValueError('The proportions to cut should be between 0 and 1 (got %s)' % limit)
+    if not len(block):
+        return block
+
+    # the rows of each group together, one contiguous column after the other
+    order = np.argsort(codes, kind='stable')
+    grouped = np.asfortranarray(block[order])
+    bounds = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=groups))])
+
+    low = np.full((groups, block.shape[1]), np.nan)
+    high = np.full((groups, block.shape[1]), np.nan)
+    columns = np.arange(block.shape[1])
+    for g in range(groups):
+        values = np.sort(grouped[bounds[g]:bounds[g + 1]], axis=0) # missing last
+        n = len(values) - np.isnan(values).sum(axis=0)
+        last = np.maximum(n - 1, 0)
+        if len(values):
+            if lower is not None:
+                low[g] = values[np.minimum(_counts(lower, n, inclusive[0]), last), columns]
+            if upper is not None:
+                high[g] = values[np.maximum(last - _counts(upper, n, inclusive[1]), 0), columns]
+
+    keep = ~np.isnan(block)
+    if lower is not None:
+        np.maximum(block, low[codes], out=block, where=keep)
+    if upper is not None:
+        np.minimum(block, high[codes], out=block, where=keep)
+    return block
+
+
+def winsorize(data, columns, by=None, limits=(0.01, 0.01), inclusive=(True, True), inplace=False):
+    """
+    'data' with the 'columns' winsorized within the groups of 'by' (a column
+    name, a list of names or an array; default: all rows in one group).
+    'limits' (lower, upper) are the proportions cut at each end, None for no
+    cut. With 'inplace', 'data' itself is changed.
+    """
+    columns = list(columns)
+    if by is None:
+        codes = np.zeros(len(data), dtype='int64')
+    elif isinstance(by, (str, list)):
+        codes = data.groupby(by, sort=False).ngroup().fillna(-1).to_numpy(dtype='int64')
+    else:
+        codes = pd.factorize(np.asarray(by))[0]
+    keyed = codes >= 0
+    groups = int(codes.max()) + 1 if len(codes) else 0
+
+    block = data[columns].to_numpy(dtype='float64', na_value=np.nan, copy=True)
+    block[~keyed] = np.nan
+    if keyed.all():
+        winsorizeBlock(block, codes, groups, limits, inclusive)
+    else:
+        block[keyed] = winsorizeBlock(block[keyed], codes[keyed], groups, limits, inclusive)
+
+    if not inplace:
+        data = data.copy(deep=False) # the columns below are replaced, not written to
+    for j, c in enumerate(columns):
+        if pd.api.types.is_integer_dtype(data[c].dtype) and keyed.all():
+            data[c] = block[:, j].astype(data[c].dtype) # the cutoffs are values of the column
+        else:
+            data[c] = block[:, j]
+    return data
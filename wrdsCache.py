@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Pak Shing Ho
+
+A local cache for WRDS extractions.
+
+CachedConnection wraps wrds.Connection(). Each conn.raw_sql(...) result is
+stored as a Parquet file (typed, columnar) in 'cache_dir', keyed by a hash of
+the normalized SQL text, and later calls with the same query read the file
+instead of re-pulling the data. The SQL of each entry is kept next to it in a
+'.sql' file.
+
+Entries are only dropped explicitly:
+    conn.invalidate(sql)             # one query
+    conn.invalidate(table='crsp.msf') # every query mentioning a table
+    conn.invalidate()                # everything
+
+Replay mode (replay=True, or environment variable WRDS_REPLAY=1) never opens
+a WRDS connection: cached queries are served from disk and any other query
+raises KeyError. This runs the whole pipeline offline from an earlier run.
+
+Usage:
+    conn = CachedConnection()
+    _kld1 = conn.raw_sql("select ticker, cusip, companyname, year from kld.history")
+"""
+
+import hashlib
+import json
+import os
+import re
+
+import pandas as pd
+
+
+def normalizeSql(sql):
+    """
+    Collapse all whitespace so that re-indented queries share one cache entry.
+    """
+    return re.sub(r'\s+', ' ', sql).strip().rstrip(';').strip()
+
+
+def sqlKey(sql, **kwargs):
+    text = normalizeSql(sql)
+    if kwargs:
+        text += json.dumps(kwargs, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:32]
+
+
+class CachedConnection:
+
+    def __init__(self, cache_dir='wrds_cache', replay=None, **wrds_kwargs):
+        if replay is None:
+            replay = os.environ.get('WRDS_REPLAY', '0') not in ('', '0')
+        self.cache_dir = cache_dir
+        self.replay = replay
+        self.wrds_kwargs = wrds_kwargs
+        self._conn = None
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @property
+    def conn(self):
+        """
+        The underlying wrds.Connection(), only opened on the first cache miss.
+        """
+        if self.replay:
+            raise RuntimeError('No WRDS connection in replay mode')
+        if self._conn is None:
+            import wrds
+            self._conn = wrds.Connection(**self.wrds_kwargs)
+        return self._conn
+
+    def _path(self, key, ext='.parquet'):
+        return os.path.join(self.cache_dir, key + ext)
+
+    def raw_sql(self, sql, **kwargs):
+        key = sqlKey(sql, **kwargs)
+        path = self._path(key)
+        if os.path.exists(path):
+            return pd.read_parquet(path)
+        if self.replay:
+            raise KeyError('Query not cached, cannot replay:\n' + normalizeSql(sql))
+
+        data = self.conn.raw_sql(sql, **kwargs)
+        data.to_parquet(path + '.tmp', index=False)
+        os.replace(path + '.tmp', path)
+        with open(self._path(key, '.sql'), 'w') as f:
+            f.write(normalizeSql(sql) + '\n')
+        return data
+
+    def cached(self, sql, **kwargs):
+        return os.path.exists(self._path(sqlKey(sql, **kwargs)))
+
+    def invalidate(self, sql=None, table=None, **kwargs):
+        """
+        Drop the entry of one query, of every query mentioning 'table', or
+        (no arguments) every entry. Returns the number of dropped entries.
+        """
+        if sql is not None:
+            keys = [sqlKey(sql, **kwargs)]
+        else:
+            keys = [f[:-4] for f in os.listdir(self.cache_dir) if f.endswith('.sql')]
+            if table is not None:
+                pattern = re.compile(r'\b' + re.escape(table) + r'\b', re.IGNORECASE)
+                keys = [k for k in keys
+                        if pattern.search(open(self._path(k, '.sql')).read())]
+        dropped = 0
+        for k in keys:
+            for ext in ('.parquet', '.sql'):
+                if os.path.exists(self._path(k, ext)):
+                    os.remove(self._path(k, ext))
+                    dropped += ext == '.parquet'
+        return dropped
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def __getattr__(self, name):
+        # describe_table, get_table, list_tables, ... go to WRDS directly
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.conn, name)
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Pak Shing Ho
+
+Concurrent WRDS extraction over a bounded pool of connections.
+
+The scripts pull kld.history, crsp.stocknames (twice), the CCM link and funda
+one query after another over one connection, so the extraction takes the sum
+of the query times, mostly spent waiting on the WRDS server. extractTables
+runs independent queries at the same time in threads, over at most
+'connections' connections opened by 'connect()' as they are needed. A query
+that fails is retried on a new connection after a pause (backoff, 2*backoff,
+... seconds); the other queries keep running. Identical queries (up to
+whitespace) run once.
+
+With CachedConnections ('wrdsCache.py') each result is written to the query
+cache as soon as it arrives, and cached queries do not open a connection.
+warmCache pulls the queries missing from the cache of a CachedConnection
+this way without keeping the results, so that the conn.raw_sql calls of a
+script then read them from disk. extractTables returns the results, with
+the compact dtypes of 'frameSchema.py'.
+
+Any object with raw_sql can be the connection, e.g. a SyntheticConnection
+('syntheticData.py') or a SqlBackend ('sqlBackend.py'), to run the
+extraction offline.
+
+Usage:
+    tables = extractTables({'kld_raw': (KLD_SQL, 'kld.history'),
+                            'crsp_cusip_raw': (CRSP_CUSIP_SQL, 'crsp.stocknames')},
+                           connect=CachedConnection, connections=4)
+    tables = extractTables(queries, connect=lambda: SyntheticConnection(synthetic))
+    warmCache(conn, [KLD_SQL, CRSP_CUSIP_SQL, CRSP_TICKER_SQL])
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+
+from wrdsCache import CachedConnection, normalizeSql
+from frameSchema import compactFrame
+
+
+class ConnectionPool:
+    """
+    At most 'size' connections opened by 'connect()' on first use, each lent
+    to one thread at a time. A connection whose query failed is closed and
+    replaced by a new one.
+    """
+
+    def __init__(self, connect, size=4):
+        self.connect = connect
+        self.size = size
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = queue.LifoQueue()
+        self.opened = 0
+
+    @contextmanager
+    def connection(self):
+        self._slots.acquire()
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self.connect()
+                self.opened += 1
+            try:
+                yield conn
+            except BaseException:
+                _close(conn)
+                raise
+            self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        while not self._idle.empty():
+            _close(self._idle.get_nowait())
+
+
+def _close(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+def _pull(pool, sql, retries=2, backoff=1.0, refresh=False):
+    """
+    conn.raw_sql(sql) on a connection of 'pool', retried 'retries' times.
+    """
+    for attempt in range(retries + 1):
+        replay = False
+        try:
+            with pool.connection() as conn:
+                replay = getattr(conn, 'replay', False)
+                if refresh and hasattr(conn, 'invalidate'):
+                    conn.invalidate(sql)
+                return conn.raw_sql(sql)
+        except Exception as error:
+            # a query not cached in replay mode (KeyError) will not come on a retry
+            if attempt == retries or (replay and isinstance(error, KeyError)):
+                raise
+            wait = backoff * 2 ** attempt
+            print('Query failed (%s: %s), retry %d of %d in %.1f s:\n%s'
+                  % (type(error).__name__, error, attempt + 1, retries, wait, normalizeSql(sql)[:200]))
+            time.sleep(wait)
+
+
+def _runQueries(queries, connect, connections, retries, backoff, refresh, handle):
+    """
+    {normalized SQL: handle(data, table)} of the distinct 'queries'
+    ({name: (sql, table)}), pulled over a pool of 'connections'.
+    """
+    distinct = {}
+    for name, (sql, table) in queries.items():
+        key = normalizeSql(sql)
+        sql, table, forced = distinct.get(key, (sql, table, False))
+        distinct[key] = (sql, table, forced or name in refresh)
+
+    pool = ConnectionPool(connect, connections)
+    results, seconds, errors = {}, {}, {}
+
+    def pull(key):
+        sql, table, forced = distinct[key]
+        start = time.time()
+        result = handle(_pull(pool, sql, retries, backoff, forced), table)
+        seconds[key] = time.time() - start
+        return result
+
+    start_time = time.time()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(connections, len(distinct)))) as executor:
+            futures = {executor.submit(pull, key): key for key in distinct}
+            for future in as_completed(futures):
+                key = futures[future]
+                try:
+                    results[key] = future.result()
+                except Exception as error:
+                    errors[key] = error
+                    print('Query failed after %d retries (%s: %s):\n%s'
+                          % (retries, type(error).__name__, error, key[:200]))
+    finally:
+        pool.close()
+
+    print('Extracted %d queries in %.1f s (%.1f s one after another), %d connections opened'
+          % (len(results), time.time() - start_time, sum(seconds.values()), pool.opened))
+    if errors:
+        raise next(iter(errors.values()))
+    return results
+
+
+def extractTables(queries, connect, connections=4, retries=2, backoff=1.0, compact=True, refresh=()):
+    """
+    Run 'queries' ({name: sql, or (sql, table)}) at the same time over at
+    most 'connections' connections opened by 'connect()'. Returns {name:
+    DataFrame}, with compact dtypes if 'compact'. The queries of the names
+    in 'refresh' are dropped from the cache first. A query that still fails
+    after 'retries' retries raises its error once the others are done.
+    """
+    queries = {name: q if isinstance(q, tuple) else (q, name) for name, q in queries.items()}
+
+    def handle(data, table):
+        return compactFrame(data, table) if compact else data
+
+    results = _runQueries(queries, connect, connections, retries, backoff, set(refresh), handle)
+    tables, seen = {}, set()
+    for name, (sql, table) in queries.items():
+        key = normalizeSql(sql)
+        tables[name] = results[key].copy() if key in seen else results[key]
+        seen.add(key)
+    return tables
+
+
+def warmCache(conn, queries, connections=4, retries=2, backoff=1.0):
+    """
+    Pull the 'queries' (SQL texts) not yet in the cache of 'conn', a
+    CachedConnection, at the same time over at most 'connections' new
+    connections, writing them to the cache without keeping them. Returns the
+    number of queries pulled. Nothing is pulled in replay mode.
+    """
+    missing = [sql for sql in queries if not conn.cached(sql)]
+    if conn.replay or not missing:
+        return 0
+
+    def connect():
+        return CachedConnection(conn.cache_dir, replay=False, **conn.wrds_kwargs)
+
+    results = _runQueries({i: (sql, '') for i, sql in enumerate(missing)}, connect, connections,
+                          retries, backoff, set(), lambda data, table: len(data))
+    return len(results)
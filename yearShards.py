@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Pak Shing Ho
+
+Year-sharded merges for the later steps of 'KLD_CRSP_Link.py' and
+'KLD_Compustat_Link.py'.
+
+Once the KLD-CRSP link candidates are formed, the msf merge, the CCM date
+match and the funda (gvkey, fyear) merge only ever match rows of the same
+year. mergeByYear splits both sides by year, merges the years over a process
+pool and puts the rows back in the order of the serial merge, so that
+    mergeByYear(linked3, ccm_link, 'date', on=['permno', 'date'])
+equals
+    linked3.merge(ccm_link, on=['permno', 'date'])
+row for row. The merge keys must determine the year (a date, a month, or a
+year column itself), otherwise matches across years are lost.
+
+The years are merged over the forked process pool of 'parallel.py', and the
+rows are put back in order as there.
+"""
+
+import pandas as pd
+
+from parallel import mapTasks, numberRows, concatInOrder # forked pool, serial merge order
+
+
+# Shards of the running mergeByYear, inherited by the forked workers so that
+# the inputs are not pickled
+_SHARDS = {}
+
+
+def shardYears(series):
+    """
+    Year of each row from a date, month (period) or year column.
+    Missing values are year -1.
+    """
+    if pd.api.types.is_datetime64_any_dtype(series) or pd.api.types.is_period_dtype(series):
+        years = series.dt.year
+    else:
+        years = pd.to_numeric(series.astype(object), errors='coerce')
+    return years.fillna(-1).astype('int64').to_numpy()
+
+
+def _mergeShard(year):
+    left, right, kwargs = _SHARDS[year]
+    return left.merge(right, **kwargs)
+
+
+def mergeByYear(left, right, left_year, right_year=None, n_jobs=None, **kwargs):
+    """
+    Same rows, in the same order, as the inner merge
+        left.merge(right, **kwargs)
+    computed year by year over 'n_jobs' processes (default: all cores).
+    'left_year' and 'right_year' (default: 'left_year') are the columns giving
+    the year of each row.
+    """
+    if kwargs.get('how', 'inner') != 'inner':
+        raise ValueError('mergeByYear only supports inner merges')
+    if right_year is None:
+        right_year = left_year
+    on = kwargs.get('left_on', kwargs.get('on'))
+
+    left_years, right_years = shardYears(left[left_year]), shardYears(right[right_year])
+    left = numberRows(left, on)
+    left_groups = pd.Series(left_years).groupby(left_years).indices
+    right_groups = pd.Series(right_years).groupby(right_years).indices
+    years = sorted(set(left_groups) & set(right_groups))
+
+    _SHARDS.clear()
+    for year in years:
+        _SHARDS[year] = (left.take(left_groups[year]), right.take(right_groups[year]), kwargs)
+
+    try:
+        merged = mapTasks(_mergeShard, years, n_jobs)
+    finally:
+        _SHARDS.clear()
+
+    if not merged:
+        # no common year: pandas orders the columns of a merge of two empty
+        # frames differently, so only the right side is emptied
+        merged = [left.merge(right.iloc[0:0], **kwargs)]
+    return concatInOrder(merged)